@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+"""Run FreeSurfer recon-all over a rawdata folder with an adaptive job scheduler.
+
+recon_all.sh used to start a fixed ``QUEUE_SIZE`` subjects with a fixed
+``THREADS`` each, which leaves cores idle while the last subjects finish and
+can run out of memory when every job reaches its peak at once. This scheduler
+instead:
+
+- runs each subject as three recon-all invocations (``-autorecon1``,
+  ``-autorecon2``, ``-autorecon3``) and decides the OpenMP threads of each one
+  when it starts, from the cores that are free and the number of jobs waiting;
+- admits a stage only while its expected peak memory fits in the available
+  RAM, using the peak resident memory and CPU use measured for each stage on
+  earlier subjects (kept in ``<derivs>/.recon_scheduler/profile.json``);
+- starts the largest T1 images first, so the longest runs do not end up alone
+  at the end of the batch;
+- resumes instead of deleting: subjects with ``recon-all.done`` and their stats
+  files are skipped, a subject whose later stage failed or was interrupted
+  restarts from the stage after its last completed one, and a folder that
+  cannot be resumed (no imported T1) is moved aside rather than removed.
+
+Stage progress is recorded in ``<derivs>/.recon_scheduler/state.json`` and each
+stage is logged to ``<derivs>/.recon_scheduler/logs/<subject>.<stage>.log``.
+Usage::
+
+    python Step_1_Preprocessing/recon_all_scheduler.py \\
+      --rawdata /path/to/rawdata \\
+      --derivs /path/to/derivatives \\
+      --dry-run
+"""
+
+from __future__ import annotations
+
+import argparse
+import heapq
+import json
+import math
+import os
+import shutil
+import signal
+import statistics
+import subprocess
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any
+
+
+STAGES = ["autorecon1", "autorecon2", "autorecon3"]
+# Files written at the end of each stage; used to place subjects without scheduler state.
+STAGE_MARKERS = {
+    "autorecon1": ["mri/brainmask.mgz"],
+    "autorecon2": ["mri/wm.mgz", "surf/lh.white", "surf/rh.white"],
+    "autorecon3": ["stats/aseg.stats", "stats/lh.aparc.stats", "stats/rh.aparc.stats"],
+}
+# Starting estimates per stage until measurements exist: peak GB and useful threads.
+DEFAULT_PROFILE = {
+    "autorecon1": {"mem_gb": 2.0, "threads": 2},
+    "autorecon2": {"mem_gb": 4.0, "threads": 8},
+    "autorecon3": {"mem_gb": 3.0, "threads": 8},
+}
+STATE_DIR = ".recon_scheduler"
+KEEP_SAMPLES = 20
+MEMORY_MARGIN = 1.2
+# A stage that keeps at least this share of its threads busy is given more threads.
+SCALING_EFFICIENCY = 0.75
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run recon-all on every subject with adaptive concurrency and resumable stages.")
+    parser.add_argument("--rawdata", required=True, help="Folder containing one folder per subject.")
+    parser.add_argument("--derivs", required=True, help="FreeSurfer SUBJECTS_DIR for the outputs.")
+    parser.add_argument("--subject-pattern", default="sub-*", help="Glob for subject folders under --rawdata. Default: sub-*.")
+    parser.add_argument("--t1-pattern", default="*_T1w.nii.gz", help="Glob for the T1 image inside a subject folder. Default: *_T1w.nii.gz.")
+    parser.add_argument("--cores", type=int, help="Cores to use. Default: the cores this process may run on.")
+    parser.add_argument("--memory-gb", type=float, help="Memory to use. Default: the memory available at start.")
+    parser.add_argument("--reserve-gb", type=float, default=2.0, help="Memory left free for the system. Default: 2.")
+    parser.add_argument("--max-jobs", type=int, help="Most recon-all jobs at once. Default: no limit beyond cores and memory.")
+    parser.add_argument("--max-threads", type=int, default=8, help="Most OpenMP threads per job. Default: 8.")
+    parser.add_argument("--poll", type=float, default=10.0, help="Seconds between resource checks. Default: 10.")
+    parser.add_argument("--recon-args", nargs=argparse.REMAINDER, default=[], help="Extra recon-all arguments, e.g. -3T. Must come last.")
+    parser.add_argument("--dry-run", action="store_true", help="Print each subject's next stage and the first launch plan.")
+    args = parser.parse_args()
+    if args.max_threads < 1 or (args.max_jobs is not None and args.max_jobs < 1):
+        parser.error("--max-threads and --max-jobs must be at least 1")
+    return args
+
+
+def available_cores() -> int:
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def available_memory_gb() -> float:
+    """MemAvailable on Linux, else physical memory."""
+    meminfo = Path("/proc/meminfo")
+    if meminfo.is_file():
+        for line in meminfo.read_text().splitlines():
+            if line.startswith("MemAvailable:"):
+                return int(line.split()[1]) / 1024**2
+    return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / 1024**3
+
+
+def group_usage() -> dict[int, tuple[float, float]]:
+    """Resident GB and CPU seconds summed by process group, from /proc (empty elsewhere)."""
+    usage: dict[int, list[float]] = {}
+    page_gb = os.sysconf("SC_PAGE_SIZE") / 1024**3
+    ticks = os.sysconf("SC_CLK_TCK")
+    proc = Path("/proc")
+    if not proc.is_dir():
+        return {}
+    for entry in proc.iterdir():
+        if not entry.name.isdigit():
+            continue
+        try:
+            text = (entry / "stat").read_text()
+        except OSError:
+            continue
+        # Fields after the parenthesised command: state ppid pgrp ...
+        fields = text[text.rindex(")") + 2 :].split()
+        pgrp = int(fields[2])
+        cpu = sum(int(value) for value in fields[11:15]) / ticks
+        total = usage.setdefault(pgrp, [0.0, 0.0])
+        total[0] += int(fields[21]) * page_gb
+        total[1] += cpu
+    return {pgrp: (rss, cpu) for pgrp, (rss, cpu) in usage.items()}
+
+
+class StageProfile:
+    """Measured peak memory and CPU use of each stage, persisted between runs."""
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.samples: dict[str, list[dict[str, float]]] = {stage: [] for stage in STAGES}
+        if path.is_file():
+            self.samples.update(json.loads(path.read_text(encoding="utf-8")))
+
+    def record(self, stage: str, threads: int, peak_gb: float, cpu_seconds: float, wall_seconds: float) -> None:
+        self.samples[stage] = [
+            *self.samples[stage][-(KEEP_SAMPLES - 1) :],
+            {"threads": threads, "peak_gb": peak_gb, "cpu_seconds": cpu_seconds, "wall_seconds": wall_seconds},
+        ]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.path.write_text(json.dumps(self.samples, indent=1) + "\n", encoding="utf-8")
+
+    def mem_gb(self, stage: str) -> float:
+        peaks = [sample["peak_gb"] for sample in self.samples[stage] if sample["peak_gb"] > 0]
+        return max(peaks) * MEMORY_MARGIN if peaks else DEFAULT_PROFILE[stage]["mem_gb"]
+
+    def threads(self, stage: str, max_threads: int) -> int:
+        """Threads worth giving the stage: fewer if earlier runs left their threads idle."""
+        runs = [
+            (sample["cpu_seconds"] / sample["wall_seconds"], sample["threads"])
+            for sample in self.samples[stage]
+            if sample["wall_seconds"] > 0 and sample["cpu_seconds"] > 0 and sample["threads"] > 0
+        ]
+        if not runs:
+            return min(DEFAULT_PROFILE[stage]["threads"], max_threads)
+        if statistics.median(busy / threads for busy, threads in runs) >= SCALING_EFFICIENCY:
+            return min(max_threads, 2 * max(threads for _, threads in runs))
+        return max(1, min(max_threads, math.ceil(statistics.median(busy for busy, _ in runs))))
+
+
+@dataclass(order=True)
+class Pending:
+    priority: tuple[int, str]
+    subject: str = field(compare=False)
+    stage: str = field(compare=False)
+
+
+@dataclass
+class Job:
+    subject: str
+    stage: str
+    threads: int
+    mem_gb: float
+    process: subprocess.Popen
+    log: Any
+    started: float
+    priority: tuple[int, str]
+    peak_gb: float = 0.0
+    cpu_seconds: float = 0.0
+
+
+def find_t1(subject_dir: Path, pattern: str) -> Path | None:
+    matches = sorted(path for path in subject_dir.rglob(pattern) if path.is_file())
+    return matches[0] if matches else None
+
+
+def markers_present(subject_out: Path, stage: str) -> bool:
+    return all((subject_out / marker).exists() for marker in STAGE_MARKERS[stage])
+
+
+def completed_stages(subject_out: Path, recorded: list[str]) -> list[str]:
+    """Stages that need not run again.
+
+    Stages recorded by the scheduler count while their marker files exist.
+    Folders from other runs count as finished when ``recon-all.done`` and the
+    final stats exist, and as past autorecon1 when the brain mask exists.
+    """
+    if not subject_out.is_dir():
+        return []
+    done = [stage for stage in STAGES if stage in recorded and markers_present(subject_out, stage)]
+    if done == STAGES[: len(done)] and done:
+        return done
+    if (subject_out / "scripts" / "recon-all.done").is_file() and markers_present(subject_out, "autorecon3"):
+        return list(STAGES)
+    if markers_present(subject_out, "autorecon1"):
+        return ["autorecon1"]
+    return []
+
+
+def recon_command(subject: str, stage: str, derivs: Path, threads: int, t1: Path | None, extra: list[str]) -> list[str]:
+    command = ["recon-all", "-s", subject, "-sd", str(derivs), f"-{stage}", "-no-isrunning"]
+    if t1 is not None:
+        command += ["-i", str(t1)]
+    if stage != "autorecon1":
+        command += ["-parallel"]
+    return command + ["-openmp", str(threads), *extra]
+
+
+class Scheduler:
+    def __init__(self, args: argparse.Namespace) -> None:
+        self.args = args
+        self.rawdata = Path(args.rawdata).resolve()
+        self.derivs = Path(args.derivs).resolve()
+        self.state_dir = self.derivs / STATE_DIR
+        self.state_path = self.state_dir / "state.json"
+        self.state: dict[str, dict[str, Any]] = {}
+        if self.state_path.is_file():
+            self.state = json.loads(self.state_path.read_text(encoding="utf-8"))
+        self.profile = StageProfile(self.state_dir / "profile.json")
+        self.cores = args.cores or available_cores()
+        self.memory_gb = args.memory_gb or max(available_memory_gb() - args.reserve_gb, 1.0)
+        self.queue: list[Pending] = []
+        self.jobs: list[Job] = []
+        self.t1: dict[str, Path] = {}
+        self.failed: dict[str, str] = {}
+        self.finished = 0
+
+    def save_state(self) -> None:
+        self.state_dir.mkdir(parents=True, exist_ok=True)
+        partial = self.state_path.with_suffix(".tmp")
+        partial.write_text(json.dumps(self.state, indent=1, sort_keys=True) + "\n", encoding="utf-8")
+        os.replace(partial, self.state_path)
+
+    def discover(self) -> list[tuple[str, int, str | None]]:
+        """Queue every unfinished subject at its next stage, largest T1 first; returns (subject, bytes, next stage)."""
+        plan = []
+        for subject_dir in sorted(self.rawdata.glob(self.args.subject_pattern)):
+            if not subject_dir.is_dir():
+                continue
+            subject = subject_dir.name
+            t1 = find_t1(subject_dir, self.args.t1_pattern)
+            if t1 is None:
+                print(f"{subject}: no T1 matching {self.args.t1_pattern}, skipping")
+                continue
+            self.t1[subject] = t1
+            recorded = self.state.get(subject, {}).get("completed", [])
+            done = completed_stages(self.derivs / subject, recorded)
+            next_stage = STAGES[len(done)] if len(done) < len(STAGES) else None
+            size = t1.stat().st_size
+            plan.append((subject, size, next_stage))
+            self.state.setdefault(subject, {})["completed"] = done
+            if next_stage is not None:
+                heapq.heappush(self.queue, Pending((-size, subject), subject, next_stage))
+        return plan
+
+    def prepare_folder(self, subject: str) -> Path | None:
+        """The T1 to import, or None when the subject folder already holds it.
+
+        A folder without an imported T1 cannot be resumed and recon-all
+        refuses ``-i`` on an existing subject, so it is renamed and kept.
+        """
+        subject_out = self.derivs / subject
+        if (subject_out / "mri" / "orig" / "001.mgz").is_file():
+            return None
+        if subject_out.exists():
+            aside = subject_out.with_name(f"{subject}.incomplete-{time.strftime('%Y%m%d_%H%M%S')}")
+            subject_out.rename(aside)
+            print(f"{subject}: folder has no imported T1; moved it to {aside.name}")
+        return self.t1[subject]
+
+    def reserved(self) -> tuple[int, float]:
+        return sum(job.threads for job in self.jobs), sum(job.mem_gb for job in self.jobs)
+
+    def next_launch(self) -> tuple[int, float] | None:
+        """Threads and memory for the job at the head of the queue, or None if it must wait."""
+        if not self.queue or (self.args.max_jobs and len(self.jobs) >= self.args.max_jobs):
+            return None
+        stage = self.queue[0].stage
+        used_cores, used_gb = self.reserved()
+        free_cores = self.cores - used_cores
+        mem_gb = self.profile.mem_gb(stage)
+        free_gb = min(self.memory_gb - used_gb, available_memory_gb() - self.args.reserve_gb)
+        if free_cores < 1 or (mem_gb > free_gb and self.jobs):
+            return None
+        # Split the free cores between the jobs that can start now, so the
+        # last subjects of a batch get the cores the finished ones released.
+        fit = max(1, min(len(self.queue), int(free_gb // mem_gb) if mem_gb > 0 else len(self.queue)))
+        if self.args.max_jobs:
+            fit = min(fit, self.args.max_jobs - len(self.jobs))
+        threads = max(1, min(math.ceil(free_cores / fit), self.profile.threads(stage, self.args.max_threads)))
+        return threads, mem_gb
+
+    def launch(self, threads: int, mem_gb: float) -> None:
+        pending = heapq.heappop(self.queue)
+        subject, stage = pending.subject, pending.stage
+        t1 = self.prepare_folder(subject) if stage == "autorecon1" else None
+        command = recon_command(subject, stage, self.derivs, threads, t1, self.args.recon_args)
+        log_dir = self.state_dir / "logs"
+        log_dir.mkdir(parents=True, exist_ok=True)
+        log = (log_dir / f"{subject}.{stage}.log").open("w", encoding="utf-8")
+        log.write("$ " + " ".join(command) + "\n")
+        log.flush()
+        env = {**os.environ, "SUBJECTS_DIR": str(self.derivs), "OMP_NUM_THREADS": str(threads)}
+        process = subprocess.Popen(command, stdout=log, stderr=subprocess.STDOUT, env=env, start_new_session=True)
+        self.jobs.append(Job(subject, stage, threads, mem_gb, process, log, time.monotonic(), pending.priority))
+        print(f"[{time.strftime('%F %T')}] {subject}: {stage} started with {threads} thread(s), ~{mem_gb:.1f} GB")
+
+    def sample(self) -> None:
+        usage = group_usage()
+        for job in self.jobs:
+            rss, cpu = usage.get(job.process.pid, (0.0, 0.0))
+            job.peak_gb = max(job.peak_gb, rss)
+            job.cpu_seconds = max(job.cpu_seconds, cpu)
+
+    def reap(self) -> None:
+        for job in list(self.jobs):
+            pid, status, rusage = os.wait4(job.process.pid, os.WNOHANG)
+            if pid == 0:
+                continue
+            job.process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else -os.WTERMSIG(status)
+            job.log.close()
+            self.jobs.remove(job)
+            wall = time.monotonic() - job.started
+            cpu = max(job.cpu_seconds, rusage.ru_utime + rusage.ru_stime)
+            # ru_maxrss (KB on Linux) is the largest single process of the stage; it
+            # catches peaks between samples, while the samples cover the whole group.
+            job.peak_gb = max(job.peak_gb, rusage.ru_maxrss / 1024**2)
+            entry = self.state.setdefault(job.subject, {})
+            stamp = time.strftime("%F %T")
+            if job.process.returncode == 0:
+                self.profile.record(job.stage, job.threads, job.peak_gb, cpu, wall)
+                entry["completed"] = [stage for stage in STAGES if stage in entry.get("completed", []) or stage == job.stage]
+                entry.pop("failed", None)
+                print(f"[{stamp}] {job.subject}: {job.stage} finished in {wall / 60:.1f} min (peak {job.peak_gb:.1f} GB)")
+                index = STAGES.index(job.stage)
+                if index + 1 < len(STAGES):
+                    heapq.heappush(self.queue, Pending(job.priority, job.subject, STAGES[index + 1]))
+                else:
+                    self.finished += 1
+            else:
+                entry["failed"] = job.stage
+                self.failed[job.subject] = job.stage
+                log_path = self.state_dir / "logs" / f"{job.subject}.{job.stage}.log"
+                print(f"[{stamp}] {job.subject}: {job.stage} failed (exit code {job.process.returncode}); see {log_path}")
+            self.save_state()
+
+    def stop(self) -> None:
+        """Terminate running jobs; their stages are rerun from the start next time."""
+        for job in self.jobs:
+            try:
+                os.killpg(job.process.pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        for job in self.jobs:
+            job.process.wait()
+            job.log.close()
+            self.state.setdefault(job.subject, {})["failed"] = job.stage
+        self.save_state()
+
+    def run(self) -> None:
+        while self.queue or self.jobs:
+            self.reap()
+            while True:
+                plan = self.next_launch()
+                if plan is None:
+                    break
+                self.launch(*plan)
+            if self.jobs:
+                time.sleep(self.args.poll)
+                self.sample()
+
+
+def main() -> None:
+    args = parse_args()
+    scheduler = Scheduler(args)
+    if not scheduler.rawdata.is_dir():
+        raise SystemExit(f"Rawdata folder not found: {scheduler.rawdata}")
+    plan = scheduler.discover()
+    todo = [entry for entry in plan if entry[2] is not None]
+    print(
+        f"{len(plan)} subject(s), {len(plan) - len(todo)} already complete; "
+        f"{scheduler.cores} cores, {scheduler.memory_gb:.1f} GB for recon-all"
+    )
+    if args.dry_run:
+        for subject, size, stage in sorted(todo, key=lambda entry: -entry[1]):
+            print(f"  {subject:<24}{size / 1024**2:8.1f} MB  next: {stage}")
+        for stage in STAGES:
+            threads = scheduler.profile.threads(stage, args.max_threads)
+            print(f"  {stage}: up to {threads} thread(s), ~{scheduler.profile.mem_gb(stage):.1f} GB per job")
+        return
+    if not todo:
+        return
+    if shutil.which("recon-all") is None:
+        raise SystemExit("recon-all not in PATH; source FreeSurfer's SetUpFreeSurfer.sh first")
+    scheduler.derivs.mkdir(parents=True, exist_ok=True)
+    scheduler.save_state()
+    try:
+        scheduler.run()
+    except KeyboardInterrupt:
+        scheduler.stop()
+        raise SystemExit("Interrupted; rerun the same command to resume from the last completed stages")
+    print(f"Finished {scheduler.finished} subject(s). Outputs located in {scheduler.derivs}")
+    if scheduler.failed:
+        failed = ", ".join(f"{subject} ({stage})" for subject, stage in sorted(scheduler.failed.items()))
+        raise SystemExit(f"{len(scheduler.failed)} subject(s) failed: {failed}. Rerun to restart them from the failed stage.")
+
+
+if __name__ == "__main__":
+    main()
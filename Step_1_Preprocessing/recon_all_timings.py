@@ -0,0 +1,305 @@
+#!/usr/bin/env python3
+"""Per-stage wall time, CPU time and peak memory of recon-all runs.
+
+recon-all marks the start of every stage in ``scripts/recon-all.log`` and
+``scripts/recon-all-status.log`` with a ``#@# <stage> <date>`` line, and
+FreeSurfer's fs_time adds an ``@#@FSTIME`` line after each command with its
+elapsed (``e``), system (``S``) and user (``U``) seconds and its peak
+resident memory in KB (``M``). This script reads those logs for every subject
+under ``--derivs`` and writes one row per subject, recon-all invocation and
+stage:
+
+- ``wall_seconds``: time from the stage header to the next header, or to the
+  ``finished without error``/``exited with ERRORS`` line for the last stage.
+- ``cpu_seconds`` (``user_seconds`` + ``system_seconds``) and
+  ``peak_rss_mb``: summed and maximum over the stage's commands.
+- ``status``: ``ok``, ``error`` for the stage a failed invocation stopped in,
+  or ``running``.
+
+Subjects without ``recon-all.log`` fall back to the status log, which only
+gives wall times. The table is CSV, or Parquet when ``--output`` ends in
+``.parquet`` (needs pandas and pyarrow). A summary of the slowest stages and
+subjects is printed, and written with ``--summary-out``. Folders the
+scheduler moved aside as ``<subject>.incomplete-<timestamp>`` are skipped.
+Usage::
+
+    python Step_1_Preprocessing/recon_all_timings.py \\
+      --derivs /path/to/derivatives \\
+      --output /path/to/derivatives/recon_all_timings.csv \\
+      --summary-out /path/to/derivatives/recon_all_stage_summary.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import re
+import statistics
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Iterable
+
+
+COLUMNS = [
+    "subject",
+    "run",
+    "stage_index",
+    "stage",
+    "start",
+    "wall_seconds",
+    "cpu_seconds",
+    "user_seconds",
+    "system_seconds",
+    "peak_rss_mb",
+    "commands",
+    "status",
+]
+SUMMARY_COLUMNS = [
+    "stage",
+    "subjects",
+    "median_wall_seconds",
+    "p90_wall_seconds",
+    "total_wall_seconds",
+    "median_cpu_seconds",
+    "cpu_per_wall",
+    "max_peak_rss_mb",
+]
+DATE = r"(?:Mon|Tue|Wed|Thu|Fri|Sat|Sun) (\w{3}) +(\d{1,2}) (\d\d:\d\d:\d\d)(?: \S+)? (\d{4})"
+HEADER = re.compile(rf"^#@# (.+?) {DATE}\s*$")
+END = re.compile(rf"^recon-all .* (finished without error|exited with ERRORS) at {DATE}")
+FSTIME = re.compile(r"^@#@FSTIME\s+\S+\s+\S+\s+N\s+\d+\s+(.*)$")
+NEW_RUN = "New invocation of recon-all"
+INCOMPLETE = ".incomplete-"
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Tabulate per-stage time and memory of recon-all runs from their logs.")
+    parser.add_argument("--derivs", required=True, help="FreeSurfer SUBJECTS_DIR holding the subject folders.")
+    parser.add_argument("--pattern", default="sub-*", help="Glob for subject folders under --derivs. Default: sub-*.")
+    parser.add_argument("--output", required=True, help="Per-stage table, .csv or .parquet.")
+    parser.add_argument("--summary-out", help="Optional CSV with one summary row per stage.")
+    parser.add_argument("--top", type=int, default=10, help="Stages and subjects listed in the printed report. Default: 10.")
+    return parser.parse_args()
+
+
+def parse_date(month: str, day: str, clock: str, year: str) -> datetime:
+    return datetime.strptime(f"{year} {month} {day} {clock}", "%Y %b %d %H:%M:%S")
+
+
+def fstime_fields(rest: str) -> dict[str, str]:
+    """The ``key value`` pairs after ``N <args>`` on an FSTIME line."""
+    tokens = rest.split()
+    return {tokens[i]: tokens[i + 1] for i in range(0, len(tokens) - 1, 2)}
+
+
+def new_stage(name: str, start: datetime) -> dict[str, Any]:
+    return {"stage": name, "start": start, "user": 0.0, "system": 0.0, "elapsed": 0.0, "rss_kb": 0, "commands": 0}
+
+
+def parse_log(lines: Iterable[str]) -> list[list[dict[str, Any]]]:
+    """Stages of each recon-all invocation in a recon-all.log or recon-all-status.log.
+
+    Each invocation is a list of stage dicts; the end time and status of an
+    invocation are stored on its last stage as ``end`` and ``status``.
+    """
+    runs: list[list[dict[str, Any]]] = [[]]
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith(NEW_RUN) and runs[-1]:
+            runs.append([])
+            continue
+        header = HEADER.match(line)
+        if header:
+            runs[-1].append(new_stage(header.group(1).strip(), parse_date(*header.groups()[1:])))
+            continue
+        stages = runs[-1]
+        if not stages:
+            continue
+        timing = FSTIME.match(line)
+        if timing:
+            fields = fstime_fields(timing.group(1))
+            stage = stages[-1]
+            try:
+                stage["user"] += float(fields.get("U", 0))
+                stage["system"] += float(fields.get("S", 0))
+                stage["elapsed"] += float(fields.get("e", 0))
+                stage["rss_kb"] = max(stage["rss_kb"], int(fields.get("M", 0)))
+            except ValueError:
+                continue
+            stage["commands"] += 1
+            continue
+        end = END.match(line)
+        if end:
+            stages[-1]["end"] = parse_date(*end.groups()[1:])
+            stages[-1]["status"] = "ok" if end.group(1) == "finished without error" else "error"
+    return [run for run in runs if run]
+
+
+def stage_rows(subject: str, runs: list[list[dict[str, Any]]], has_fstime: bool) -> list[dict[str, Any]]:
+    rows = []
+    for run_number, stages in enumerate(runs, start=1):
+        run_status = stages[-1].get("status", "running")
+        for index, stage in enumerate(stages):
+            if index + 1 < len(stages):
+                wall = (stages[index + 1]["start"] - stage["start"]).total_seconds()
+            elif "end" in stage:
+                wall = (stage["end"] - stage["start"]).total_seconds()
+            else:
+                wall = stage["elapsed"] if stage["commands"] else None
+            last = index + 1 == len(stages)
+            rows.append({
+                "subject": subject,
+                "run": run_number,
+                "stage_index": index + 1,
+                "stage": stage["stage"],
+                "start": stage["start"].isoformat(sep=" "),
+                "wall_seconds": wall,
+                "cpu_seconds": stage["user"] + stage["system"] if has_fstime else None,
+                "user_seconds": stage["user"] if has_fstime else None,
+                "system_seconds": stage["system"] if has_fstime else None,
+                "peak_rss_mb": stage["rss_kb"] / 1024 if has_fstime else None,
+                "commands": stage["commands"] if has_fstime else None,
+                "status": run_status if last else "ok",
+            })
+    return rows
+
+
+def subject_timings(subject_dir: Path) -> list[dict[str, Any]]:
+    """Rows for one subject; empty if it has neither log."""
+    scripts = subject_dir / "scripts"
+    for name, has_fstime in [("recon-all.log", True), ("recon-all-status.log", False)]:
+        path = scripts / name
+        if path.is_file():
+            with path.open(encoding="utf-8", errors="replace") as handle:
+                runs = parse_log(handle)
+            if runs:
+                return stage_rows(subject_dir.name, runs, has_fstime)
+    return []
+
+
+def collect(derivs: Path, pattern: str) -> tuple[list[dict[str, Any]], list[str]]:
+    """Rows for every subject folder, and the names of skipped moved-aside folders.
+
+    Folders renamed to ``<subject>.incomplete-<timestamp>`` by
+    recon_all_scheduler.py are left out so they are not counted as subjects.
+    """
+    rows = []
+    skipped = []
+    for subject_dir in sorted(derivs.glob(pattern)):
+        if not subject_dir.is_dir():
+            continue
+        if INCOMPLETE in subject_dir.name:
+            skipped.append(subject_dir.name)
+            continue
+        rows.extend(subject_timings(subject_dir))
+    return rows, skipped
+
+
+def write_rows(path: Path, rows: list[dict[str, Any]], columns: list[str]) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    if path.suffix == ".parquet":
+        try:
+            import pandas as pd
+
+            pd.DataFrame(rows, columns=columns).to_parquet(path, index=False)
+        except ImportError as exc:
+            raise SystemExit("Parquet output needs pandas and pyarrow; install them or write a .csv") from exc
+        return
+    with path.open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.DictWriter(handle, fieldnames=columns, lineterminator="\n")
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({key: cell(value) for key, value in row.items()})
+
+
+def cell(value: Any) -> Any:
+    if value is None:
+        return ""
+    return round(value, 3) if isinstance(value, float) else value
+
+
+def percentile(values: list[float], fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(fraction * (len(ordered) - 1))))]
+
+
+def stage_summary(rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """One row per stage name over completed stages, slowest total wall time first."""
+    by_stage: dict[str, list[dict[str, Any]]] = {}
+    for row in rows:
+        if row["status"] == "ok" and row["wall_seconds"] is not None:
+            by_stage.setdefault(row["stage"], []).append(row)
+    summary = []
+    for stage, group in by_stage.items():
+        walls = [row["wall_seconds"] for row in group]
+        timed = [row for row in group if row["cpu_seconds"] is not None]
+        cpus = [row["cpu_seconds"] for row in timed]
+        timed_wall = sum(row["wall_seconds"] for row in timed)
+        rss = [row["peak_rss_mb"] for row in group if row["peak_rss_mb"] is not None]
+        summary.append({
+            "stage": stage,
+            "subjects": len({row["subject"] for row in group}),
+            "median_wall_seconds": statistics.median(walls),
+            "p90_wall_seconds": percentile(walls, 0.9),
+            "total_wall_seconds": sum(walls),
+            "median_cpu_seconds": statistics.median(cpus) if cpus else None,
+            "cpu_per_wall": sum(cpus) / timed_wall if timed_wall > 0 else None,
+            "max_peak_rss_mb": max(rss) if rss else None,
+        })
+    return sorted(summary, key=lambda row: -row["total_wall_seconds"])
+
+
+def subject_summary(rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+    """Wall and CPU hours and peak memory per subject, slowest first."""
+    subjects: dict[str, dict[str, Any]] = {}
+    for row in rows:
+        entry = subjects.setdefault(row["subject"], {"subject": row["subject"], "wall": 0.0, "cpu": 0.0, "rss": 0.0, "errors": 0})
+        entry["wall"] += row["wall_seconds"] or 0.0
+        entry["cpu"] += row["cpu_seconds"] or 0.0
+        entry["rss"] = max(entry["rss"], row["peak_rss_mb"] or 0.0)
+        entry["errors"] += row["status"] == "error"
+    return sorted(subjects.values(), key=lambda entry: -entry["wall"])
+
+
+def report(rows: list[dict[str, Any]], stages: list[dict[str, Any]], top: int) -> str:
+    def fmt(value, scale: float = 1.0, digits: int = 2) -> str:
+        return "-" if value is None else f"{value / scale:.{digits}f}"
+
+    subjects = subject_summary(rows)
+    lines = [f"{len(subjects)} subject(s), {len(rows)} stage run(s)", "", "Slowest stages (minutes):"]
+    lines.append(f"  {'stage':<32}{'n':>5}{'median':>9}{'p90':>9}{'total h':>9}{'cpu/wall':>9}{'peak GB':>9}")
+    for row in stages[:top]:
+        lines.append(
+            f"  {row['stage'][:31]:<32}{row['subjects']:>5}{fmt(row['median_wall_seconds'], 60, 1):>9}"
+            f"{fmt(row['p90_wall_seconds'], 60, 1):>9}{fmt(row['total_wall_seconds'], 3600, 1):>9}"
+            f"{fmt(row['cpu_per_wall']):>9}{fmt(row['max_peak_rss_mb'], 1024):>9}"
+        )
+    lines += ["", "Slowest subjects:", f"  {'subject':<32}{'wall h':>9}{'cpu h':>9}{'peak GB':>9}{'errors':>8}"]
+    for entry in subjects[:top]:
+        lines.append(
+            f"  {entry['subject'][:31]:<32}{entry['wall'] / 3600:>9.2f}{entry['cpu'] / 3600:>9.2f}"
+            f"{entry['rss'] / 1024:>9.2f}{entry['errors']:>8}"
+        )
+    return "\n".join(lines)
+
+
+def main() -> None:
+    args = parse_args()
+    derivs = Path(args.derivs)
+    if not derivs.is_dir():
+        raise SystemExit(f"Derivatives folder not found: {derivs}")
+    rows, skipped = collect(derivs, args.pattern)
+    if skipped:
+        print(f"Skipped {len(skipped)} moved-aside folder(s): {', '.join(skipped)}")
+    if not rows:
+        raise SystemExit(f"No recon-all logs found under {derivs}/{args.pattern}/scripts")
+    write_rows(Path(args.output), rows, COLUMNS)
+    stages = stage_summary(rows)
+    if args.summary_out:
+        write_rows(Path(args.summary_out), stages, SUMMARY_COLUMNS)
+    print(report(rows, stages, args.top))
+    print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""Cache of fitted site adaptations for run_braincharts_normative_models.py.
+
+The per-site adjustment estimated from the healthy-control adaptation sheet
+only depends on the adaptation rows, the covariate and site settings and the
+model itself. It is stored under a hash of those inputs, so a run where only
+the test CSV changed reuses it and only predicts the test set.
+"""
+
+from __future__ import annotations
+
+import os
+from pathlib import Path
+
+from braincharts_blr import SiteAdaptation
+from braincharts_design import fingerprint
+
+
+def adaptation_key(
+    df_ad,
+    idp_ids: list[str],
+    cols_cov: list[str],
+    site_col: str,
+    sitenum_col: str,
+    site_ids_tr: list[str],
+    xmin: float,
+    xmax: float,
+    model_name: str,
+    model_fingerprint: str,
+) -> str:
+    """Hash every input that determines the fitted site adaptation."""
+    import pandas as pd
+
+    return fingerprint(
+        "site-adaptation",
+        model_name,
+        model_fingerprint,
+        list(site_ids_tr),
+        list(cols_cov),
+        float(xmin),
+        float(xmax),
+        list(idp_ids),
+        df_ad[cols_cov].to_numpy(dtype=float),
+        df_ad[site_col].astype(str).to_numpy(),
+        df_ad[sitenum_col].to_numpy(dtype=int),
+        df_ad[idp_ids].apply(pd.to_numeric, errors="coerce").to_numpy(dtype=float),
+    )
+
+
+def load_adaptation(cache_dir: Path, key: str, idps: list[str]) -> SiteAdaptation | None:
+    """Return the cached adaptation for ``key`` restricted to ``idps``, if any."""
+    import numpy as np
+
+    path = cache_dir / f"{key}.npz"
+    if not path.is_file():
+        return None
+    try:
+        with np.load(path, allow_pickle=False) as data:
+            cached = SiteAdaptation(
+                idps=[str(idp) for idp in data["idps"]],
+                sites=data["sites"],
+                counts=data["counts"],
+                residual_mean=data["residual_mean"],
+                residual_var=data["residual_var"],
+            )
+    except (OSError, KeyError, ValueError):
+        return None
+    if not set(idps) <= set(cached.idps):
+        return None
+    return cached.select(idps)
+
+
+def save_adaptation(cache_dir: Path, key: str, adaptation: SiteAdaptation) -> Path:
+    """Store ``adaptation`` under ``key`` and return the cache file path."""
+    import numpy as np
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    path = cache_dir / f"{key}.npz"
+    tmp_path = cache_dir / f"{key}.tmp.npz"
+    np.savez(
+        tmp_path,
+        idps=np.asarray(adaptation.idps, dtype=str),
+        sites=np.asarray(adaptation.sites, dtype=float),
+        counts=np.asarray(adaptation.counts, dtype=int),
+        residual_mean=np.asarray(adaptation.residual_mean, dtype=float),
+        residual_var=np.asarray(adaptation.residual_var, dtype=float),
+    )
+    os.replace(tmp_path, path)
+    return path
@@ -0,0 +1,340 @@
+"""In-memory BrainCharts BLR predictions.
+
+PCNtoolkit's ``normative.predict`` reads its covariates and responses from text
+files in the current working directory and writes its outputs back there. The
+functions below load a pickled BLR normative model from an IDP's ``Models``
+folder and reproduce the same prediction, site adaptation and z-score steps on
+NumPy arrays, without any file round trip or ``os.chdir``.
+
+``stack_models`` and ``batched_predict`` go one step further: because every
+BrainCharts IDP shares the same design matrix, the posterior weights,
+covariances, noise variances and warp parameters of all IDPs are stacked into
+arrays and the whole subjects x IDPs z-score matrix is computed at once.
+"""
+
+from __future__ import annotations
+
+import pickle
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Callable
+
+
+def load_normative_model(model_path: Path, inputsuffix: str = "estimate", fold: int = 0):
+    """Load the BLR normative model that ``predict(..., model_path=...)`` would use.
+
+    Only models estimated without input/output scaling are supported, which is
+    how the BrainCharts lifespan models were fitted.
+    """
+    import pandas as pd
+
+    meta_path = model_path / "meta_data.md"
+    if meta_path.is_file():
+        with meta_path.open("rb") as handle:
+            meta_data = pickle.load(handle)
+        for key in ("inscaler", "outscaler"):
+            if str(meta_data.get(key, "None")) != "None":
+                raise ValueError(f"{model_path} uses {key}={meta_data[key]!r}; only unscaled BLR models are supported in memory.")
+
+    suffix = "_" + inputsuffix.replace("_", "")
+    model_file = model_path / f"NM_{fold}_0{suffix}.pkl"
+    if not model_file.is_file():
+        raise FileNotFoundError(f"Normative model not found: {model_file}")
+    with model_file.open("rb") as handle:
+        nm = pd.read_pickle(handle)
+    if not hasattr(nm, "blr"):
+        raise ValueError(f"{model_file} is not a BLR normative model.")
+    return nm
+
+
+def warp_responses(nm, y):
+    """Map responses into the model's Gaussian space (a no-op without a warp)."""
+    warp = nm.blr.warp
+    if warp is None:
+        return y
+    return warp.f(y, nm.blr.hyp[1 : warp.get_n_params() + 1])
+
+
+def predict_idp(
+    nm,
+    x_te,
+    y_te,
+    x_ad=None,
+    y_ad=None,
+    sitenum_te=None,
+    sitenum_ad=None,
+) -> tuple[Any, Any, Any]:
+    """Return predictive mean, variance and z-scores for one IDP.
+
+    Passing the adaptation arrays applies the same per-site residual
+    adjustment as ``predict(..., adaptrespfile=..., adaptcovfile=...)``.
+    """
+    import numpy as np
+
+    x_te = np.asarray(x_te, dtype=float)
+    if x_te.ndim == 1:
+        x_te = x_te[:, np.newaxis]
+    y_te = np.asarray(y_te, dtype=float).reshape(-1)
+
+    kwargs: dict[str, Any] = {}
+    if y_ad is not None:
+        if x_ad is None or sitenum_ad is None or sitenum_te is None:
+            raise ValueError("Adaptation needs x_ad, y_ad, sitenum_ad and sitenum_te.")
+        # PCNtoolkit reads adaptrespfile as a column vector and the sitenum
+        # files as floats; pass the same shapes and dtypes so the per-site
+        # residual statistics match the file-based run exactly.
+        kwargs = {
+            "adaptresp": np.asarray(y_ad, dtype=float).reshape(-1, 1),
+            "adaptcov": np.asarray(x_ad, dtype=float),
+            "adaptvargroup": np.asarray(sitenum_ad, dtype=float),
+            "testvargroup": np.asarray(sitenum_te, dtype=float),
+        }
+
+    yhat, s2 = nm.predict(x_te, **kwargs)
+    yhat = np.asarray(yhat).reshape(-1)
+    s2 = np.asarray(s2).reshape(-1)
+    z = (warp_responses(nm, y_te) - yhat) / np.sqrt(s2)
+    return yhat, s2, z
+
+
+def _warp_sinarcsinh(y, params):
+    """WarpSinArcsinh.f for one parameter row per IDP (column of ``y``)."""
+    import numpy as np
+
+    epsilon = params[:, 0]
+    b = np.exp(params[:, 1])
+    a = -epsilon * b
+    return np.sinh(b * np.arcsinh(y) - a)
+
+
+# Closed forms of the PCNtoolkit warps used by the stacked kernel. Each entry is
+# checked against the model's own warp object when the models are stacked.
+_WARPS: dict[str, Callable[[Any, Any], Any]] = {
+    "WarpSinArcsinh": _warp_sinarcsinh,
+}
+
+
+@dataclass(frozen=True)
+class BLRStack:
+    """Posterior parameters of several BLR models that share one design matrix.
+
+    ``weights`` is (D, P), ``covariances`` is (P, D, D), ``noise_var`` is (P,)
+    and ``warp_params`` is (P, n_warp_params), with one IDP per column ``P``.
+    """
+
+    idps: list[str]
+    weights: Any
+    covariances: Any
+    noise_var: Any
+    warp_kind: str | None
+    warp_params: Any
+
+    def warp(self, y):
+        """Map an (N, P) response matrix into each model's Gaussian space."""
+        if self.warp_kind is None:
+            return y
+        return _WARPS[self.warp_kind](y, self.warp_params)
+
+    def select(self, idps: list[str]) -> BLRStack:
+        """Return the stack restricted to ``idps``, in that order."""
+        if list(idps) == self.idps:
+            return self
+        position = {idp: i for i, idp in enumerate(self.idps)}
+        columns = [position[idp] for idp in idps]
+        return BLRStack(
+            idps=list(idps),
+            weights=self.weights[:, columns],
+            covariances=self.covariances[columns],
+            noise_var=self.noise_var[columns],
+            warp_kind=self.warp_kind,
+            warp_params=self.warp_params[columns],
+        )
+
+
+def stack_models(idps: list[str], models: list) -> BLRStack:
+    """Stack loaded BLR normative models into a :class:`BLRStack`.
+
+    Only homoskedastic models without variance groups or a polynomial basis
+    expansion can be stacked, which covers the BrainCharts lifespan models.
+    """
+    import numpy as np
+    from scipy import linalg
+
+    if not models:
+        raise ValueError("No models to stack.")
+
+    weights = []
+    covariances = []
+    noise_var = []
+    warp_params = []
+    warp_kind: str | None = None
+    for position, (idp, nm) in enumerate(zip(idps, models)):
+        blr = nm.blr
+        if getattr(nm, "_model_order", 1) != 1:
+            raise ValueError(f"{idp}: models with a polynomial basis expansion cannot be stacked.")
+        if blr.var_groups is not None or getattr(blr, "hetero_var", False):
+            raise ValueError(f"{idp}: heteroskedastic models cannot be stacked.")
+
+        kind = None if blr.warp is None else type(blr.warp).__name__
+        if position == 0:
+            warp_kind = kind
+        elif kind != warp_kind:
+            raise ValueError(f"{idp}: warp {kind} differs from {warp_kind} used by {idps[0]}.")
+        if kind is not None and kind not in _WARPS:
+            raise ValueError(f"{idp}: warp {kind} is not supported by the stacked kernel.")
+
+        n_features = blr.m.shape[0]
+        weights.append(np.asarray(blr.m, dtype=float).reshape(-1))
+        covariance = linalg.solve(blr.A, np.eye(n_features), assume_a="pos")
+        covariances.append((covariance + covariance.T) / 2)
+        # The predictive variance at an all-zero design row is the noise
+        # variance; this keeps PCNtoolkit's own handling of warp_reparam.
+        _, s2_zero = blr.predict(blr.hyp, None, None, np.zeros((1, n_features)))
+        noise_var.append(float(np.asarray(s2_zero).reshape(-1)[0]))
+
+        if kind is None:
+            warp_params.append(np.zeros(0))
+        else:
+            params = np.asarray(blr.hyp[1 : blr.warp.get_n_params() + 1], dtype=float)
+            probe = np.linspace(-10.0, 10.0, 41)
+            expected = blr.warp.f(probe, params)
+            actual = _WARPS[kind](probe[:, np.newaxis], params[np.newaxis, :]).reshape(-1)
+            if not np.allclose(actual, expected, rtol=1e-12, atol=1e-12):
+                raise ValueError(f"{idp}: closed-form {kind} does not reproduce the model warp.")
+            warp_params.append(params)
+
+    return BLRStack(
+        idps=list(idps),
+        weights=np.column_stack(weights),
+        covariances=np.stack(covariances),
+        noise_var=np.asarray(noise_var),
+        warp_kind=warp_kind,
+        warp_params=np.vstack(warp_params),
+    )
+
+
+def _quadratic_forms(x, covariances, chunk_rows: int = 2048):
+    """Return x_n' C_p x_n for every row ``n`` of ``x`` and every IDP ``p``.
+
+    Columns that are zero for every row (e.g. dummies of sites not present)
+    contribute nothing and are dropped. The rest is one matrix product of the
+    pairwise column products with the matching upper-triangle covariances.
+    """
+    import numpy as np
+
+    active = np.flatnonzero(np.any(x != 0, axis=0))
+    x = x[:, active]
+    rows, cols = np.triu_indices(active.size)
+    coef = covariances[:, active[rows], active[cols]].T
+    coef = coef * np.where(rows == cols, 1.0, 2.0)[:, np.newaxis]
+
+    out = np.empty((x.shape[0], covariances.shape[0]))
+    for start in range(0, x.shape[0], chunk_rows):
+        block = x[start : start + chunk_rows]
+        out[start : start + chunk_rows] = (block[:, rows] * block[:, cols]) @ coef
+    return out
+
+
+@dataclass(frozen=True)
+class SiteAdaptation:
+    """Per-site residual statistics from the adaptation controls.
+
+    ``residual_mean`` and ``residual_var`` are (G, P) arrays for the G
+    adaptation sites in ``sites`` and the IDPs in ``idps``; ``counts`` holds
+    the number of adaptation rows per site.
+    """
+
+    idps: list[str]
+    sites: Any
+    counts: Any
+    residual_mean: Any
+    residual_var: Any
+
+    def select(self, idps: list[str]) -> SiteAdaptation:
+        """Return the statistics restricted to ``idps``, in that order."""
+        if list(idps) == self.idps:
+            return self
+        position = {idp: i for i, idp in enumerate(self.idps)}
+        columns = [position[idp] for idp in idps]
+        return SiteAdaptation(
+            idps=list(idps),
+            sites=self.sites,
+            counts=self.counts,
+            residual_mean=self.residual_mean[:, columns],
+            residual_var=self.residual_var[:, columns],
+        )
+
+
+def fit_site_adaptation(stack: BLRStack, x_ad, y_ad, sitenum_ad) -> SiteAdaptation:
+    """Estimate the per-site adjustment of ``BLR.predict_and_adjust`` for all IDPs.
+
+    ``y_ad`` holds one column per IDP in ``stack.idps`` order. PCNtoolkit
+    receives the adaptation responses as a column vector, so its residuals
+    cover every (prediction, response) pair of a site; the mean and variance
+    below are the closed forms of that all-pairs statistic.
+    """
+    import numpy as np
+
+    x_ad = np.asarray(x_ad, dtype=float)
+    sitenum_ad = np.asarray(sitenum_ad, dtype=float)
+    ref_ad = x_ad @ stack.weights
+    warped_ad = stack.warp(np.asarray(y_ad, dtype=float))
+
+    sites = np.unique(sitenum_ad)
+    counts = np.zeros(sites.size, dtype=int)
+    residual_mean = np.empty((sites.size, ref_ad.shape[1]))
+    residual_var = np.empty((sites.size, ref_ad.shape[1]))
+    for position, site in enumerate(sites):
+        idx_ad = sitenum_ad == site
+        counts[position] = int(np.sum(idx_ad))
+        residual_mean[position] = ref_ad[idx_ad].mean(axis=0) - warped_ad[idx_ad].mean(axis=0)
+        residual_var[position] = ref_ad[idx_ad].var(axis=0) + warped_ad[idx_ad].var(axis=0)
+    return SiteAdaptation(
+        idps=list(stack.idps),
+        sites=sites,
+        counts=counts,
+        residual_mean=residual_mean,
+        residual_var=residual_var,
+    )
+
+
+def batched_predict(
+    stack: BLRStack,
+    x_te,
+    y_te,
+    adaptation: SiteAdaptation | None = None,
+    sitenum_te=None,
+) -> tuple[Any, Any, Any]:
+    """Return (N, P) predictive means, variances and z-scores for all IDPs.
+
+    ``y_te`` holds one column per IDP in ``stack.idps`` order. With an
+    ``adaptation`` this follows ``BLR.predict_and_adjust``: each test site's
+    predictions are shifted by the mean adaptation residual and the variance
+    is replaced by the residual variance.
+    """
+    import numpy as np
+
+    x_te = np.asarray(x_te, dtype=float)
+    y_te = np.asarray(y_te, dtype=float)
+    yhat = x_te @ stack.weights
+
+    if adaptation is None:
+        s2 = _quadratic_forms(x_te, stack.covariances) + stack.noise_var[np.newaxis, :]
+    else:
+        if sitenum_te is None:
+            raise ValueError("Adaptation needs sitenum_te.")
+        if adaptation.idps != stack.idps:
+            raise ValueError("Adaptation statistics do not match the stacked IDPs.")
+        sitenum_te = np.asarray(sitenum_te, dtype=float)
+        position = {float(site): i for i, site in enumerate(adaptation.sites)}
+        s2 = np.empty_like(yhat)
+        for site in np.unique(sitenum_te):
+            row = position.get(float(site))
+            if row is None or adaptation.counts[row] < 2:
+                raise ValueError("Insufficient adaptation data to estimate variance")
+            idx_te = sitenum_te == site
+            yhat[idx_te] -= adaptation.residual_mean[row]
+            s2[idx_te] = adaptation.residual_var[row]
+
+    z = (stack.warp(y_te) - yhat) / np.sqrt(s2)
+    return yhat, s2, z
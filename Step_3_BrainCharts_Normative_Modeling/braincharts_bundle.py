@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Compile the BrainCharts IDP models into one memory-mappable bundle.
+
+Loading the lifespan model normally means unpickling one PCNtoolkit model per
+IDP and re-reading the site and phenotype lists. This script does that once and
+writes a bundle directory with the stacked BLR parameters as plain ``.npy``
+arrays plus an ``index.json`` holding the IDP order, training site IDs and a
+fingerprint of the source model files. run_braincharts_normative_models.py
+opens the bundle with ``--model-bundle`` and memory-maps the arrays.
+"""
+
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from pathlib import Path
+from typing import Any
+
+from braincharts_blr import BLRStack, load_normative_model, stack_models
+from braincharts_design import fingerprint
+from braincharts_docs import DEFAULT_PHENOTYPE_FILES, DEFAULT_SITE_ID_FILE, read_model_lists
+
+
+BUNDLE_FORMAT = 1
+INDEX_NAME = "index.json"
+ARRAY_NAMES = ("weights", "covariances", "noise_var", "warp_params")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compile BrainCharts IDP models into a memory-mappable bundle.")
+    parser.add_argument("--braincharts-root", required=True, help="Local clone of the braincharts repository.")
+    parser.add_argument("--output", required=True, help="Bundle directory to create.")
+    parser.add_argument("--model-name", default="lifespan_57K_82sites", help="BrainCharts model folder name.")
+    parser.add_argument("--site-id-file", default=DEFAULT_SITE_ID_FILE, help="Training site ID file in braincharts/docs.")
+    parser.add_argument(
+        "--phenotype-files",
+        nargs="+",
+        default=DEFAULT_PHENOTYPE_FILES,
+        help="Phenotype lists in braincharts/docs.",
+    )
+    return parser.parse_args()
+
+
+def source_fingerprint(model_dir: Path, idp_ids: list[str], site_ids: list[str]) -> str:
+    """Hash the IDP order, site IDs and size/mtime of every source model file."""
+    parts: list[Any] = [model_dir.name, list(idp_ids), list(site_ids)]
+    for idp in idp_ids:
+        models_path = model_dir / idp / "Models"
+        for path in sorted(models_path.glob("*")) if models_path.is_dir() else []:
+            stat = path.stat()
+            parts.append([idp, path.name, stat.st_size, stat.st_mtime_ns])
+    return fingerprint(*parts)
+
+
+def write_bundle(output: Path, stack: BLRStack, site_ids: list[str], metadata: dict[str, Any]) -> None:
+    """Write a stacked model and its index to ``output``."""
+    import numpy as np
+
+    output.mkdir(parents=True, exist_ok=True)
+    index_path = output / INDEX_NAME
+    if index_path.exists():
+        index_path.unlink()
+    for name in ARRAY_NAMES:
+        np.save(output / f"{name}.npy", np.ascontiguousarray(getattr(stack, name), dtype=float))
+    index = {
+        "format": BUNDLE_FORMAT,
+        **metadata,
+        "warp_kind": stack.warp_kind,
+        "idps": list(stack.idps),
+        "site_ids": list(site_ids),
+    }
+    # Written last so an interrupted compile never looks like a valid bundle.
+    index_path.write_text(json.dumps(index, indent=2) + "\n", encoding="utf-8")
+
+
+def load_bundle(path: Path) -> tuple[BLRStack, dict[str, Any]]:
+    """Open a bundle, memory-mapping its arrays; returns the stack and its index."""
+    import numpy as np
+
+    index_path = path / INDEX_NAME
+    if not index_path.is_file():
+        raise FileNotFoundError(f"Not a BrainCharts model bundle (missing {INDEX_NAME}): {path}")
+    index = json.loads(index_path.read_text(encoding="utf-8"))
+    if index.get("format") != BUNDLE_FORMAT:
+        raise ValueError(f"Unsupported bundle format {index.get('format')!r} in {path}; recompile it.")
+    arrays = {name: np.load(path / f"{name}.npy", mmap_mode="r") for name in ARRAY_NAMES}
+    stack = BLRStack(idps=list(index["idps"]), warp_kind=index["warp_kind"], **arrays)
+    return stack, index
+
+
+def compile_bundle(
+    braincharts_root: Path,
+    output: Path,
+    model_name: str,
+    site_id_file: str,
+    phenotype_files: list[str],
+) -> dict[str, Any]:
+    """Load every IDP model once, stack it and write the bundle."""
+    docs_dir = braincharts_root / "docs"
+    model_dir = braincharts_root / "models" / model_name
+    if not docs_dir.is_dir():
+        raise SystemExit(f"BrainCharts docs directory not found: {docs_dir}")
+    if not model_dir.is_dir():
+        raise SystemExit(f"BrainCharts model directory not found: {model_dir}")
+
+    site_ids, idp_ids = read_model_lists(docs_dir, site_id_file, phenotype_files)
+
+    models = []
+    for idp_num, idp in enumerate(idp_ids, start=1):
+        print(f"Loading IDP {idp_num}/{len(idp_ids)}: {idp}")
+        models.append(load_normative_model(model_dir / idp / "Models"))
+    stack = stack_models(idp_ids, models)
+
+    metadata = {
+        "model_name": model_name,
+        "site_id_file": site_id_file,
+        "phenotype_files": list(phenotype_files),
+        "source_fingerprint": source_fingerprint(model_dir, idp_ids, site_ids),
+    }
+    write_bundle(output, stack, site_ids, metadata)
+    return metadata
+
+
+def main() -> None:
+    args = parse_args()
+    braincharts_root = Path(args.braincharts_root).resolve()
+    sys.path.insert(0, str(braincharts_root))
+    try:
+        import numpy  # noqa: F401
+        import pcntoolkit.normative  # noqa: F401 - needed to unpickle the models
+    except ImportError as exc:
+        raise SystemExit(
+            "Missing Python dependency. Install the BrainCharts/PCNtoolkit environment "
+            "first, for example: pip install pcntoolkit==0.35"
+        ) from exc
+
+    output = Path(args.output).resolve()
+    compile_bundle(braincharts_root, output, args.model_name, args.site_id_file, args.phenotype_files)
+    print(f"Wrote model bundle: {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""Map FreeSurfer table headers to BrainCharts and PyBrainAge column names.
+
+``keys_lifespan57K_82sites.csv`` pairs each joined FreeSurfer header (as
+written by aparcstats2table/asegstats2table, for example
+``lh_G_and_S_cingul-Ant_thickness``) with the BrainCharts model header
+(``lh_G&S_cingul-Ant_thickness``). :class:`ColumnMap` compiles that dictionary
+together with the header canonicalisation rules into one lookup from canonical
+name to dictionary entry. The compiled map is saved next to the dictionary as
+``<dict>.colmap.json`` and reused until the dictionary changes.
+
+Tables are remapped column-wise: only the needed columns are read, and the
+output frame is assembled from the selected columns without copying them.
+Values are kept as the strings in the input file. Subcommands::
+
+    python braincharts_columns.py compile --dict keys_lifespan57K_82sites.csv
+    python braincharts_columns.py prepare --joined _dbg_joined_all.csv --dict keys_lifespan57K_82sites.csv \\
+      --metadata metadata.csv --outdir outputs
+    python braincharts_columns.py reorder --joined _dbg_joined_all.csv --template template.csv --outfile reordered.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import json
+import re
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable
+
+
+COLMAP_FORMAT = 1
+COLMAP_SUFFIX = ".colmap.json"
+DEFAULT_DICT = Path(__file__).resolve().parent / "keys_lifespan57K_82sites.csv"
+FEATURES_NAME = "_dbg_braincharts_features_only.csv"
+MAPPING_NAME = "_dbg_braincharts_column_mapping.csv"
+OUTPUT_NAME = "braincharts_all_subjects.csv"
+
+# FreeSurfer writes "&" in structure names; the table tools write "_and_".
+CANON_REWRITES = [("+", ""), ("G_and_S", "G&S"), ("_and_", "&"), ("Ins_lG", "Ins_lg")]
+SUBJECT_KEYS = {"subject", "subject_id"}
+SESSION_KEYS = {"session", "ses"}
+METADATA_SUBJECT_KEYS = ["subject", "subject_id", "subjectid", "id", "sub_id"]
+SESSION_PATTERN = re.compile(r"^sub-([^_]+)_ses-([A-Za-z0-9._-]+)")
+
+
+def canon(name: str) -> str:
+    """Canonical form of a header: pandas ``.N`` duplicate suffixes, ``_and_`` spellings and case are ignored."""
+    name = re.sub(r"\.[0-9]+$", "", name.replace("\r", ""))
+    for old, new in CANON_REWRITES:
+        name = name.replace(old, new)
+    return re.sub(r"[^0-9a-z]+", "_", name.lower()).strip("_")
+
+
+def file_sha256(path: Path) -> str:
+    return hashlib.sha256(Path(path).read_bytes()).hexdigest()
+
+
+def _clean(value: str) -> str:
+    value = value.strip()
+    if len(value) >= 2 and value[0] == value[-1] == '"':
+        value = value[1:-1]
+    return value
+
+
+@dataclass(frozen=True)
+class ColumnMap:
+    """Compiled header dictionary.
+
+    ``entries`` holds ``(joined_header, output_name)`` pairs in dictionary
+    order and ``lookup`` maps the canonical form of both names to the entry.
+    """
+
+    entries: tuple[tuple[str, str], ...]
+    lookup: dict[str, int]
+
+    @classmethod
+    def from_pairs(cls, pairs: Iterable[tuple[str, str]]) -> "ColumnMap":
+        entries = tuple(pairs)
+        lookup: dict[str, int] = {}
+        for position, (joined, output) in enumerate(entries):
+            for name in (joined, output):
+                lookup.setdefault(canon(name), position)
+        return cls(entries, lookup)
+
+    @classmethod
+    def from_dictionary(cls, path: Path) -> "ColumnMap":
+        """Parse a ``joined_header,template_match`` CSV; an empty or NA match keeps the joined header."""
+        pairs = []
+        with Path(path).open(newline="", encoding="utf-8") as handle:
+            for number, row in enumerate(csv.reader(handle)):
+                if not row or (number == 0 and _clean(row[0]).lower() == "joined_header"):
+                    continue
+                joined = _clean(row[0])
+                output = _clean(row[1]) if len(row) > 1 else ""
+                if joined:
+                    pairs.append((joined, joined if output in {"", "NA", "na"} else output))
+        if not pairs:
+            raise SystemExit(f"Header dictionary has no entries: {path}")
+        return cls.from_pairs(pairs)
+
+    @classmethod
+    def compiled(cls, dict_path: Path = DEFAULT_DICT, cache_path: Path | None = None) -> "ColumnMap":
+        """Load the compiled map for ``dict_path``, compiling and saving it first if it is missing or stale."""
+        dict_path = Path(dict_path)
+        cache_path = Path(cache_path) if cache_path else dict_path.with_name(dict_path.name + COLMAP_SUFFIX)
+        source = file_sha256(dict_path)
+        try:
+            return cls.load(cache_path, source)
+        except (OSError, ValueError, KeyError):
+            pass
+        column_map = cls.from_dictionary(dict_path)
+        try:
+            column_map.save(cache_path, source)
+        except OSError as exc:
+            print(f"WARNING: could not save the compiled column map to {cache_path}: {exc}", file=sys.stderr)
+        return column_map
+
+    def save(self, path: Path, source: str) -> Path:
+        payload = {"format": COLMAP_FORMAT, "source_sha256": source, "entries": self.entries, "lookup": self.lookup}
+        path = Path(path)
+        path.write_text(json.dumps(payload, indent=1) + "\n", encoding="utf-8")
+        return path
+
+    @classmethod
+    def load(cls, path: Path, source: str | None = None) -> "ColumnMap":
+        """Read a saved map; ``ValueError`` if it was compiled from a different dictionary."""
+        payload = json.loads(Path(path).read_text(encoding="utf-8"))
+        if payload["format"] != COLMAP_FORMAT or (source is not None and payload["source_sha256"] != source):
+            raise ValueError(f"Compiled column map {path} is stale")
+        return cls(tuple((joined, output) for joined, output in payload["entries"]), dict(payload["lookup"]))
+
+    def aliases(self, name: str) -> list[str]:
+        """``name`` followed by both names of its dictionary entry, if it has one."""
+        position = self.lookup.get(canon(name))
+        return [name] if position is None else [name, *self.entries[position]]
+
+    def match(self, targets: Iterable[str], headers: list[str]) -> list[int | None]:
+        """Position in ``headers`` of each target column, or ``None``.
+
+        Exact header names win; otherwise the canonical forms of the target and
+        its dictionary aliases are looked up. When several headers share a
+        name, the last one is used.
+        """
+        exact, by_canon = _header_index(headers)
+        found = []
+        for target in targets:
+            names = self.aliases(target)
+            hit = next((exact[name] for name in names if name in exact), None)
+            if hit is None:
+                hit = next((by_canon[key] for key in map(canon, names) if key in by_canon), None)
+            found.append(hit)
+        return found
+
+    def dictionary_plan(self, headers: list[str]) -> list[tuple[str, str, int | None]]:
+        """``(joined_header, output_name, header_position)`` for every dictionary entry, in dictionary order."""
+        exact, by_canon = _header_index(headers)
+        plan = []
+        for joined, output in self.entries:
+            position = exact.get(joined, by_canon.get(canon(joined), by_canon.get(canon(output))))
+            plan.append((joined, output, position))
+        return plan
+
+
+def _header_index(headers: list[str]) -> tuple[dict[str, int], dict[str, int]]:
+    """Exact and canonical header name to position; later duplicates win."""
+    exact = {name: position for position, name in enumerate(headers)}
+    by_canon = {canon(name): position for position, name in enumerate(headers)}
+    return exact, by_canon
+
+
+def read_header(path: Path) -> list[str]:
+    with Path(path).open(newline="", encoding="utf-8") as handle:
+        header = next(csv.reader(handle), None)
+    if not header:
+        raise SystemExit(f"Empty CSV: {path}")
+    return [_clean(name) for name in header]
+
+
+def read_columns(path: Path, positions: Iterable[int]):
+    """Read the columns at ``positions`` of a CSV as strings, exactly as written; the frame is keyed by position."""
+    import pandas as pd
+
+    frame = pd.read_csv(path, header=None, skiprows=1, usecols=sorted(set(positions)), dtype=str, keep_default_na=False)
+    return frame.fillna("")
+
+
+def assemble(columns: list[tuple[str, object]], index):
+    """Frame from ``(name, Series or str)`` pairs; Series are reused as they are and strings fill a constant column.
+
+    Columns are keyed by position, so repeated output names are kept.
+    """
+    import pandas as pd
+
+    data = {}
+    for position, (_, values) in enumerate(columns):
+        data[position] = values if isinstance(values, pd.Series) else pd.Series(values, index=index, dtype=object)
+    frame = pd.DataFrame(data, index=index)
+    frame.columns = [name for name, _ in columns]
+    return frame
+
+
+def write_csv(frame, path: Path) -> Path:
+    """Write ``frame`` as ``to_csv(index=False)`` would, with missing values empty.
+
+    Uses the csv module because ``to_csv(lineterminator=)`` needs pandas 1.5.
+    """
+    import pandas as pd
+
+    with path.open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle, lineterminator="\n")
+        writer.writerow(frame.columns)
+        writer.writerows(["" if pd.isna(value) else value for value in row] for row in frame.itertuples(index=False, name=None))
+    return path
+
+
+def remap_features(joined: Path, column_map: ColumnMap, mapping_out: Path | None = None):
+    """Joined table renamed and reordered to the dictionary; entries without a joined column are empty."""
+    header = read_header(joined)
+    plan = column_map.dictionary_plan(header)
+    frame = read_columns(joined, [0, *(source for _, _, source in plan if source is not None)])
+    if mapping_out:
+        with Path(mapping_out).open("w", newline="", encoding="utf-8") as handle:
+            writer = csv.writer(handle, lineterminator="\n")
+            writer.writerow(["dictionary_column", "output_column", "joined_column_found"])
+            writer.writerows((joined_name, output, "" if source is None else header[source]) for joined_name, output, source in plan)
+    return assemble([(output, "" if source is None else frame[source]) for _, output, source in plan], frame.index)
+
+
+def merge_metadata(features, metadata: Path, subject_col: str | None = None):
+    """Metadata rows (in metadata order) followed by their FreeSurfer columns; unmatched subjects are reported."""
+    import pandas as pd
+
+    meta = pd.read_csv(metadata, dtype=str, keep_default_na=False)
+    if subject_col is None:
+        subject_col = next((name for name in meta.columns if name.strip().lower() in METADATA_SUBJECT_KEYS), None)
+    if subject_col not in meta.columns:
+        raise SystemExit("ERROR: Could not find subject column in metadata. Use --metadata-subject.")
+
+    brain_keys = features.iloc[:, 0].str.strip()
+    brain = features.iloc[:, 1:].set_axis(brain_keys, axis=0)
+    brain = brain[~brain.index.duplicated(keep="last")]
+    meta_keys = meta[subject_col].str.strip()
+    found = meta_keys.isin(brain.index)
+    for key in meta_keys[~found]:
+        print(f"WARNING: Metadata subject not found in FreeSurfer table: {key}", file=sys.stderr)
+    for key in brain.index.difference(meta_keys[found], sort=False):
+        print(f"WARNING: FreeSurfer subject had no metadata row: {key}", file=sys.stderr)
+
+    meta = meta[found.to_numpy()].reset_index(drop=True)
+    brain = brain.loc[meta_keys[found]].reset_index(drop=True)
+    return assemble([*meta.items(), *brain.items()], meta.index)
+
+
+def reorder_to_template(joined: Path, template: Path, column_map: ColumnMap, report: Path, mapping_out: Path):
+    """Joined table reordered to the header of ``template``; subject and session columns come from the first column."""
+    header = read_header(joined)
+    targets = read_header(template)
+    sources = column_map.match(targets, header)
+    frame = read_columns(joined, [0, *(source for source in sources if source is not None)])
+    keys = frame[0]
+    sessions = keys.str.extract(SESSION_PATTERN, expand=True)[1].fillna("")
+
+    columns, missing = [], []
+    for target, source in zip(targets, sources):
+        key = canon(target)
+        if key in SUBJECT_KEYS:
+            columns.append((target, keys))
+        elif key in SESSION_KEYS:
+            columns.append((target, sessions))
+        else:
+            columns.append((target, "" if source is None else frame[source]))
+            if source is None:
+                missing.append(target)
+
+    report_lines = [
+        f"Template columns: {len(targets)}",
+        f"Joined columns:   {len(header)}",
+        f"Header matches:   {len(targets) - len(missing)}",
+        f"Header missing:   {len(missing)}",
+        *missing[:80],
+    ]
+    Path(report).write_text("\n".join(report_lines) + "\n", encoding="utf-8")
+    with Path(mapping_out).open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle, quoting=csv.QUOTE_ALL, lineterminator="\n")
+        writer.writerow(["template_header", "joined_match"])
+        writer.writerows((target, "" if source is None else header[source]) for target, source in zip(targets, sources))
+    return assemble(columns, frame.index)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Rename and reorder joined FreeSurfer tables for BrainCharts.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    compile_cmd = commands.add_parser("compile", help="Compile a header dictionary and save the lookup table.")
+    compile_cmd.add_argument("--dict", default=str(DEFAULT_DICT), help="CSV with columns joined_header,template_match.")
+    compile_cmd.add_argument("--output", help=f"Compiled map. Default: <dict>{COLMAP_SUFFIX}.")
+
+    prepare = commands.add_parser("prepare", help="Rename the joined table to BrainCharts headers and merge metadata.")
+    prepare.add_argument("--joined", required=True, help="Joined FreeSurfer table from build_freesurfer_sheet.sh.")
+    prepare.add_argument("--dict", default=str(DEFAULT_DICT), help="CSV with columns joined_header,template_match.")
+    prepare.add_argument("--metadata", help="Participant metadata CSV. Recommended.")
+    prepare.add_argument("--metadata-subject", help="Subject ID column in metadata. Default: auto-detect.")
+    prepare.add_argument("--outdir", help="Output directory. Default: directory containing --joined.")
+    prepare.add_argument("--outfile", help=f"Final output CSV. Default: <outdir>/{OUTPUT_NAME}.")
+
+    reorder = commands.add_parser("reorder", help="Reorder the joined table to the header of a template CSV.")
+    reorder.add_argument("--joined", required=True, help="Joined FreeSurfer CSV.")
+    reorder.add_argument("--template", required=True, help="CSV whose header defines the desired output order.")
+    reorder.add_argument("--outfile", required=True, help="Reordered output CSV.")
+    reorder.add_argument("--dict", default=str(DEFAULT_DICT), help="Header dictionary used for aliases such as Left-Thalamus-Proper.")
+    reorder.add_argument("--report", help="Text report. Default: <outfile>.report.txt.")
+    reorder.add_argument("--mapping", help="Mapping CSV. Default: <outfile>.mapping.csv.")
+    return parser.parse_args()
+
+
+def require_file(path: str, label: str) -> Path:
+    if not Path(path).is_file():
+        raise SystemExit(f"ERROR: {label} not found: {path}")
+    return Path(path)
+
+
+def main() -> None:
+    args = parse_args()
+    dict_path = require_file(args.dict, "Header dictionary")
+
+    if args.command == "compile":
+        output = Path(args.output) if args.output else dict_path.with_name(dict_path.name + COLMAP_SUFFIX)
+        column_map = ColumnMap.from_dictionary(dict_path)
+        column_map.save(output, file_sha256(dict_path))
+        print(f"Compiled {len(column_map.entries)} entries into {output}")
+        return
+
+    joined = require_file(args.joined, "Joined CSV")
+    column_map = ColumnMap.compiled(dict_path)
+
+    if args.command == "reorder":
+        template = require_file(args.template, "Template CSV")
+        outfile = Path(args.outfile)
+        report = Path(args.report or f"{outfile}.report.txt")
+        mapping = Path(args.mapping or f"{outfile}.mapping.csv")
+        outfile.parent.mkdir(parents=True, exist_ok=True)
+        write_csv(reorder_to_template(joined, template, column_map, report, mapping), outfile)
+        print("Wrote:")
+        print(f"  Reordered CSV: {outfile}")
+        print(f"  Report:        {report}")
+        print(f"  Mapping CSV:   {mapping}")
+        return
+
+    outdir = Path(args.outdir) if args.outdir else joined.parent
+    outdir.mkdir(parents=True, exist_ok=True)
+    outfile = Path(args.outfile) if args.outfile else outdir / OUTPUT_NAME
+    features = remap_features(joined, column_map, outdir / MAPPING_NAME)
+    write_csv(features, outdir / FEATURES_NAME)
+    if args.metadata:
+        write_csv(merge_metadata(features, require_file(args.metadata, "Metadata CSV"), args.metadata_subject), outfile)
+    else:
+        write_csv(features, outfile)
+        print(
+            "WARNING: No metadata supplied. Add subject, age, sex, site, sitenum, and cohort before running the split and normative model.",
+            file=sys.stderr,
+        )
+    print("Wrote:")
+    print(f"  BrainCharts input:  {outfile}")
+    print(f"  Feature-only table: {outdir / FEATURES_NAME}")
+    print(f"  Mapping report:     {outdir / MAPPING_NAME}")
+    print("[OK] BrainCharts table preparation complete.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,195 @@
+"""Shared design-matrix stage for run_braincharts_normative_models.py.
+
+Every BrainCharts IDP is predicted from the same covariates, site list and
+B-spline limits, so the test and adaptation design matrices and the sitenum
+vectors are built once per run and reused by every IDP. The files are kept in
+``model_work/_design`` together with a content hash of their inputs; a rerun
+with unchanged inputs reuses them and any change to the inputs rebuilds them.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+
+DESIGN_DIRNAME = "_design"
+MANIFEST_NAME = "design.json"
+
+
+def fingerprint(*parts: Any) -> str:
+    """Return a SHA-256 hex digest of strings, numbers, lists and arrays."""
+    import numpy as np
+
+    digest = hashlib.sha256()
+
+    def feed(part: Any) -> None:
+        if part is None:
+            digest.update(b"N;")
+        elif isinstance(part, (str, bytes)):
+            data = part.encode("utf-8") if isinstance(part, str) else part
+            digest.update(b"S%d;" % len(data))
+            digest.update(data)
+        elif isinstance(part, np.ndarray):
+            array = np.ascontiguousarray(part)
+            if array.dtype == object:
+                feed([str(value) for value in array.tolist()])
+                return
+            digest.update(f"A{array.dtype.str}{array.shape};".encode("ascii"))
+            digest.update(array.tobytes())
+        elif isinstance(part, (list, tuple)):
+            digest.update(b"L%d;" % len(part))
+            for item in part:
+                feed(item)
+        else:
+            feed(repr(part))
+
+    for part in parts:
+        feed(part)
+    return digest.hexdigest()
+
+
+@dataclass(frozen=True)
+class SharedDesign:
+    """Design matrices and sitenum vectors shared by every IDP."""
+
+    digest: str
+    x_te: Any
+    cov_file_te: Path
+    x_ad: Any = None
+    cov_file_ad: Path | None = None
+    sitenum_te: Any = None
+    sitenum_file_te: Path | None = None
+    sitenum_ad: Any = None
+    sitenum_file_ad: Path | None = None
+
+
+def design_fingerprint(
+    df_te,
+    df_ad,
+    cols_cov: list[str],
+    site_col: str,
+    sitenum_col: str,
+    site_ids_tr: list[str],
+    xmin: float,
+    xmax: float,
+) -> str:
+    """Hash every input that determines the shared design files."""
+    parts: list[Any] = ["bspline", list(cols_cov), list(site_ids_tr), float(xmin), float(xmax)]
+    for frame in (df_te, df_ad):
+        if frame is None:
+            parts.append(None)
+            continue
+        parts.extend(
+            [
+                frame[cols_cov].to_numpy(dtype=float),
+                frame[site_col].astype(str).to_numpy(),
+                frame[sitenum_col].to_numpy(dtype=int),
+            ]
+        )
+    return fingerprint(*parts)
+
+
+def _paths(design_dir: Path, adaptation: bool) -> dict[str, Path]:
+    paths = {"cov_te": design_dir / "cov_bspline_te.txt"}
+    if adaptation:
+        paths.update(
+            {
+                "cov_ad": design_dir / "cov_bspline_ad.txt",
+                "sitenum_te": design_dir / "sitenum_te.txt",
+                "sitenum_ad": design_dir / "sitenum_ad.txt",
+            }
+        )
+    return paths
+
+
+def build_shared_design(
+    work_root: Path,
+    df_te,
+    df_ad,
+    cols_cov: list[str],
+    site_col: str,
+    sitenum_col: str,
+    site_ids_tr: list[str],
+    xmin: float,
+    xmax: float,
+) -> SharedDesign:
+    """Build the shared design files, or reuse them if their hash still matches.
+
+    ``df_ad`` is None when no site adaptation is needed; the adaptation design
+    and both sitenum files are then omitted.
+    """
+    import numpy as np
+
+    digest = design_fingerprint(df_te, df_ad, cols_cov, site_col, sitenum_col, site_ids_tr, xmin, xmax)
+    adaptation = df_ad is not None
+    design_dir = work_root / DESIGN_DIRNAME
+    manifest_path = design_dir / MANIFEST_NAME
+    paths = _paths(design_dir, adaptation)
+    arrays: dict[str, Any] = {}
+
+    manifest: dict[str, Any] = {}
+    if manifest_path.is_file():
+        try:
+            manifest = json.loads(manifest_path.read_text(encoding="utf-8"))
+        except ValueError:
+            manifest = {}
+    npy_paths = {key: path.with_suffix(".npy") for key, path in paths.items()}
+    fresh = manifest.get("digest") == digest and all(
+        path.is_file() for path in list(paths.values()) + list(npy_paths.values())
+    )
+
+    if fresh:
+        print(f"Reusing shared design matrices in {design_dir}")
+        arrays = {key: np.load(path) for key, path in npy_paths.items()}
+    else:
+        from pcntoolkit.util.utils import create_design_matrix
+
+        print(f"Building shared design matrices in {design_dir}")
+        design_dir.mkdir(parents=True, exist_ok=True)
+        if manifest_path.exists():
+            manifest_path.unlink()
+
+        arrays["cov_te"] = create_design_matrix(
+            df_te[cols_cov],
+            site_ids=df_te[site_col],
+            all_sites=site_ids_tr,
+            basis="bspline",
+            xmin=xmin,
+            xmax=xmax,
+        )
+        if adaptation:
+            arrays["cov_ad"] = create_design_matrix(
+                df_ad[cols_cov],
+                site_ids=df_ad[site_col],
+                all_sites=site_ids_tr,
+                basis="bspline",
+                xmin=xmin,
+                xmax=xmax,
+            )
+            arrays["sitenum_te"] = df_te[sitenum_col].to_numpy(dtype=int)
+            arrays["sitenum_ad"] = df_ad[sitenum_col].to_numpy(dtype=int)
+
+        for key, array in arrays.items():
+            np.savetxt(paths[key], array)
+            np.save(npy_paths[key], array)
+        # Written last so an interrupted build is treated as stale next time.
+        manifest_path.write_text(
+            json.dumps({"digest": digest, "files": sorted(path.name for path in paths.values())}, indent=2) + "\n",
+            encoding="utf-8",
+        )
+
+    return SharedDesign(
+        digest=digest,
+        x_te=arrays["cov_te"],
+        cov_file_te=paths["cov_te"],
+        x_ad=arrays.get("cov_ad"),
+        cov_file_ad=paths.get("cov_ad"),
+        sitenum_te=arrays.get("sitenum_te"),
+        sitenum_file_te=paths.get("sitenum_te"),
+        sitenum_ad=arrays.get("sitenum_ad"),
+        sitenum_file_ad=paths.get("sitenum_ad"),
+    )
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""Sparse index of extreme BrainCharts deviations.
+
+Only a small fraction of the subjects x IDPs z-score matrix is extreme, so the
+entries with ``|z| > k`` for the smallest configured threshold ``k`` are kept
+as CSR-style (subject, IDP, z) triplets. The index also stores an IDP-ordered
+view of the same triplets and the per-subject counts for every threshold, so
+QC queries such as "which subjects deviate in region X" or "deviation load
+per subject" are answered from the index instead of rescanning the wide
+z-score table. Thresholds are strict, like ``n_abs_z_gt_7`` in the summary.
+
+Build the index from a z-score table (any ``--format``) or with
+``run_braincharts_normative_models.py --deviation-thresholds``, then query it::
+
+    python braincharts_deviations.py build \\
+      --zscores braincharts_normative_outputs/braincharts_zscores.csv \\
+      --output braincharts_normative_outputs/braincharts_deviation_index.npz \\
+      --thresholds 2 3 7
+    python braincharts_deviations.py query \\
+      --index braincharts_normative_outputs/braincharts_deviation_index.npz \\
+      --idp Left-Hippocampus --threshold 3
+
+In Python::
+
+    index = DeviationIndex.load(path)
+    index.subjects_deviating("Left-Hippocampus", threshold=3)
+    index.deviation_load(threshold=3)
+"""
+
+from __future__ import annotations
+
+import argparse
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any, Sequence
+
+from braincharts_tables import read_table, table_columns
+
+
+INDEX_NAME = "braincharts_deviation_index.npz"
+SUBJECT_REPORT_NAME = "braincharts_deviation_subjects.csv"
+COHORT_REPORT_NAME = "braincharts_deviation_cohorts.csv"
+DEFAULT_THRESHOLDS = (2.0, 3.0, 7.0)
+INDEX_FORMAT = 1
+ARRAY_NAMES = (
+    "subjects", "cohorts", "idps", "thresholds", "indptr", "indices", "values",
+    "idp_indptr", "idp_order", "subject_counts",
+)
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build and query a sparse index of extreme BrainCharts deviations.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build = commands.add_parser("build", help="Index the extreme z-scores of a braincharts_zscores table.")
+    build.add_argument("--zscores", required=True, help="braincharts_zscores table (.csv, .parquet or .feather).")
+    build.add_argument("--output", required=True, help=f"Index file to write, e.g. {INDEX_NAME}.")
+    build.add_argument("--subject-col", default="subject", help="Subject ID column. Default: subject.")
+    build.add_argument("--cohort-col", default="cohort", help="Cohort column for per-cohort counts, if present. Default: cohort.")
+    build.add_argument("--z-suffix", default="_zscore", help="Suffix of the z-score columns. Default: _zscore.")
+    build.add_argument(
+        "--thresholds",
+        type=float,
+        nargs="+",
+        default=list(DEFAULT_THRESHOLDS),
+        help="|z| thresholds to count; the smallest one decides which entries are stored. Default: 2 3 7.",
+    )
+    build.add_argument("--reports", action="store_true", help="Also write the per-subject and per-cohort count CSVs next to the index.")
+
+    query = commands.add_parser("query", help="Query an index built by 'build'.")
+    query.add_argument("--index", required=True, help="Index file from 'build' or --deviation-thresholds.")
+    query.add_argument("--threshold", type=float, help="|z| threshold; at least the smallest indexed one. Default: the smallest indexed one.")
+    target = query.add_mutually_exclusive_group(required=True)
+    target.add_argument("--idp", help="List the subjects deviating in this IDP.")
+    target.add_argument("--subject", help="List the deviating IDPs of this subject.")
+    target.add_argument("--load", action="store_true", help="Deviation count and summed |z| per subject.")
+    target.add_argument("--cohorts", action="store_true", help="Per-cohort counts for every indexed threshold.")
+    query.add_argument("--output", help="Write the result as CSV instead of printing it.")
+
+    args = parser.parse_args()
+    if args.command == "build" and any(threshold < 0 for threshold in args.thresholds):
+        parser.error("--thresholds must not be negative")
+    return args
+
+
+def threshold_label(threshold: float) -> str:
+    """Column name used for the count of ``|z| > threshold``."""
+    return f"n_abs_z_gt_{threshold:g}"
+
+
+@dataclass(frozen=True)
+class DeviationIndex:
+    """Extreme z-scores of a subjects x IDPs matrix in CSR form.
+
+    Row ``i`` (subject ``subjects[i]``) holds ``values[indptr[i]:indptr[i + 1]]``
+    at IDP positions ``indices[...]``, for every ``|z| > min(thresholds)``.
+    ``idp_order[idp_indptr[j]:idp_indptr[j + 1]]`` lists the positions of IDP
+    ``j``'s entries in the triplet arrays. ``subject_counts[i, t]`` counts
+    ``|z| > thresholds[t]`` for subject ``i``. ``cohorts`` is empty when no
+    cohort column was available.
+    """
+
+    subjects: Any
+    cohorts: Any
+    idps: Any
+    thresholds: Any
+    indptr: Any
+    indices: Any
+    values: Any
+    idp_indptr: Any
+    idp_order: Any
+    subject_counts: Any
+
+    @classmethod
+    def build(
+        cls,
+        z,
+        subjects: Sequence[str],
+        idps: Sequence[str],
+        thresholds: Sequence[float] = DEFAULT_THRESHOLDS,
+        cohorts: Sequence[str] | None = None,
+        block: int = 4096,
+    ) -> "DeviationIndex":
+        """Index a subjects x IDPs z-score matrix; NaN z-scores are never extreme."""
+        import numpy as np
+
+        z = np.asarray(z)
+        thresholds = np.array(sorted(set(float(value) for value in thresholds)))
+        if thresholds.size == 0:
+            raise ValueError("At least one threshold is needed")
+        n_subjects, n_idps = z.shape
+        if len(subjects) != n_subjects or len(idps) != n_idps:
+            raise ValueError(f"z has shape {z.shape} for {len(subjects)} subjects and {len(idps)} IDPs")
+
+        counts = np.zeros((n_subjects, thresholds.size), dtype=np.int64)
+        row_nnz = np.zeros(n_subjects, dtype=np.int64)
+        indices, values = [], []
+        for start in range(0, n_subjects, block):
+            abs_z = np.abs(np.asarray(z[start:start + block], dtype=float))
+            with np.errstate(invalid="ignore"):
+                for position, threshold in enumerate(thresholds):
+                    counts[start:start + block, position] = np.sum(abs_z > threshold, axis=1)
+                rows, cols = np.nonzero(abs_z > thresholds[0])
+            row_nnz[start:start + block] = counts[start:start + block, 0]
+            indices.append(cols.astype(np.int32))
+            values.append(np.asarray(z[start:start + block], dtype=float)[rows, cols])
+
+        indices = np.concatenate(indices) if indices else np.empty(0, dtype=np.int32)
+        values = np.concatenate(values) if values else np.empty(0)
+        idp_order = np.argsort(indices, kind="stable")
+        return cls(
+            subjects=np.asarray(subjects, dtype=str),
+            cohorts=np.asarray(cohorts if cohorts is not None else [], dtype=str),
+            idps=np.asarray(idps, dtype=str),
+            thresholds=thresholds,
+            indptr=np.concatenate([[0], np.cumsum(row_nnz)]),
+            indices=indices,
+            values=values,
+            idp_indptr=np.concatenate([[0], np.cumsum(np.bincount(indices, minlength=n_idps))]),
+            idp_order=idp_order,
+            subject_counts=counts,
+        )
+
+    def save(self, path: Path) -> Path:
+        """Write the index as one ``.npz`` file."""
+        import numpy as np
+
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with path.open("wb") as handle:
+            np.savez(handle, format=np.array(INDEX_FORMAT), **{name: getattr(self, name) for name in ARRAY_NAMES})
+        return path
+
+    @classmethod
+    def load(cls, path: Path) -> "DeviationIndex":
+        import numpy as np
+
+        with np.load(path, allow_pickle=False) as data:
+            if "format" not in data or int(data["format"]) != INDEX_FORMAT:
+                raise ValueError(f"{path} is not a deviation index in format {INDEX_FORMAT}; rebuild it")
+            return cls(**{name: data[name] for name in ARRAY_NAMES})
+
+    def _threshold(self, threshold: float | None) -> float:
+        smallest = float(self.thresholds[0])
+        if threshold is None:
+            return smallest
+        if threshold < smallest:
+            raise ValueError(f"Threshold {threshold:g} is below the smallest indexed threshold {smallest:g}")
+        return float(threshold)
+
+    def _cohorts_of(self, rows):
+        return self.cohorts[rows] if self.cohorts.size else None
+
+    def subjects_deviating(self, idp: str, threshold: float | None = None, sign: int = 0):
+        """Subjects with ``|z| > threshold`` in ``idp``; ``sign`` 1 or -1 keeps only high or low z."""
+        import numpy as np
+        import pandas as pd
+
+        threshold = self._threshold(threshold)
+        matches = np.flatnonzero(self.idps == idp)
+        if matches.size == 0:
+            raise KeyError(f"IDP {idp!r} is not in the index")
+        column = matches[0]
+        entries = self.idp_order[self.idp_indptr[column]:self.idp_indptr[column + 1]]
+        z = self.values[entries]
+        keep = np.abs(z) > threshold
+        if sign:
+            keep &= np.sign(z) == np.sign(sign)
+        entries, z = entries[keep], z[keep]
+        rows = np.searchsorted(self.indptr, entries, side="right") - 1
+        result = pd.DataFrame({"subject": self.subjects[rows], "z": z})
+        cohorts = self._cohorts_of(rows)
+        if cohorts is not None:
+            result.insert(1, "cohort", cohorts)
+        return result
+
+    def subject_profile(self, subject: str, threshold: float | None = None):
+        """IDPs in which ``subject`` has ``|z| > threshold``, most extreme first."""
+        import numpy as np
+        import pandas as pd
+
+        threshold = self._threshold(threshold)
+        matches = np.flatnonzero(self.subjects == subject)
+        if matches.size == 0:
+            raise KeyError(f"Subject {subject!r} is not in the index")
+        profiles = []
+        for row in matches:
+            start, stop = self.indptr[row], self.indptr[row + 1]
+            keep = np.abs(self.values[start:stop]) > threshold
+            profiles.append(pd.DataFrame({"idp": self.idps[self.indices[start:stop][keep]], "z": self.values[start:stop][keep]}))
+        result = pd.concat(profiles, ignore_index=True)
+        return result.iloc[np.argsort(-np.abs(result["z"].to_numpy()), kind="stable")].reset_index(drop=True)
+
+    def deviation_load(self, threshold: float | None = None):
+        """Per-subject count and summed ``|z|`` of the deviations above ``threshold``."""
+        import numpy as np
+        import pandas as pd
+
+        threshold = self._threshold(threshold)
+        abs_z = np.abs(self.values)
+        keep = abs_z > threshold
+        rows = np.repeat(np.arange(self.subjects.size), np.diff(self.indptr))
+        result = pd.DataFrame({
+            "subject": self.subjects,
+            "n_extreme": np.bincount(rows[keep], minlength=self.subjects.size),
+            "sum_abs_z": np.bincount(rows[keep], weights=abs_z[keep], minlength=self.subjects.size),
+        })
+        cohorts = self._cohorts_of(slice(None))
+        if cohorts is not None:
+            result.insert(1, "cohort", cohorts)
+        return result
+
+    def subject_report(self):
+        """Per-subject counts for every indexed threshold."""
+        import pandas as pd
+
+        result = pd.DataFrame(self.subject_counts, columns=[threshold_label(value) for value in self.thresholds])
+        cohorts = self._cohorts_of(slice(None))
+        if cohorts is not None:
+            result.insert(0, "cohort", cohorts)
+        result.insert(0, "subject", self.subjects)
+        return result
+
+    def cohort_report(self):
+        """Per-cohort subjects, deviating subjects and deviations for every indexed threshold."""
+        import pandas as pd
+
+        if not self.cohorts.size:
+            raise ValueError("The index has no cohort labels")
+        rows = []
+        for cohort in sorted(set(self.cohorts.tolist())):
+            counts = self.subject_counts[self.cohorts == cohort]
+            for position, threshold in enumerate(self.thresholds):
+                rows.append({
+                    "cohort": cohort,
+                    "threshold": float(threshold),
+                    "n_subjects": int(counts.shape[0]),
+                    "n_subjects_with_deviation": int((counts[:, position] > 0).sum()),
+                    "n_deviations": int(counts[:, position].sum()),
+                    "mean_deviations_per_subject": float(counts[:, position].mean()),
+                })
+        return pd.DataFrame(rows)
+
+    def write_reports(self, output_dir: Path) -> list[Path]:
+        """Write the per-subject (and, with cohort labels, per-cohort) count CSVs."""
+        written = [output_dir / SUBJECT_REPORT_NAME]
+        self.subject_report().to_csv(written[0], index=False)
+        if self.cohorts.size:
+            written.append(output_dir / COHORT_REPORT_NAME)
+            self.cohort_report().to_csv(written[1], index=False)
+        return written
+
+
+def build_from_table(path: Path, subject_col: str, cohort_col: str, z_suffix: str, thresholds: Sequence[float]) -> DeviationIndex:
+    """Build the index from the subject, cohort and z-score columns of a z-score table."""
+    names = table_columns(path)
+    if subject_col not in names:
+        raise SystemExit(f"{path} has no subject column {subject_col!r}")
+    z_columns = [name for name in names if name.endswith(z_suffix)]
+    if not z_columns:
+        raise SystemExit(f"{path} has no columns ending in {z_suffix!r}")
+    meta = [subject_col] + ([cohort_col] if cohort_col in names else [])
+    frame = read_table(path, meta + z_columns)
+    return DeviationIndex.build(
+        frame[z_columns].to_numpy(dtype=float),
+        frame[subject_col].astype(str).to_list(),
+        [name[: -len(z_suffix)] for name in z_columns],
+        thresholds,
+        frame[cohort_col].astype(str).to_list() if cohort_col in names else None,
+    )
+
+
+def main() -> None:
+    args = parse_args()
+    if args.command == "build":
+        output = Path(args.output)
+        index = build_from_table(Path(args.zscores), args.subject_col, args.cohort_col, args.z_suffix, args.thresholds)
+        written = [index.save(output)]
+        if args.reports:
+            written.extend(index.write_reports(output.parent))
+        print(f"Indexed {index.values.size} deviations with |z| > {index.thresholds[0]:g} "
+              f"for {index.subjects.size} subjects and {index.idps.size} IDPs")
+        for path in written:
+            print(f"  {path}")
+        return
+
+    try:
+        index = DeviationIndex.load(Path(args.index))
+        if args.idp:
+            result = index.subjects_deviating(args.idp, args.threshold)
+        elif args.subject:
+            result = index.subject_profile(args.subject, args.threshold)
+        elif args.load:
+            result = index.deviation_load(args.threshold)
+        else:
+            result = index.cohort_report()
+    except (KeyError, ValueError) as exc:
+        raise SystemExit(str(exc).strip("'\"")) from exc
+    if args.output:
+        result.to_csv(args.output, index=False)
+    else:
+        print(result.to_string(index=False))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,27 @@
+"""Site and phenotype lists from the braincharts ``docs`` folder.
+
+Shared by run_braincharts_normative_models.py and braincharts_bundle.py so both
+read the training site IDs and IDP names the same way.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+
+DEFAULT_SITE_ID_FILE = "site_ids_ct_82sites.txt"
+DEFAULT_PHENOTYPE_FILES = ["phenotypes_ct_lh.txt", "phenotypes_ct_rh.txt", "phenotypes_sc.txt"]
+
+
+def read_lines(path: Path) -> list[str]:
+    with path.open(encoding="utf-8") as handle:
+        return [line.strip() for line in handle if line.strip()]
+
+
+def read_model_lists(docs_dir: Path, site_id_file: str, phenotype_files: list[str]) -> tuple[list[str], list[str]]:
+    """Return the training site IDs and the de-duplicated IDP names, in file order."""
+    site_ids = read_lines(docs_dir / site_id_file)
+    idp_ids: list[str] = []
+    for filename in phenotype_files:
+        idp_ids.extend(read_lines(docs_dir / filename))
+    return site_ids, list(dict.fromkeys(idp_ids))
@@ -0,0 +1,97 @@
+"""Incremental z-scoring support for run_braincharts_normative_models.py.
+
+Each test row is keyed on its subject ID plus a hash of its site, covariate and
+IDP values. ``braincharts_incremental_state.json`` records those keys next to
+the previous outputs together with a fingerprint of everything else the
+z-scores depend on (model, adaptation set, B-spline limits, IDP list). A rerun
+reuses the z-scores of unchanged rows and only predicts new or modified rows.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Any
+
+from braincharts_tables import read_table
+
+
+STATE_NAME = "braincharts_incremental_state.json"
+
+
+def row_keys(frame, subject_col: str, value_cols: list[str]) -> list[str]:
+    """Return one ``subject:hash`` key per row of ``frame``."""
+    import pandas as pd
+
+    hashes = pd.util.hash_pandas_object(frame[value_cols], index=False).to_numpy()
+    subjects = frame[subject_col].astype(str).to_list()
+    return [f"{subject}:{value:016x}" for subject, value in zip(subjects, hashes)]
+
+
+@dataclass(frozen=True)
+class IncrementalPlan:
+    """Which test rows can reuse previous z-scores.
+
+    ``reuse`` is a boolean mask over the test rows and ``previous_z`` holds
+    the reused rows' z-scores (in test-row order) keyed by z-score column.
+    """
+
+    reuse: Any
+    previous_z: dict[str, Any]
+
+
+def plan_incremental(
+    output_dir: Path,
+    zscores_path: Path,
+    keys: list[str],
+    context_fingerprint: str,
+    z_columns: list[str],
+) -> IncrementalPlan:
+    """Match the current test rows against the previous run's state."""
+    import numpy as np
+
+    nothing = IncrementalPlan(
+        reuse=np.zeros(len(keys), dtype=bool),
+        previous_z={col: np.empty(0) for col in z_columns},
+    )
+    state_path = output_dir / STATE_NAME
+    if not state_path.is_file() or not zscores_path.is_file():
+        return nothing
+    try:
+        state = json.loads(state_path.read_text(encoding="utf-8"))
+    except ValueError:
+        return nothing
+    if state.get("context") != context_fingerprint or not set(z_columns) <= set(state.get("z_columns", [])):
+        print("Previous z-scores were produced with different inputs; rescoring every row")
+        return nothing
+
+    previous = read_table(zscores_path, z_columns)
+    previous_keys = state.get("row_keys", [])
+    if previous.shape[0] != len(previous_keys):
+        return nothing
+
+    previous_row = {key: row for row, key in enumerate(previous_keys)}
+    source = np.array([previous_row.get(key, -1) for key in keys], dtype=int)
+    reuse = source >= 0
+    previous_z = {col: previous[col].to_numpy(dtype=float)[source[reuse]] for col in z_columns}
+    return IncrementalPlan(reuse=reuse, previous_z=previous_z)
+
+
+def write_state(
+    output_dir: Path,
+    keys: list[str],
+    context_fingerprint: str,
+    z_columns: list[str],
+) -> Path:
+    """Record the row keys and context of the outputs that were just written."""
+    state_path = output_dir / STATE_NAME
+    tmp_path = output_dir / f"{STATE_NAME}.tmp"
+    tmp_path.write_text(
+        json.dumps({"context": context_fingerprint, "z_columns": list(z_columns), "row_keys": list(keys)}) + "\n",
+        encoding="utf-8",
+    )
+    os.replace(tmp_path, state_path)
+    return state_path
+
@@ -0,0 +1,78 @@
+"""Output table formats for run_braincharts_normative_models.py.
+
+CSV keeps the original three output files. Parquet and Feather write a single
+columnar ``braincharts_zscores`` table holding the metadata and raw IDP columns
+once plus the typed z-score columns, so readers can load only the columns they
+need, for example ``pd.read_parquet(path, columns=[...])`` in Python or
+``arrow::read_parquet(path, col_select = ...)`` in R. Both columnar formats
+need pyarrow.
+"""
+
+from __future__ import annotations
+
+from pathlib import Path
+
+
+FORMAT_SUFFIXES = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+
+
+def table_format(path: Path) -> str:
+    """Return the table format implied by the file suffix of ``path``."""
+    for fmt, suffix in FORMAT_SUFFIXES.items():
+        if path.suffix == suffix:
+            return fmt
+    raise ValueError(f"Unsupported table format for {path}; expected one of {', '.join(FORMAT_SUFFIXES.values())}")
+
+
+def require_columnar_support(fmt: str) -> None:
+    """Fail early, before any IDP runs, if ``fmt`` needs pyarrow and it is missing."""
+    if fmt == "csv":
+        return
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError as exc:
+        raise SystemExit(f"--format {fmt} needs pyarrow; install it with: pip install pyarrow") from exc
+
+
+def write_table(frame, path: Path) -> Path:
+    """Write ``frame`` to ``path`` in the format given by its suffix."""
+    fmt = table_format(path)
+    if fmt == "parquet":
+        frame.to_parquet(path, index=False)
+    elif fmt == "feather":
+        frame.reset_index(drop=True).to_feather(path)
+    else:
+        frame.to_csv(path, index=False)
+    return path
+
+
+def table_columns(path: Path) -> list[str]:
+    """Column names of a table written by :func:`write_table`, without reading its rows."""
+    import pandas as pd
+
+    fmt = table_format(path)
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+
+        return list(pq.read_schema(path).names)
+    if fmt == "feather":
+        import pyarrow.feather as feather
+
+        return list(feather.read_table(path, memory_map=True).column_names)
+    return list(pd.read_csv(path, nrows=0).columns)
+
+
+def read_table(path: Path, columns: list[str] | None = None):
+    """Read ``columns`` (default: all) from a table written by :func:`write_table`.
+
+    Columnar formats only read the requested columns; CSV floats are parsed
+    with round-trip precision so reused values match what was written.
+    """
+    import pandas as pd
+
+    fmt = table_format(path)
+    if fmt == "parquet":
+        return pd.read_parquet(path, columns=columns)
+    if fmt == "feather":
+        return pd.read_feather(path, columns=columns)
+    return pd.read_csv(path, usecols=columns, float_precision="round_trip")
@@ -0,0 +1,378 @@
+#!/usr/bin/env python3
+"""Array-backed store of the wide FreeSurfer feature tables.
+
+The Step 3 and Step 8 scripts write several wide CSVs (``_dbg_joined_all.csv``,
+``braincharts_all_subjects.csv``, ``dk_all_stats.csv``, ``wm_volumes.csv``,
+``icv_data.csv``, ...) that every consumer parses again. ``build`` parses them
+once and joins them on the subject column into a store directory holding:
+
+- ``values.npy``: one float32 subjects x features matrix; a subject missing
+  from a table, or an empty cell, is NaN. ``--dtype float64`` keeps the
+  values exactly as parsed from the CSVs at twice the size.
+- ``subjects.npy`` and ``subject_order.npy``: the subject IDs in row order and
+  their sort order, memory-mapped and binary-searched on lookup.
+- ``metadata.csv``: the subject column, the ``--metadata-cols`` and every
+  column that is not numeric, kept as text so covariates such as age and site
+  are not rounded to float32.
+- ``index.json``: the feature names, the table each came from and the size
+  and mtime of the source tables.
+
+A feature that appears in more than one table is taken from the first table
+listed. In Python, ``FeatureStore.load(path)`` memory-maps the arrays;
+``select`` returns a view of the mapped matrix when the requested subjects and
+features are contiguous or evenly spaced and otherwise gathers only the
+requested block. Usage::
+
+    python Step_3_BrainCharts_Normative_Modeling/feature_store.py build \\
+      --tables /path/to/outputs/braincharts_all_subjects.csv /path/to/outputs/dk_all_stats.csv \\
+      --output /path/to/outputs/freesurfer_features.store
+    python Step_3_BrainCharts_Normative_Modeling/feature_store.py info \\
+      --store /path/to/outputs/freesurfer_features.store
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+from pathlib import Path
+from typing import Any, Iterable, Sequence
+
+
+STORE_FORMAT = 1
+INDEX_NAME = "index.json"
+VALUES_NAME = "values.npy"
+SUBJECTS_NAME = "subjects.npy"
+ORDER_NAME = "subject_order.npy"
+METADATA_NAME = "metadata.csv"
+DEFAULT_METADATA_COLS = ["age", "sex", "site", "sitenum", "cohort"]
+DTYPES = ("float32", "float64")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build or inspect the array-backed FreeSurfer feature store.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    build_cmd = commands.add_parser("build", help="Join wide CSV tables into a feature store.")
+    build_cmd.add_argument("--tables", nargs="+", required=True, help="CSV or tab-separated tables, one row per subject.")
+    build_cmd.add_argument("--output", required=True, help="Store directory to create.")
+    build_cmd.add_argument(
+        "--subject-cols",
+        nargs="+",
+        help="Subject column of each table, in --tables order. Default: the first column of each table.",
+    )
+    build_cmd.add_argument(
+        "--metadata-cols",
+        nargs="*",
+        default=DEFAULT_METADATA_COLS,
+        help="Columns kept as text in metadata.csv instead of the feature matrix; matched ignoring case. "
+        f"Non-numeric columns are always metadata. Default: {' '.join(DEFAULT_METADATA_COLS)}.",
+    )
+    build_cmd.add_argument("--dtype", choices=DTYPES, default="float32", help="Feature matrix dtype. Default: float32.")
+
+    info_cmd = commands.add_parser("info", help="Print the size of a store and whether its source tables changed.")
+    info_cmd.add_argument("--store", required=True, help="Store directory written by build.")
+    return parser.parse_args()
+
+
+def source_signature(path: Path) -> dict[str, Any]:
+    stat = path.stat()
+    return {"path": str(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def table_separator(path: Path) -> str:
+    """Tab for tables whose header has tabs but no commas (aparc_aseg_pybrain.sh output), else comma."""
+    with path.open(newline="", encoding="utf-8") as handle:
+        header = handle.readline()
+    return "\t" if "\t" in header and "," not in header else ","
+
+
+def read_source(path: Path, subject_col: str | None, metadata_cols: Iterable[str]):
+    """Read one table; returns its subject IDs, numeric feature frame and text metadata frame."""
+    import pandas as pd
+
+    sep = table_separator(path)
+    header = list(pd.read_csv(path, sep=sep, nrows=0).columns)
+    if not header:
+        raise SystemExit(f"{path} has no header")
+    subject_col = subject_col or header[0]
+    if subject_col not in header:
+        raise SystemExit(f"{path} has no subject column {subject_col!r}")
+    wanted = {name.lower() for name in metadata_cols}
+    text_cols = [subject_col] + [name for name in header if name != subject_col and name.lower() in wanted]
+    frame = pd.read_csv(path, sep=sep, dtype={name: str for name in text_cols}, keep_default_na=False, na_values=[""])
+
+    subjects = frame[subject_col].fillna("").astype(str)
+    if (subjects == "").any():
+        raise SystemExit(f"{path} has rows without a {subject_col!r} value")
+    duplicated = subjects[subjects.duplicated()].unique()
+    if len(duplicated):
+        raise SystemExit(f"{path} lists subjects more than once: {', '.join(duplicated[:5])}")
+
+    numeric = [
+        name for name in header if name not in text_cols and pd.api.types.is_numeric_dtype(frame[name].dtype)
+    ]
+    metadata = [name for name in header if name != subject_col and name not in numeric]
+    return subjects.to_list(), frame[numeric], frame[metadata].fillna("").astype(str)
+
+
+def build_store(
+    tables: Sequence[Path],
+    output: Path,
+    subject_cols: Sequence[str | None] | None = None,
+    metadata_cols: Iterable[str] = DEFAULT_METADATA_COLS,
+    dtype: str = "float32",
+) -> dict[str, Any]:
+    """Join ``tables`` on their subject columns and write the store to ``output``; returns its index."""
+    import numpy as np
+    import pandas as pd
+
+    subject_cols = list(subject_cols) if subject_cols else [None] * len(tables)
+    if len(subject_cols) != len(tables):
+        raise SystemExit(f"--subject-cols lists {len(subject_cols)} column(s) for {len(tables)} table(s)")
+    metadata_cols = list(metadata_cols)
+
+    rows: dict[str, int] = {}
+    features: list[str] = []
+    feature_tables: list[int] = []
+    blocks = []
+    metadata_parts = []
+    taken: set[str] = set()
+    sources = []
+    for number, (path, subject_col) in enumerate(zip(tables, subject_cols)):
+        path = Path(path).resolve()
+        if not path.is_file():
+            raise SystemExit(f"Table not found: {path}")
+        subjects, numeric, metadata = read_source(path, subject_col, metadata_cols)
+        positions = np.array([rows.setdefault(subject, len(rows)) for subject in subjects], dtype=np.int64)
+        keep = [name for name in numeric.columns if name not in taken]
+        taken.update(keep)
+        features.extend(keep)
+        feature_tables.extend([number] * len(keep))
+        blocks.append((positions, numeric[keep].to_numpy(dtype=dtype)))
+        new_meta = [name for name in metadata.columns if name not in taken]
+        taken.update(new_meta)
+        if new_meta:
+            metadata_parts.append(metadata[new_meta].set_axis(subjects, axis=0))
+        sources.append({**source_signature(path), "features": len(keep)})
+        print(f"Read {path.name}: {len(subjects)} subjects, {len(keep)} new features")
+
+    if not rows:
+        raise SystemExit("The tables hold no subjects")
+    subjects = list(rows)
+    output.mkdir(parents=True, exist_ok=True)
+    index_path = output / INDEX_NAME
+    if index_path.exists():
+        index_path.unlink()
+
+    values = np.lib.format.open_memmap(output / VALUES_NAME, mode="w+", dtype=dtype, shape=(len(subjects), len(features)))
+    values[:] = np.nan
+    start = 0
+    for positions, block in blocks:
+        values[positions, start : start + block.shape[1]] = block
+        start += block.shape[1]
+    values.flush()
+    del values
+
+    subject_array = np.array(subjects, dtype=str)
+    np.save(output / SUBJECTS_NAME, subject_array)
+    np.save(output / ORDER_NAME, np.argsort(subject_array, kind="stable").astype(np.int64))
+
+    metadata = pd.DataFrame(index=pd.Index(subjects, name="subject"))
+    for part in metadata_parts:
+        metadata = metadata.join(part)
+    # Written with the csv module: DataFrame.to_csv(lineterminator=) needs pandas 1.5,
+    # and predict.py reads stores in the PyBrainAge environment (pandas 1.3).
+    with (output / METADATA_NAME).open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle, lineterminator="\n")
+        writer.writerow([metadata.index.name, *metadata.columns])
+        writer.writerows([subject, *values] for subject, values in zip(metadata.index, metadata.fillna("").itertuples(index=False)))
+
+    index = {
+        "format": STORE_FORMAT,
+        "dtype": dtype,
+        "subjects": len(subjects),
+        "features": features,
+        "feature_tables": feature_tables,
+        "metadata_columns": list(metadata.columns),
+        "sources": sources,
+    }
+    # Written last so an interrupted build never looks like a valid store.
+    index_path.write_text(json.dumps(index, indent=1) + "\n", encoding="utf-8")
+    return index
+
+
+def as_slice(positions):
+    """``positions`` as an equivalent slice when they are evenly spaced and increasing, else None."""
+    import numpy as np
+
+    positions = np.asarray(positions, dtype=np.int64)
+    if positions.size == 0:
+        return None
+    if positions.size == 1:
+        return slice(int(positions[0]), int(positions[0]) + 1)
+    steps = np.diff(positions)
+    step = int(steps[0])
+    if step <= 0 or not (steps == step).all():
+        return None
+    return slice(int(positions[0]), int(positions[-1]) + 1, step)
+
+
+class FeatureStore:
+    """A feature store opened with memory-mapped arrays."""
+
+    def __init__(self, path: Path, index: dict[str, Any], values, subjects, order) -> None:
+        self.path = path
+        self.index = index
+        self.values = values
+        self.subjects = subjects
+        self.order = order
+        self.features = list(index["features"])
+        self._feature_positions = {name: position for position, name in enumerate(self.features)}
+        self._metadata = None
+
+    @classmethod
+    def load(cls, path: Path) -> "FeatureStore":
+        import numpy as np
+
+        path = Path(path)
+        index_path = path / INDEX_NAME
+        if not index_path.is_file():
+            raise FileNotFoundError(f"Not a feature store (missing {INDEX_NAME}): {path}")
+        index = json.loads(index_path.read_text(encoding="utf-8"))
+        if index.get("format") != STORE_FORMAT:
+            raise ValueError(f"Unsupported feature store format {index.get('format')!r} in {path}; rebuild it.")
+        return cls(
+            path,
+            index,
+            np.load(path / VALUES_NAME, mmap_mode="r"),
+            np.load(path / SUBJECTS_NAME, mmap_mode="r"),
+            np.load(path / ORDER_NAME, mmap_mode="r"),
+        )
+
+    @staticmethod
+    def is_store(path: Path) -> bool:
+        return (Path(path) / INDEX_NAME).is_file()
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        return self.values.shape
+
+    def subject_rows(self, subjects: Iterable[str]):
+        """Row of each subject, found by binary search of the mapped subject index."""
+        import numpy as np
+
+        keys = np.asarray(list(subjects), dtype=str)
+        found = np.searchsorted(self.subjects, keys, sorter=self.order)
+        found = np.minimum(found, len(self.order) - 1)
+        rows = np.asarray(self.order[found], dtype=np.int64)
+        missing = keys[self.subjects[rows] != keys] if keys.size else keys
+        if missing.size:
+            raise KeyError(f"{missing.size} subject(s) not in {self.path}, e.g. {', '.join(missing[:5])}")
+        return rows
+
+    def feature_columns(self, features: Iterable[str]):
+        import numpy as np
+
+        features = list(features)
+        missing = [name for name in features if name not in self._feature_positions]
+        if missing:
+            raise KeyError(f"{len(missing)} feature(s) not in {self.path}, e.g. {', '.join(missing[:5])}")
+        return np.array([self._feature_positions[name] for name in features], dtype=np.int64)
+
+    def select(self, subjects: Iterable[str] | None = None, features: Iterable[str] | None = None):
+        """Subjects x features array of the selected rows and columns.
+
+        Selections that map to evenly spaced rows and columns (including all of
+        them) return a read-only view of the mapped matrix without copying;
+        any other selection copies just the requested block.
+        """
+        import numpy as np
+
+        rows = slice(None) if subjects is None else self.subject_rows(subjects)
+        cols = slice(None) if features is None else self.feature_columns(features)
+        if not isinstance(rows, slice):
+            rows = as_slice(rows) or rows
+        if not isinstance(cols, slice):
+            cols = as_slice(cols) or cols
+        if isinstance(rows, slice) or isinstance(cols, slice):
+            return self.values[rows][:, cols] if isinstance(rows, slice) else self.values[:, cols][rows]
+        return self.values[np.ix_(rows, cols)]
+
+    def metadata(self, columns: Sequence[str] | None = None):
+        """The text metadata table, indexed by subject in row order."""
+        import pandas as pd
+
+        if self._metadata is None:
+            self._metadata = pd.read_csv(self.path / METADATA_NAME, dtype=str, keep_default_na=False, index_col=0)
+        return self._metadata if columns is None else self._metadata[list(columns)]
+
+    def frame(
+        self,
+        subjects: Iterable[str] | None = None,
+        features: Iterable[str] | None = None,
+        metadata: Sequence[str] = (),
+        dtype=None,
+    ):
+        """DataFrame of ``metadata`` columns followed by the selected features, indexed by subject.
+
+        With the default ``dtype`` the feature block wraps :meth:`select`
+        without another copy; pass ``dtype=float`` for float64 columns.
+        """
+        import pandas as pd
+
+        subjects = None if subjects is None else list(subjects)
+        features = self.features if features is None else list(features)
+        block = self.select(subjects, features)
+        if dtype is not None:
+            block = block.astype(dtype)
+        index = pd.Index(self.subjects if subjects is None else subjects, name=self.metadata().index.name)
+        frame = pd.DataFrame(block, index=index, columns=features, copy=False)
+        if metadata:
+            meta = self.metadata(metadata)
+            meta = meta if subjects is None else meta.iloc[self.subject_rows(subjects)]
+            frame = pd.concat([meta.set_axis(index, axis=0), frame], axis=1)
+        return frame
+
+    def column(self, name: str):
+        """One feature as a view of the mapped matrix, or one metadata column as text."""
+        if name in self._feature_positions:
+            return self.values[:, self._feature_positions[name]]
+        return self.metadata()[name].to_numpy()
+
+    def stale_sources(self) -> list[str]:
+        """Source tables that changed or disappeared since the store was built."""
+        stale = []
+        for source in self.index["sources"]:
+            path = Path(source["path"])
+            if not path.is_file() or any(source[key] != value for key, value in source_signature(path).items()):
+                stale.append(source["path"])
+        return stale
+
+
+def write_info(store: FeatureStore) -> None:
+    n_subjects, n_features = store.shape
+    print(f"{store.path}: {n_subjects} subjects x {n_features} features ({store.index['dtype']})")
+    print(f"Metadata columns: {', '.join(store.index['metadata_columns']) or 'none'}")
+    for source in store.index["sources"]:
+        print(f"  {source['path']}: {source['features']} features")
+    stale = store.stale_sources()
+    if stale:
+        print(f"Stale: {len(stale)} source table(s) changed since the build; rebuild the store.")
+
+
+def main() -> None:
+    args = parse_args()
+    if args.command == "info":
+        try:
+            write_info(FeatureStore.load(Path(args.store)))
+        except (FileNotFoundError, ValueError) as exc:
+            raise SystemExit(str(exc)) from exc
+        return
+    output = Path(args.output).resolve()
+    index = build_store([Path(path) for path in args.tables], output, args.subject_cols, args.metadata_cols, args.dtype)
+    print(f"Wrote feature store: {output} ({index['subjects']} subjects x {len(index['features'])} features)")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,22 +13,50 @@ from __future__ import annotations
 import argparse
 import os
 import sys
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from dataclasses import dataclass, replace
 from pathlib import Path
+from typing import Any
+
+from braincharts_adaptation import adaptation_key, load_adaptation, save_adaptation
+from braincharts_blr import (
+    BLRStack,
+    batched_predict,
+    fit_site_adaptation,
+    load_normative_model,
+    predict_idp,
+    stack_models,
+)
+from braincharts_bundle import load_bundle, source_fingerprint
+from braincharts_design import SharedDesign, build_shared_design, fingerprint
+from braincharts_docs import DEFAULT_PHENOTYPE_FILES, DEFAULT_SITE_ID_FILE, read_model_lists
+from braincharts_deviations import INDEX_NAME, DeviationIndex
+from braincharts_incremental import STATE_NAME, plan_incremental, row_keys, write_state
+from braincharts_tables import FORMAT_SUFFIXES, require_columnar_support, write_table
+from feature_store import FeatureStore
 
 
 def parse_args() -> argparse.Namespace:
     parser = argparse.ArgumentParser(description="Run BrainCharts normative predictions for SCI_MAP.")
     parser.add_argument("--braincharts-root", required=True, help="Local clone of the braincharts repository.")
-    parser.add_argument("--test-csv", required=True, help="BrainCharts test CSV from split_braincharts_adaptation_test.py.")
-    parser.add_argument("--adaptation-csv", help="Healthy-control adaptation CSV.")
+    parser.add_argument(
+        "--test-csv",
+        required=True,
+        help="BrainCharts test CSV from split_braincharts_adaptation_test.py, or the full input table with --split-index. "
+        "A feature store directory from feature_store.py is also accepted.",
+    )
+    parser.add_argument("--adaptation-csv", help="Healthy-control adaptation CSV or feature store directory.")
     parser.add_argument("--output-dir", required=True, help="Directory for z-score outputs and model work files.")
     parser.add_argument("--model-name", default="lifespan_57K_82sites", help="BrainCharts model folder name.")
-    parser.add_argument("--site-id-file", default="site_ids_ct_82sites.txt", help="Training site ID file in braincharts/docs.")
+    parser.add_argument(
+        "--site-id-file",
+        help=f"Training site ID file in braincharts/docs. Default: {DEFAULT_SITE_ID_FILE}. Not used with --model-bundle.",
+    )
     parser.add_argument(
         "--phenotype-files",
         nargs="+",
-        default=["phenotypes_ct_lh.txt", "phenotypes_ct_rh.txt", "phenotypes_sc.txt"],
-        help="Phenotype lists in braincharts/docs.",
+        help=f"Phenotype lists in braincharts/docs. Default: {' '.join(DEFAULT_PHENOTYPE_FILES)}. "
+        "Not used with --model-bundle.",
     )
     parser.add_argument("--subject-col", default="subject", help="Subject ID column in test/adaptation CSVs.")
     parser.add_argument("--site-col", default="site", help="Site column. Default: site.")
@@ -40,12 +68,81 @@ def parse_args() -> argparse.Namespace:
     parser.add_argument("--force-adaptation", action="store_true", help="Use adaptation data even if test sites are present in the training model.")
     parser.add_argument("--allow-missing-adaptation-sites", action="store_true", help="Warn instead of failing when a test site is missing from adaptation data.")
     parser.add_argument("--z-suffix", default="_zscore", help="Suffix appended to phenotype names in z-score columns.")
-    return parser.parse_args()
-
-
-def read_lines(path: Path) -> list[str]:
-    with path.open(encoding="utf-8") as handle:
-        return [line.strip() for line in handle if line.strip()]
+    parser.add_argument(
+        "--engine",
+        choices=["pcntoolkit", "memory", "batched"],
+        default="pcntoolkit",
+        help="pcntoolkit: file-based PCNtoolkit predict() per IDP. memory: load each BLR model and predict on "
+        "in-memory arrays without text files or chdir. batched: stack all IDP models and compute every "
+        "z-score in a few matrix operations. Default: pcntoolkit.",
+    )
+    parser.add_argument(
+        "--check-reference",
+        action="store_true",
+        help="Also run the per-IDP PCNtoolkit loop and fail if its z-scores differ from the selected engine.",
+    )
+    parser.add_argument(
+        "--model-bundle",
+        help="Compiled model bundle from braincharts_bundle.py. Replaces the per-IDP model pickles and the "
+        "docs site/phenotype lists; requires --engine batched.",
+    )
+    parser.add_argument(
+        "--adaptation-cache-dir",
+        help="Directory for cached site adaptations used by --engine batched. Default: <output-dir>/adaptation_cache.",
+    )
+    parser.add_argument("--no-adaptation-cache", action="store_true", help="Always refit the site adaptation.")
+    parser.add_argument("--jobs", type=int, default=1, help="Number of workers used to run IDPs in parallel. Default: 1.")
+    parser.add_argument(
+        "--split-index",
+        help="Split index from split_braincharts_adaptation_test.py --index-out. --test-csv is then the full input "
+        "table and each replicate is scored into <output-dir>/split_NNN.",
+    )
+    parser.add_argument("--replicates", type=int, nargs="+", help="Replicate numbers to score from --split-index. Default: all.")
+    parser.add_argument(
+        "--format",
+        choices=list(FORMAT_SUFFIXES),
+        default="csv",
+        help="csv: braincharts_zscores.csv plus braincharts_test_with_zscores.csv. parquet/feather: one columnar "
+        "braincharts_zscores table with the metadata, raw IDP and z-score columns. Default: csv.",
+    )
+    parser.add_argument(
+        "--z-dtype",
+        choices=["float64", "float32"],
+        default="float64",
+        help="Storage type of the z-score columns in parquet/feather output. Default: float64.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Reuse z-scores from the previous outputs in --output-dir for rows whose subject, site, covariates "
+        "and IDP values are unchanged, and only predict new or modified rows.",
+    )
+    parser.add_argument(
+        "--deviation-thresholds",
+        type=float,
+        nargs="+",
+        help=f"Also write a sparse index of |z| above these thresholds ({INDEX_NAME}) plus per-subject and "
+        "per-cohort deviation counts, for example: 2 3 7.",
+    )
+    parser.add_argument("--cohort-col", default="cohort", help="Cohort column for the per-cohort deviation counts. Default: cohort.")
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.split_index and args.adaptation_csv:
+        parser.error("--split-index takes the adaptation controls from the index; drop --adaptation-csv")
+    if args.replicates and not args.split_index:
+        parser.error("--replicates requires --split-index")
+    if args.z_dtype != "float64" and args.format == "csv":
+        parser.error("--z-dtype requires --format parquet or feather")
+    if args.model_bundle and args.engine != "batched":
+        parser.error("--model-bundle requires --engine batched")
+    if args.model_bundle and (args.site_id_file or args.phenotype_files):
+        parser.error("--model-bundle holds its own site and phenotype lists; drop --site-id-file and --phenotype-files")
+    args.site_id_file = args.site_id_file or DEFAULT_SITE_ID_FILE
+    args.phenotype_files = args.phenotype_files or DEFAULT_PHENOTYPE_FILES
+    if args.deviation_thresholds and any(threshold < 0 for threshold in args.deviation_thresholds):
+        parser.error("--deviation-thresholds must not be negative")
+    return args
 
 
 def require_columns(frame, columns: list[str], label: str) -> None:
@@ -54,65 +151,356 @@ def require_columns(frame, columns: list[str], label: str) -> None:
         raise SystemExit(f"{label} is missing required column(s): {', '.join(missing)}")
 
 
-def main() -> None:
-    args = parse_args()
+@dataclass(frozen=True)
+class IdpContext:
+    """Inputs shared by every per-IDP prediction."""
+
+    braincharts_root: Path
+    model_dir: Path
+    work_root: Path
+    df_te: Any
+    df_ad: Any
+    design: SharedDesign
+    needs_adaptation: bool
+    engine: str
+    n_idps: int
+    adaptation_cache_dir: Path | None = None
+    adaptation_key: str | None = None
+
+
+_WORKER_CONTEXT: IdpContext | None = None
+
+
+def run_idp(idp_num: int, idp: str, context: IdpContext):
+    """Predict one IDP with the selected engine and return its z-scores."""
+    print(f"Running IDP {idp_num}/{context.n_idps}: {idp}")
+    source_model_path = context.model_dir / idp / "Models"
+    if not source_model_path.is_dir():
+        raise FileNotFoundError(f"Model files not found for {idp}: {source_model_path}")
+
+    if context.engine == "memory":
+        return run_idp_in_memory(idp, source_model_path, context)
+    return run_idp_with_files(idp, source_model_path, context)
+
+
+def run_idp_in_memory(idp: str, source_model_path: Path, context: IdpContext):
+    """Predict one IDP from its pickled BLR model on in-memory arrays."""
+    import pandas as pd
+
+    design = context.design
+    nm = load_normative_model(source_model_path)
+    y_te = pd.to_numeric(context.df_te[idp], errors="raise").to_numpy(dtype=float)
+    if context.needs_adaptation:
+        assert context.df_ad is not None
+        y_ad = pd.to_numeric(context.df_ad[idp], errors="raise").to_numpy(dtype=float)
+        _, _, z_array = predict_idp(
+            nm,
+            design.x_te,
+            y_te,
+            x_ad=design.x_ad,
+            y_ad=y_ad,
+            sitenum_te=design.sitenum_te,
+            sitenum_ad=design.sitenum_ad,
+        )
+    else:
+        _, _, z_array = predict_idp(nm, design.x_te, y_te)
+    return z_array
 
-    braincharts_root = Path(args.braincharts_root).resolve()
-    docs_dir = braincharts_root / "docs"
-    model_dir = braincharts_root / "models" / args.model_name
-    output_dir = Path(args.output_dir).resolve()
-    work_root = output_dir / "model_work"
 
-    if not docs_dir.is_dir():
-        raise SystemExit(f"BrainCharts docs directory not found: {docs_dir}")
-    if not model_dir.is_dir():
-        raise SystemExit(f"BrainCharts model directory not found: {model_dir}")
+def run_idp_with_files(idp: str, source_model_path: Path, context: IdpContext):
+    """Predict one IDP with PCNtoolkit's file-based predict() in its work directory."""
+    import numpy as np
+    import pandas as pd
+    from pcntoolkit.normative import predict
 
-    output_dir.mkdir(parents=True, exist_ok=True)
-    work_root.mkdir(parents=True, exist_ok=True)
-    sys.path.insert(0, str(braincharts_root))
+    df_te = context.df_te
+    df_ad = context.df_ad
+    design = context.design
 
-    try:
-        import numpy as np
-        import pandas as pd
-        from pcntoolkit.normative import predict
-        from pcntoolkit.util.utils import create_design_matrix
-    except ImportError as exc:
-        raise SystemExit(
-            "Missing Python dependency. Install the BrainCharts/PCNtoolkit environment "
-            "first, for example: pip install pcntoolkit==0.35"
-        ) from exc
+    idp_work_dir = context.work_root / idp
+    idp_work_dir.mkdir(parents=True, exist_ok=True)
 
-    site_ids_tr = read_lines(docs_dir / args.site_id_file)
+    y_te = pd.to_numeric(df_te[idp], errors="raise").to_numpy()
+    resp_file_te = idp_work_dir / "resp_te.txt"
+    np.savetxt(resp_file_te, y_te)
 
-    idp_ids: list[str] = []
-    for filename in args.phenotype_files:
-        idp_ids.extend(read_lines(docs_dir / filename))
-    idp_ids = list(dict.fromkeys(idp_ids))
+    cov_file_te = design.cov_file_te
 
-    df_te = pd.read_csv(args.test_csv)
-    df_te[args.site_col] = df_te[args.site_col].astype(str)
-    cols_cov = [args.age_col, args.sex_col]
-    required_test = [args.subject_col, args.site_col, args.sitenum_col] + cols_cov + idp_ids
-    require_columns(df_te, required_test, "Test CSV")
+    old_cwd = Path.cwd()
+    os.chdir(idp_work_dir)
+    try:
+        if context.needs_adaptation:
+            assert df_ad is not None
+            y_ad = pd.to_numeric(df_ad[idp], errors="raise").to_numpy()
+            resp_file_ad = idp_work_dir / "resp_ad.txt"
+            np.savetxt(resp_file_ad, y_ad)
+
+            _, _, z_values = predict(
+                str(cov_file_te),
+                alg="blr",
+                respfile=str(resp_file_te),
+                model_path=str(source_model_path),
+                inputsuffix="estimate",
+                adaptrespfile=str(resp_file_ad),
+                adaptcovfile=str(design.cov_file_ad),
+                adaptvargroupfile=str(design.sitenum_file_ad),
+                testvargroupfile=str(design.sitenum_file_te),
+            )
+        else:
+            _, _, z_values = predict(
+                str(cov_file_te),
+                alg="blr",
+                respfile=str(resp_file_te),
+                inputsuffix="estimate",
+                model_path=str(source_model_path),
+            )
+    finally:
+        os.chdir(old_cwd)
+
+    z_array = np.asarray(z_values).reshape(-1)
+    if z_array.shape[0] != df_te.shape[0]:
+        z_predict = idp_work_dir / "Z_predict.txt"
+        z_array = np.loadtxt(z_predict).reshape(-1)
+    if z_array.shape[0] != df_te.shape[0]:
+        raise ValueError(f"Z-score length mismatch for {idp}: expected {df_te.shape[0]}, got {z_array.shape[0]}")
+    return z_array
+
+
+def run_batched(
+    idp_ids: list[str],
+    context: IdpContext,
+    bundle: BLRStack | None = None,
+) -> tuple[dict[str, Any], dict[str, str]]:
+    """Predict all IDPs at once with the stacked BLR kernel.
+
+    Returns the same (results, failures) pair as :func:`run_all_idps`. IDPs
+    whose model or response column cannot be loaded are reported as failures
+    and left out of the stack. ``bundle`` supplies precompiled parameters in
+    place of the per-IDP model pickles.
+    """
+    import numpy as np
+    import pandas as pd
+
+    results: dict[str, Any] = {}
+    failures: dict[str, str] = {}
+    idps: list[str] = []
+    models = []
+    y_te_columns = []
+    y_ad_columns = []
+    for idp_num, idp in enumerate(idp_ids, start=1):
+        source_model_path = context.model_dir / idp / "Models"
+        try:
+            if bundle is None:
+                print(f"Loading IDP {idp_num}/{context.n_idps}: {idp}")
+                if not source_model_path.is_dir():
+                    raise FileNotFoundError(f"Model files not found for {idp}: {source_model_path}")
+                nm = load_normative_model(source_model_path)
+            else:
+                nm = None
+            y_te = pd.to_numeric(context.df_te[idp], errors="raise").to_numpy(dtype=float)
+            y_ad = None
+            if context.needs_adaptation:
+                y_ad = pd.to_numeric(context.df_ad[idp], errors="raise").to_numpy(dtype=float)
+        except (Exception, SystemExit) as exc:
+            failures[idp] = f"{type(exc).__name__}: {exc}"
+            continue
+        idps.append(idp)
+        models.append(nm)
+        y_te_columns.append(y_te)
+        y_ad_columns.append(y_ad)
+
+    if not idps:
+        return results, failures
+
+    if bundle is not None:
+        stack = bundle.select(idps)
+    else:
+        try:
+            stack = stack_models(idps, models)
+        except ValueError as exc:
+            raise SystemExit(f"Cannot use --engine batched: {exc} Use --engine memory instead.") from exc
+
+    design = context.design
+    adaptation = None
+    if context.needs_adaptation:
+        use_cache = context.adaptation_cache_dir is not None and context.adaptation_key is not None
+        if use_cache:
+            adaptation = load_adaptation(context.adaptation_cache_dir, context.adaptation_key, idps)
+        if adaptation is not None:
+            print(f"Reusing cached site adaptation {context.adaptation_key[:12]}")
+        else:
+            print(f"Fitting site adaptation for {len(idps)} IDPs")
+            adaptation = fit_site_adaptation(stack, design.x_ad, np.column_stack(y_ad_columns), design.sitenum_ad)
+            if use_cache:
+                save_adaptation(context.adaptation_cache_dir, context.adaptation_key, adaptation)
+
+    print(f"Predicting {len(idps)} IDPs for {context.df_te.shape[0]} subjects in one batch")
+    _, _, z = batched_predict(
+        stack,
+        design.x_te,
+        np.column_stack(y_te_columns),
+        adaptation=adaptation,
+        sitenum_te=design.sitenum_te,
+    )
+
+    for position, idp in enumerate(idps):
+        results[idp] = np.ascontiguousarray(z[:, position])
+    return results, failures
+
+
+def check_against_reference(
+    idp_ids: list[str],
+    context: IdpContext,
+    jobs: int,
+    results: dict[str, Any],
+    failures: dict[str, str],
+) -> None:
+    """Rerun the per-IDP PCNtoolkit loop and compare its z-scores with ``results``."""
+    import numpy as np
+
+    print("Running the per-IDP PCNtoolkit reference for comparison")
+    reference, reference_failures = run_all_idps(idp_ids, replace(context, engine="pcntoolkit"), jobs)
+    mismatched = sorted(set(results) ^ set(reference))
+    max_diff = 0.0
+    for idp in idp_ids:
+        if idp in results and idp in reference:
+            diff = np.abs(results[idp] - reference[idp])
+            if np.any(np.isnan(results[idp]) != np.isnan(reference[idp])):
+                mismatched.append(idp)
+                continue
+            if diff.size and not np.all(np.isnan(diff)):
+                max_diff = max(max_diff, float(np.nanmax(diff)))
+            if not np.allclose(results[idp], reference[idp], rtol=1e-8, atol=1e-8, equal_nan=True):
+                mismatched.append(idp)
+    print(f"Reference check: max |z difference| = {max_diff:.3g} over {len(reference)} IDP(s)")
+    if set(failures) != set(reference_failures):
+        print("WARNING: engine and reference failed on different IDPs", file=sys.stderr)
+    if mismatched:
+        raise SystemExit("Z-scores differ from the PCNtoolkit reference for: " + ", ".join(sorted(set(mismatched))))
+
+
+def _init_worker(context: IdpContext) -> None:
+    global _WORKER_CONTEXT
+    _WORKER_CONTEXT = context
+    if str(context.braincharts_root) not in sys.path:
+        sys.path.insert(0, str(context.braincharts_root))
+
+
+def _run_idp_in_worker(idp_num: int, idp: str):
+    assert _WORKER_CONTEXT is not None
+    return run_idp(idp_num, idp, _WORKER_CONTEXT)
+
+
+def run_all_idps(idp_ids: list[str], context: IdpContext, jobs: int) -> tuple[dict[str, Any], dict[str, str]]:
+    """Run every IDP, serially or across a worker pool.
+
+    Returns z-score arrays keyed by IDP and error messages for the IDPs that
+    failed. One failing IDP does not stop the others; callers restore the
+    original IDP order from ``idp_ids``.
+    """
+    results: dict[str, Any] = {}
+    failures: dict[str, str] = {}
+
+    if jobs == 1:
+        for idp_num, idp in enumerate(idp_ids, start=1):
+            try:
+                results[idp] = run_idp(idp_num, idp, context)
+            except (Exception, SystemExit) as exc:
+                failures[idp] = f"{type(exc).__name__}: {exc}"
+        return results, failures
+
+    if context.engine == "memory":
+        # The in-memory engine never changes directory or writes per-IDP
+        # files, so IDPs can share the arrays on threads.
+        executor = ThreadPoolExecutor(max_workers=jobs)
+        submit = lambda idp_num, idp: executor.submit(run_idp, idp_num, idp, context)  # noqa: E731
+    else:
+        # PCNtoolkit's predict() works relative to the current directory, so
+        # each IDP needs its own process.
+        executor = ProcessPoolExecutor(max_workers=jobs, initializer=_init_worker, initargs=(context,))
+        submit = lambda idp_num, idp: executor.submit(_run_idp_in_worker, idp_num, idp)  # noqa: E731
+
+    with executor:
+        futures = {submit(idp_num, idp): idp for idp_num, idp in enumerate(idp_ids, start=1)}
+        for future, idp in futures.items():
+            try:
+                results[idp] = future.result()
+            except (Exception, SystemExit) as exc:
+                failures[idp] = f"{type(exc).__name__}: {exc}"
+    return results, failures
+
+
+@dataclass(frozen=True)
+class ModelInputs:
+    """The BrainCharts model, IDP list and training sites shared by every test set."""
+
+    braincharts_root: Path
+    model_dir: Path
+    idp_ids: list[str]
+    site_ids_tr: list[str]
+    bundle: BLRStack | None = None
+    model_fingerprint: str | None = None
+
+
+def read_input(path: str, idp_ids: list[str]):
+    """Read a test/adaptation CSV, or the metadata and IDP columns of a feature store as float64."""
+    import pandas as pd
+
+    if not FeatureStore.is_store(Path(path)):
+        return pd.read_csv(path)
+    store = FeatureStore.load(Path(path))
+    available = set(store.features)
+    features = [idp for idp in idp_ids if idp in available]
+    return store.frame(features=features, metadata=store.index["metadata_columns"], dtype=float).reset_index()
+
+
+def prepare_frame(frame, args: argparse.Namespace, idp_ids: list[str], label: str):
+    """Check the required columns of a test/adaptation table and coerce its covariates."""
+    import pandas as pd
 
+    cols_cov = [args.age_col, args.sex_col]
+    require_columns(frame, [args.subject_col, args.site_col, args.sitenum_col] + cols_cov + idp_ids, label)
+    frame[args.site_col] = frame[args.site_col].astype(str)
     for col in cols_cov + [args.sitenum_col]:
-        df_te[col] = pd.to_numeric(df_te[col], errors="raise")
+        frame[col] = pd.to_numeric(frame[col], errors="raise")
+    return frame
+
+
+def needs_site_adaptation(args: argparse.Namespace, df_te, site_ids_tr: list[str]) -> bool:
+    site_ids_te = set(df_te[args.site_col].to_list())
+    return args.force_adaptation or not all(site in site_ids_tr for site in site_ids_te)
+
+
+def score_test_set(
+    args: argparse.Namespace,
+    model: ModelInputs,
+    df_te,
+    df_ad,
+    output_dir: Path,
+    cache_dir: Path | None,
+) -> dict[str, str]:
+    """Score one test set, write its outputs to ``output_dir`` and return the failed IDPs.
+
+    ``df_ad`` is the adaptation table, or None when none was provided; it is
+    only used if a test site is missing from the training sites or
+    ``--force-adaptation`` is set.
+    """
+    import numpy as np
+    import pandas as pd
+
+    idp_ids = model.idp_ids
+    site_ids_tr = model.site_ids_tr
+    model_fingerprint = model.model_fingerprint
+    cols_cov = [args.age_col, args.sex_col]
+    output_dir.mkdir(parents=True, exist_ok=True)
 
     site_ids_te = sorted(set(df_te[args.site_col].to_list()))
-    needs_adaptation = args.force_adaptation or not all(site in site_ids_tr for site in site_ids_te)
-
-    df_ad = None
-    if needs_adaptation:
-        if not args.adaptation_csv:
-            raise SystemExit("Adaptation is required for at least one test site; provide --adaptation-csv.")
-        df_ad = pd.read_csv(args.adaptation_csv)
-        df_ad[args.site_col] = df_ad[args.site_col].astype(str)
-        required_ad = [args.subject_col, args.site_col, args.sitenum_col] + cols_cov + idp_ids
-        require_columns(df_ad, required_ad, "Adaptation CSV")
-        for col in cols_cov + [args.sitenum_col]:
-            df_ad[col] = pd.to_numeric(df_ad[col], errors="raise")
-
+    needs_adaptation = needs_site_adaptation(args, df_te, site_ids_tr)
+    if not needs_adaptation:
+        df_ad = None
+    elif df_ad is None:
+        raise SystemExit("Adaptation is required for at least one test site; provide --adaptation-csv.")
+    else:
         missing_ad_sites = sorted(set(site_ids_te) - set(df_ad[args.site_col].to_list()))
         if missing_ad_sites and not args.allow_missing_adaptation_sites:
             raise SystemExit(
@@ -123,88 +511,99 @@ def main() -> None:
         if missing_ad_sites:
             print("WARNING: Missing adaptation site(s): " + ", ".join(missing_ad_sites), file=sys.stderr)
 
-    z_scores = {}
-    summary_rows = []
-
-    for idp_num, idp in enumerate(idp_ids, start=1):
-        print(f"Running IDP {idp_num}/{len(idp_ids)}: {idp}")
-        source_idp_dir = model_dir / idp
-        source_model_path = source_idp_dir / "Models"
-        if not source_model_path.is_dir():
-            raise SystemExit(f"Model files not found for {idp}: {source_model_path}")
-
-        idp_work_dir = work_root / idp
-        idp_work_dir.mkdir(parents=True, exist_ok=True)
-
-        y_te = pd.to_numeric(df_te[idp], errors="raise").to_numpy()
-        resp_file_te = idp_work_dir / "resp_te.txt"
-        np.savetxt(resp_file_te, y_te)
-
-        cov_file_te = idp_work_dir / "cov_bspline_te.txt"
-        x_te = create_design_matrix(
-            df_te[cols_cov],
-            site_ids=df_te[args.site_col],
-            all_sites=site_ids_tr,
-            basis="bspline",
-            xmin=args.xmin,
-            xmax=args.xmax,
+    cache_key = None
+    if needs_adaptation and (cache_dir is not None or args.incremental):
+        cache_key = adaptation_key(
+            df_ad,
+            idp_ids,
+            cols_cov,
+            args.site_col,
+            args.sitenum_col,
+            site_ids_tr,
+            args.xmin,
+            args.xmax,
+            args.model_name,
+            model_fingerprint,
         )
-        np.savetxt(cov_file_te, x_te)
 
-        old_cwd = Path.cwd()
-        os.chdir(idp_work_dir)
-        try:
-            if needs_adaptation:
-                assert df_ad is not None
-                y_ad = pd.to_numeric(df_ad[idp], errors="raise").to_numpy()
-                resp_file_ad = idp_work_dir / "resp_ad.txt"
-                np.savetxt(resp_file_ad, y_ad)
-
-                cov_file_ad = idp_work_dir / "cov_bspline_ad.txt"
-                x_ad = create_design_matrix(
-                    df_ad[cols_cov],
-                    site_ids=df_ad[args.site_col],
-                    all_sites=site_ids_tr,
-                    basis="bspline",
-                    xmin=args.xmin,
-                    xmax=args.xmax,
-                )
-                np.savetxt(cov_file_ad, x_ad)
-
-                sitenum_file_ad = idp_work_dir / "sitenum_ad.txt"
-                sitenum_file_te = idp_work_dir / "sitenum_te.txt"
-                np.savetxt(sitenum_file_ad, df_ad[args.sitenum_col].to_numpy(dtype=int))
-                np.savetxt(sitenum_file_te, df_te[args.sitenum_col].to_numpy(dtype=int))
-
-                _, _, z_values = predict(
-                    str(cov_file_te),
-                    alg="blr",
-                    respfile=str(resp_file_te),
-                    model_path=str(source_model_path),
-                    inputsuffix="estimate",
-                    adaptrespfile=str(resp_file_ad),
-                    adaptcovfile=str(cov_file_ad),
-                    adaptvargroupfile=str(sitenum_file_ad),
-                    testvargroupfile=str(sitenum_file_te),
-                )
-            else:
-                _, _, z_values = predict(
-                    str(cov_file_te),
-                    alg="blr",
-                    respfile=str(resp_file_te),
-                    inputsuffix="estimate",
-                    model_path=str(source_model_path),
-                )
-        finally:
-            os.chdir(old_cwd)
-
-        z_array = np.asarray(z_values).reshape(-1)
-        if z_array.shape[0] != df_te.shape[0]:
-            z_predict = idp_work_dir / "Z_predict.txt"
-            z_array = np.loadtxt(z_predict).reshape(-1)
-        if z_array.shape[0] != df_te.shape[0]:
-            raise SystemExit(f"Z-score length mismatch for {idp}: expected {df_te.shape[0]}, got {z_array.shape[0]}")
+    work_root = output_dir / "model_work"
+    work_root.mkdir(parents=True, exist_ok=True)
+    z_only_path = output_dir / f"braincharts_zscores{FORMAT_SUFFIXES[args.format]}"
+    full_path = output_dir / "braincharts_test_with_zscores.csv"
+    summary_path = output_dir / "braincharts_zscore_summary.csv"
+    z_columns = [f"{idp}{args.z_suffix}" for idp in idp_ids]
+
+    df_run = df_te
+    reuse = np.zeros(df_te.shape[0], dtype=bool)
+    previous_z: dict[str, Any] = {col: np.empty(0) for col in z_columns}
+    if args.incremental:
+        keys = row_keys(df_te, args.subject_col, [args.site_col, args.sitenum_col] + cols_cov + idp_ids)
+        run_fingerprint = fingerprint(
+            "incremental",
+            args.model_name,
+            model_fingerprint,
+            list(site_ids_tr),
+            list(cols_cov),
+            float(args.xmin),
+            float(args.xmax),
+            args.engine,
+            args.z_dtype,
+            args.format,
+            needs_adaptation,
+            cache_key if needs_adaptation else None,
+        )
+        plan = plan_incremental(output_dir, z_only_path, keys, run_fingerprint, z_columns)
+        reuse, previous_z = plan.reuse, plan.previous_z
+        df_run = df_te.loc[~reuse].reset_index(drop=True)
+        print(f"Incremental run: reusing {int(reuse.sum())} row(s), scoring {df_run.shape[0]} new or modified row(s)")
+
+    if df_run.shape[0] == 0:
+        print("No new or modified rows to score")
+        results: dict[str, Any] = {idp: np.empty(0) for idp in idp_ids}
+        failures: dict[str, str] = {}
+    else:
+        design = build_shared_design(
+            work_root,
+            df_run,
+            df_ad if needs_adaptation else None,
+            cols_cov,
+            args.site_col,
+            args.sitenum_col,
+            site_ids_tr,
+            args.xmin,
+            args.xmax,
+        )
+        context = IdpContext(
+            braincharts_root=model.braincharts_root,
+            model_dir=model.model_dir,
+            work_root=work_root,
+            df_te=df_run,
+            df_ad=df_ad,
+            design=design,
+            needs_adaptation=needs_adaptation,
+            engine=args.engine,
+            n_idps=len(idp_ids),
+            adaptation_cache_dir=cache_dir,
+            adaptation_key=cache_key,
+        )
+        if args.engine == "batched":
+            results, failures = run_batched(idp_ids, context, model.bundle)
+        else:
+            results, failures = run_all_idps(idp_ids, context, args.jobs)
+        if args.check_reference:
+            check_against_reference(idp_ids, context, args.jobs, results, failures)
 
+    z_scores = {}
+    summary_rows = []
+    for idp in idp_ids:
+        if idp not in results:
+            continue
+        z_array = results[idp]
+        if args.incremental:
+            # Reused rows come from the previous table, the rest were just scored.
+            z_array = np.empty(df_te.shape[0])
+            z_array[reuse] = previous_z[f"{idp}{args.z_suffix}"]
+            z_array[~reuse] = results[idp]
         z_scores[f"{idp}{args.z_suffix}"] = z_array
         summary_rows.append(
             {
@@ -219,24 +618,174 @@ def main() -> None:
         )
 
     z_df = pd.DataFrame(z_scores)
-    idp_set = set(idp_ids)
-    metadata_cols = [col for col in df_te.columns if col not in idp_set]
-    z_only = pd.concat([df_te[metadata_cols].reset_index(drop=True), z_df], axis=1)
-    full_with_z = pd.concat([df_te.reset_index(drop=True), z_df], axis=1)
     summary = pd.DataFrame(summary_rows)
-
-    z_only_path = output_dir / "braincharts_zscores.csv"
-    full_path = output_dir / "braincharts_test_with_zscores.csv"
-    summary_path = output_dir / "braincharts_zscore_summary.csv"
-
-    z_only.to_csv(z_only_path, index=False)
-    full_with_z.to_csv(full_path, index=False)
+    written = [z_only_path]
+    if args.format == "csv":
+        idp_set = set(idp_ids)
+        metadata_cols = [col for col in df_te.columns if col not in idp_set]
+        z_only = pd.concat([df_te[metadata_cols].reset_index(drop=True), z_df], axis=1)
+        full_with_z = pd.concat([df_te.reset_index(drop=True), z_df], axis=1)
+        z_only.to_csv(z_only_path, index=False)
+        full_with_z.to_csv(full_path, index=False)
+        written.append(full_path)
+    else:
+        # One table: metadata and raw IDPs once, then the typed z-score columns.
+        table = df_te.reset_index(drop=True)
+        table[idp_ids] = table[idp_ids].apply(pd.to_numeric, errors="coerce").astype("float64")
+        table = pd.concat([table, z_df.astype(args.z_dtype)], axis=1)
+        write_table(table, z_only_path)
     summary.to_csv(summary_path, index=False)
+    written.append(summary_path)
+
+    scored_idps = [idp for idp in idp_ids if idp in results]
+    if args.deviation_thresholds and not scored_idps:
+        print("WARNING: no IDP was scored; skipping the deviation index", file=sys.stderr)
+    elif args.deviation_thresholds:
+        index = DeviationIndex.build(
+            z_df.to_numpy(dtype=float),
+            df_te[args.subject_col].astype(str).to_list(),
+            scored_idps,
+            args.deviation_thresholds,
+            df_te[args.cohort_col].astype(str).to_list() if args.cohort_col in df_te.columns else None,
+        )
+        written.append(index.save(output_dir / INDEX_NAME))
+        written.extend(index.write_reports(output_dir))
 
     print("Wrote:")
-    print(f"  {z_only_path}")
-    print(f"  {full_path}")
-    print(f"  {summary_path}")
+    for path in written:
+        print(f"  {path}")
+
+    state_path = output_dir / STATE_NAME
+    if args.incremental and not failures:
+        write_state(output_dir, keys, run_fingerprint, z_columns)
+        print(f"  {state_path}")
+    elif state_path.exists():
+        # These outputs are incomplete or were not keyed; never reuse them.
+        state_path.unlink()
+
+    failures_path = output_dir / "braincharts_failed_idps.csv"
+    if failures:
+        pd.DataFrame(
+            [{"phenotype": idp, "error": failures[idp]} for idp in idp_ids if idp in failures]
+        ).to_csv(failures_path, index=False)
+        print(f"  {failures_path}")
+        for idp in idp_ids:
+            if idp in failures:
+                print(f"ERROR: {idp}: {failures[idp]}", file=sys.stderr)
+    elif failures_path.exists():
+        # Left by an earlier run; this run had no failures.
+        failures_path.unlink()
+    return failures
+
+
+def read_split_index(path: Path, subjects, selected: list[int] | None) -> dict[str, Any]:
+    """Return ``{replicate column: a/t assignment aligned with subjects}`` from a split index."""
+    import pandas as pd
+
+    index = pd.read_csv(path, dtype=str, keep_default_na=False)
+    if "subject" not in index.columns:
+        raise SystemExit(f"Split index {path} has no subject column")
+    if index["subject"].duplicated().any():
+        raise SystemExit(f"Split index {path} lists a subject more than once")
+    columns = [col for col in index.columns if col.startswith("split_")]
+    if selected:
+        wanted = [f"split_{number:03d}" for number in selected]
+        missing = [col for col in wanted if col not in columns]
+        if missing:
+            raise SystemExit(f"Split index {path} has no replicate(s): {', '.join(missing)}")
+        columns = wanted
+    if not columns:
+        raise SystemExit(f"Split index {path} has no split_* columns")
+
+    index = index.set_index("subject")
+    unknown = sorted(set(subjects) - set(index.index))
+    if unknown:
+        raise SystemExit(f"{len(unknown)} input subject(s) are not in split index {path}, e.g. {unknown[0]}")
+    aligned = index.loc[subjects.to_list(), columns]
+    return {col: aligned[col].to_numpy() for col in columns}
+
+
+def main() -> None:
+    args = parse_args()
+
+    braincharts_root = Path(args.braincharts_root).resolve()
+    docs_dir = braincharts_root / "docs"
+    model_dir = braincharts_root / "models" / args.model_name
+    output_dir = Path(args.output_dir).resolve()
+
+    if not docs_dir.is_dir():
+        raise SystemExit(f"BrainCharts docs directory not found: {docs_dir}")
+    if not model_dir.is_dir():
+        raise SystemExit(f"BrainCharts model directory not found: {model_dir}")
+
+    output_dir.mkdir(parents=True, exist_ok=True)
+    sys.path.insert(0, str(braincharts_root))
+
+    try:
+        import pandas  # noqa: F401
+        import pcntoolkit.normative  # noqa: F401 - fail before any IDP runs
+        import pcntoolkit.util.utils  # noqa: F401
+    except ImportError as exc:
+        raise SystemExit(
+            "Missing Python dependency. Install the BrainCharts/PCNtoolkit environment "
+            "first, for example: pip install pcntoolkit==0.35"
+        ) from exc
+    require_columnar_support(args.format)
+
+    bundle = None
+    if args.model_bundle:
+        try:
+            bundle, bundle_index = load_bundle(Path(args.model_bundle).resolve())
+        except (OSError, ValueError) as exc:
+            raise SystemExit(str(exc)) from exc
+        if bundle_index["model_name"] != args.model_name:
+            raise SystemExit(f"Model bundle was compiled from {bundle_index['model_name']}, not {args.model_name}.")
+        site_ids_tr = list(bundle_index["site_ids"])
+        idp_ids = list(bundle.idps)
+        model_fingerprint = source_fingerprint(model_dir, idp_ids, site_ids_tr)
+        if model_fingerprint != bundle_index["source_fingerprint"]:
+            raise SystemExit(f"Model bundle {args.model_bundle} is stale; recompile it with braincharts_bundle.py.")
+    else:
+        site_ids_tr, idp_ids = read_model_lists(docs_dir, args.site_id_file, args.phenotype_files)
+        model_fingerprint = None
+        if args.incremental or (args.engine == "batched" and not args.no_adaptation_cache):
+            model_fingerprint = source_fingerprint(model_dir, idp_ids, site_ids_tr)
+
+    model = ModelInputs(
+        braincharts_root=braincharts_root,
+        model_dir=model_dir,
+        idp_ids=idp_ids,
+        site_ids_tr=site_ids_tr,
+        bundle=bundle,
+        model_fingerprint=model_fingerprint,
+    )
+    cache_dir = None
+    if args.engine == "batched" and not args.no_adaptation_cache:
+        cache_dir = Path(args.adaptation_cache_dir).resolve() if args.adaptation_cache_dir else output_dir / "adaptation_cache"
+
+    if args.split_index:
+        df_all = prepare_frame(read_input(args.test_csv, idp_ids), args, idp_ids, "Input CSV")
+        replicates = read_split_index(Path(args.split_index), df_all[args.subject_col].astype(str), args.replicates)
+        failed = 0
+        for number, (name, assignment) in enumerate(replicates.items(), start=1):
+            print(f"Replicate {number}/{len(replicates)}: {name}")
+            df_te = df_all.loc[assignment == "t"].reset_index(drop=True)
+            df_ad = df_all.loc[assignment == "a"].reset_index(drop=True)
+            failures = score_test_set(args, model, df_te, df_ad, output_dir / name, cache_dir)
+            failed += bool(failures)
+        if failed:
+            raise SystemExit(f"IDP failures in {failed} of {len(replicates)} replicate(s); see braincharts_failed_idps.csv in each")
+        return
+
+    df_te = prepare_frame(read_input(args.test_csv, idp_ids), args, idp_ids, "Test CSV")
+    df_ad = None
+    if needs_site_adaptation(args, df_te, site_ids_tr) and args.adaptation_csv:
+        df_ad = prepare_frame(read_input(args.adaptation_csv, idp_ids), args, idp_ids, "Adaptation CSV")
+
+    failures = score_test_set(args, model, df_te, df_ad, output_dir, cache_dir)
+    if failures:
+        failures_path = output_dir / "braincharts_failed_idps.csv"
+        raise SystemExit(f"{len(failures)} of {len(idp_ids)} IDP(s) failed; see {failures_path}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""Build the joined FreeSurfer table in parallel, with a per-subject cache.
+
+This is a Python alternative to build_freesurfer_sheet.sh (and to the
+aparcstats2table/asegstats2table calls in aparc_aseg_pybrain.sh) that does
+not need FreeSurfer to be sourced. Every subject folder holding
+``stats/aseg.stats`` is parsed in a process pool. The parsed row is stored in
+a SQLite cache keyed on the mtime and size of the stats files it was read
+from, so a rerun only parses new or changed subjects. A subject whose stats
+cannot be parsed is listed in ``_dbg_scan_failures.csv`` and left out instead
+of stopping the run.
+
+Columns follow aparcstats2table and asegstats2table:
+``<hemi>_<region>_thickness`` and ``<hemi>_MeanThickness_thickness``,
+``<hemi>_<region>_area`` and ``<hemi>_WhiteSurfArea_area``, aseg volumes by
+structure name followed by the aseg measures (``eTIV`` is written as
+``EstimatedTotalIntraCranialVol``). The per-table ``BrainSegVolNotVent`` and
+``eTIV`` columns that aparcstats2table repeats in every table are not
+repeated. Usage::
+
+    python Step_3_BrainCharts_Normative_Modeling/scan_freesurfer_stats.py \\
+      --derivs /path/to/freesurfer_outputs \\
+      --outdir /path/to/outputs \\
+      --jobs 8
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import os
+import re
+import sqlite3
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import Any, Iterable
+
+# The stats-file parser is shared with the Step 8 aggregator.
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "Step_8_Data_Aggregation"))
+from freesurfer_stats import read_stats  # noqa: E402
+
+
+CACHE_VERSION = 1
+CACHE_NAME = "_scan_cache.sqlite"
+JOINED_NAME = "_dbg_joined_all.csv"
+FAILURES_NAME = "_dbg_scan_failures.csv"
+# Joined column order of build_freesurfer_sheet.sh
+BLOCKS = ["lh_thickness", "rh_thickness", "aseg", "lh_area", "rh_area"]
+APARC_MEASURES = {"thickness": ("ThickAvg", "MeanThickness"), "area": ("SurfArea", "WhiteSurfArea")}
+# Columns dropped by aparc_aseg_pybrain.sh from the asegstats2table output
+PYBRAIN_DROPPED = {
+    "5th-Ventricle", "WM-hypointensities", "Left-WM-hypointensities", "Right-WM-hypointensities",
+    "non-WM-hypointensities", "Left-non-WM-hypointensities", "Right-non-WM-hypointensities",
+    "Optic-Chiasm", "CC_Posterior", "CC_Mid_Posterior", "CC_Central", "CC_Mid_Anterior",
+    "CC_Anterior", "BrainSegVol", "BrainSegVolNotVent", "lhCortexVol", "rhCortexVol",
+    "CortexVol", "lhCerebralWhiteMatterVol", "rhCerebralWhiteMatterVol",
+    "CerebralWhiteMatterVol", "MaskVol", "BrainSegVol-to-eTIV", "MaskVol-to-eTIV",
+    "lhSurfaceHoles", "rhSurfaceHoles", "SurfaceHoles",
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Parse FreeSurfer stats folders in parallel into the joined BrainCharts input table.")
+    parser.add_argument("--derivs", required=True, help="Directory containing FreeSurfer subject folders.")
+    parser.add_argument("--outdir", required=True, help=f"Output directory for {JOINED_NAME}.")
+    parser.add_argument("--parc", default="aparc.a2009s", help="FreeSurfer cortical parcellation. Default: aparc.a2009s.")
+    parser.add_argument("--subject-regex", help="Only keep subject folders whose name matches this regular expression.")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1, help="Worker processes. Default: all CPUs.")
+    parser.add_argument("--cache", help=f"SQLite cache of parsed subjects. Default: <outdir>/{CACHE_NAME}.")
+    parser.add_argument("--no-cache", action="store_true", help="Parse every subject and leave the cache untouched.")
+    parser.add_argument(
+        "--pybrain-out",
+        help="Also write the tab-separated PyBrainAge feature table of aparc_aseg_pybrain.sh "
+        "(ID, thickness columns, aseg volumes) to this path.",
+    )
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return args
+
+
+def find_subjects(derivs: Path, subject_regex: str | None = None) -> dict[str, Path]:
+    """Subject name to folder for every ``<subject>/stats/aseg.stats`` under ``derivs``.
+
+    The first folder in sorted path order wins when two share a name.
+    """
+    pattern = re.compile(subject_regex) if subject_regex else None
+    found = []
+    for root, _, files in os.walk(derivs, followlinks=True):
+        if "aseg.stats" in files and os.path.basename(root) == "stats":
+            found.append(Path(root).parent)
+    subjects: dict[str, Path] = {}
+    for subject_dir in sorted(found):
+        if pattern and not pattern.search(subject_dir.name):
+            continue
+        subjects.setdefault(subject_dir.name, subject_dir)
+    return dict(sorted(subjects.items()))
+
+
+def stats_files(subject_dir: Path, parc: str) -> dict[str, Path]:
+    stats_dir = subject_dir / "stats"
+    return {
+        "aseg": stats_dir / "aseg.stats",
+        "lh": stats_dir / f"lh.{parc}.stats",
+        "rh": stats_dir / f"rh.{parc}.stats",
+    }
+
+
+def signature(subject_dir: Path, parc: str) -> str:
+    """Cache key: parser version, parcellation and the mtime and size of each stats file."""
+    parts: list[Any] = [CACHE_VERSION, parc]
+    for name, path in stats_files(subject_dir, parc).items():
+        try:
+            info = path.stat()
+            parts.append([name, info.st_mtime_ns, info.st_size])
+        except FileNotFoundError:
+            parts.append([name, None, None])
+    return json.dumps(parts)
+
+
+def _number(value: str) -> str:
+    # aparcstats2table/asegstats2table print the parsed float
+    return str(float(value))
+
+
+def parse_subject(subject_dir: Path, parc: str) -> dict[str, dict[str, str]]:
+    """Parse one subject into the column blocks of the joined table; missing hemispheres give empty blocks."""
+    files = stats_files(subject_dir, parc)
+    aseg = read_stats(files["aseg"])
+    blocks: dict[str, dict[str, str]] = {}
+
+    row = aseg.table("StructName", "Volume_mm3", min_fields=5)
+    for fields in aseg.measures:
+        if len(fields) > 3:
+            name = "EstimatedTotalIntraCranialVol" if fields[1] == "eTIV" else fields[1]
+            row[name] = fields[3]
+    blocks["aseg"] = {name: _number(value) for name, value in row.items()}
+
+    for hemi in ["lh", "rh"]:
+        stats = read_stats(files[hemi]) if files[hemi].is_file() else None
+        for meas, (column, total) in APARC_MEASURES.items():
+            block = {}
+            if stats is not None:
+                for region, value in stats.table("StructName", column).items():
+                    block[f"{hemi}_{region}_{meas}"] = _number(value)
+                total_value = stats.measure(total)
+                if total_value is not None:
+                    block[f"{hemi}_{total}_{meas}"] = _number(total_value)
+            blocks[f"{hemi}_{meas}"] = block
+    return blocks
+
+
+def _parse_job(job: tuple[str, str, str]) -> tuple[str, dict[str, Any] | None, str | None]:
+    subject, subject_dir, parc = job
+    try:
+        return subject, parse_subject(Path(subject_dir), parc), None
+    except Exception as exc:  # noqa: BLE001 - one bad subject must not stop the scan
+        return subject, None, f"{type(exc).__name__}: {exc}"
+
+
+class ScanCache:
+    """SQLite store of parsed subjects keyed on their stats-file signature."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS subjects (subject TEXT PRIMARY KEY, signature TEXT NOT NULL, blocks TEXT NOT NULL)"
+        )
+
+    def lookup(self, signatures: dict[str, str]) -> dict[str, dict[str, Any]]:
+        """Cached blocks of the subjects whose signature is unchanged."""
+        hits = {}
+        for subject, stored, blocks in self.connection.execute("SELECT subject, signature, blocks FROM subjects"):
+            if signatures.get(subject) == stored:
+                hits[subject] = json.loads(blocks)
+        return hits
+
+    def store(self, rows: Iterable[tuple[str, str, dict[str, Any]]]) -> None:
+        with self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO subjects (subject, signature, blocks) VALUES (?, ?, ?)",
+                [(subject, sig, json.dumps(blocks)) for subject, sig, blocks in rows],
+            )
+
+    def prune(self, keep: Iterable[str]) -> None:
+        """Drop subjects that are no longer in the derivatives tree."""
+        keep = set(keep)
+        stale = [(subject,) for (subject,) in self.connection.execute("SELECT subject FROM subjects") if subject not in keep]
+        with self.connection:
+            self.connection.executemany("DELETE FROM subjects WHERE subject = ?", stale)
+
+    def close(self) -> None:
+        self.connection.close()
+
+
+def scan(
+    subjects: dict[str, Path], parc: str, jobs: int, cache: ScanCache | None, prune: bool = True
+) -> tuple[dict[str, Any], dict[str, str]]:
+    """Parsed blocks per subject (cached or freshly parsed) and the subjects that failed.
+
+    With ``prune``, cached subjects not in ``subjects`` are dropped; pass False
+    when ``subjects`` is a filtered subset of the tree.
+    """
+    signatures = {subject: signature(path, parc) for subject, path in subjects.items()}
+    parsed = cache.lookup(signatures) if cache else {}
+    todo = [(subject, str(path), parc) for subject, path in subjects.items() if subject not in parsed]
+    print(f"Subjects: {len(subjects)} ({len(parsed)} cached, {len(todo)} to parse)")
+
+    if jobs > 1 and len(todo) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_parse_job, todo, chunksize=max(1, len(todo) // (jobs * 8))))
+    else:
+        results = [_parse_job(job) for job in todo]
+
+    failures = {subject: error for subject, _, error in results if error is not None}
+    fresh = [(subject, signatures[subject], blocks) for subject, blocks, error in results if error is None]
+    parsed.update({subject: blocks for subject, _, blocks in fresh})
+    if cache:
+        cache.store(fresh)
+        if prune:
+            cache.prune(subjects)
+    return {subject: parsed[subject] for subject in subjects if subject in parsed}, failures
+
+
+def write_joined(path: Path, parsed: dict[str, Any], blocks: list[str], id_col: str, delimiter: str = ",", drop: set[str] | None = None) -> None:
+    """Write one row per subject; each block's columns are in first-seen order across subjects."""
+    drop = drop or set()
+    columns = []
+    for block in blocks:
+        columns.extend(dict.fromkeys(name for row in parsed.values() for name in row[block] if name not in drop))
+    lookups = {subject: {name: value for block in blocks for name, value in row[block].items()} for subject, row in parsed.items()}
+    with path.open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle, delimiter=delimiter, lineterminator="\n")
+        writer.writerow([id_col, *columns])
+        for subject, values in lookups.items():
+            writer.writerow([subject, *(values.get(name, "") for name in columns)])
+
+
+def main() -> None:
+    args = parse_args()
+    derivs = Path(args.derivs)
+    outdir = Path(args.outdir)
+    if not derivs.is_dir():
+        raise SystemExit(f"FreeSurfer output directory not found: {derivs}")
+    subjects = find_subjects(derivs, args.subject_regex)
+    if not subjects:
+        raise SystemExit(f"No FreeSurfer subjects with stats/aseg.stats were found under {derivs}")
+    outdir.mkdir(parents=True, exist_ok=True)
+
+    cache = None if args.no_cache else ScanCache(Path(args.cache) if args.cache else outdir / CACHE_NAME)
+    try:
+        parsed, failures = scan(subjects, args.parc, args.jobs, cache, prune=not args.subject_regex)
+    finally:
+        if cache:
+            cache.close()
+
+    for subject, row in parsed.items():
+        missing = [hemi for hemi in ["lh", "rh"] if not row[f"{hemi}_thickness"]]
+        if missing:
+            print(f"WARNING: {subject} has no {'/'.join(missing)}.{args.parc}.stats; its cortical columns are empty", file=sys.stderr)
+
+    failures_path = outdir / FAILURES_NAME
+    if failures:
+        with failures_path.open("w", newline="", encoding="utf-8") as handle:
+            writer = csv.writer(handle, lineterminator="\n")
+            writer.writerow(["subject", "error"])
+            writer.writerows(failures.items())
+        for subject, error in failures.items():
+            print(f"ERROR: {subject}: {error}", file=sys.stderr)
+    elif failures_path.exists():
+        failures_path.unlink()
+    if not parsed:
+        raise SystemExit(f"None of the {len(subjects)} subjects could be parsed; see {failures_path}")
+
+    written = [outdir / JOINED_NAME]
+    write_joined(written[0], parsed, BLOCKS, "subject_id")
+    if args.pybrain_out:
+        written.append(Path(args.pybrain_out))
+        write_joined(written[-1], parsed, ["lh_thickness", "rh_thickness", "aseg"], "ID", delimiter="\t", drop=PYBRAIN_DROPPED)
+    if failures:
+        written.append(failures_path)
+
+    print("Wrote:")
+    for path in written:
+        print(f"  {path}")
+    print(f"[OK] {len(parsed)} subjects in {written[0]}; {len(failures)} failed.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,514 @@
+#!/usr/bin/env python3
+"""Keep the PyBrainAge and BrainCharts models loaded behind a localhost HTTP server.
+
+Starting predict.py or run_braincharts_normative_models.py costs seconds of
+unpickling and imports before the first subject is scored. ``serve`` pays that
+once: it loads the PyBrainAge ExtraTrees model and scaler and/or a compiled
+BrainCharts model bundle (see braincharts_bundle.py) with an optional cached
+site adaptation, then answers ``POST /score`` requests.
+
+A request body is one row, a list of rows, or ``{"rows": [...]}``; each row is
+an object with the subject, age, sex, site and sitenum columns plus FreeSurfer
+features under either the FreeSurfer or the model names. Requests that arrive
+within ``--max-wait-ms`` of each other are scored together as one batch. Each
+result holds ``BrainAge``, ``BrainPAD``, a ``zscores`` object and, for rows
+that could not be scored by one of the models, an ``errors`` object.
+``GET /health`` reports the loaded models and batch counters. Usage::
+
+    python Step_3_BrainCharts_Normative_Modeling/scoring_server.py serve \\
+      --pybrain-model /path/to/ExtraTreesModel --pybrain-scaler /path/to/scaler.pkl \\
+      --model-bundle /path/to/braincharts_lifespan_57K_82sites.bundle \\
+      --adaptation /path/to/adaptation_cache/<key>.npz
+    python Step_3_BrainCharts_Normative_Modeling/scoring_server.py score \\
+      --input new_subjects.csv --output new_subjects_scores.csv
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import math
+import queue
+import sys
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Any, Callable
+
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "Step_3_to_7_PyBrainAge"))
+
+from braincharts_adaptation import load_adaptation  # noqa: E402
+from braincharts_blr import BLRStack, SiteAdaptation, batched_predict  # noqa: E402
+from braincharts_bundle import load_bundle, source_fingerprint  # noqa: E402
+from braincharts_columns import ColumnMap  # noqa: E402
+
+
+DEFAULT_HOST = "127.0.0.1"
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BATCH = 256
+DEFAULT_MAX_WAIT_MS = 5.0
+MATCH_CACHE_SIZE = 64
+
+
+@dataclass(frozen=True)
+class RowColumns:
+    """Names of the per-subject columns in a request row."""
+
+    subject: str = "subject"
+    age: str = "age"
+    sex: str = "sex"
+    site: str = "site"
+    sitenum: str = "sitenum"
+
+
+@dataclass(frozen=True)
+class BrainChartsModel:
+    stack: BLRStack
+    site_ids_tr: list[str]
+    adaptation: SiteAdaptation | None
+    xmin: float
+    xmax: float
+
+
+class Scorer:
+    """Score batches of request rows with whichever models are loaded.
+
+    Rows are checked one by one, so a row with missing features or an unknown
+    site gets an error message while the rest of the batch is still scored.
+    """
+
+    def __init__(self, columns: RowColumns, pybrain: tuple[Any, Any] | None = None, braincharts: BrainChartsModel | None = None):
+        if pybrain is None and braincharts is None:
+            raise ValueError("Load the PyBrainAge model, a BrainCharts bundle, or both.")
+        self.columns = columns
+        self.pybrain = pybrain
+        self.braincharts = braincharts
+        self.column_map = ColumnMap.compiled()
+        self._matches: OrderedDict[tuple[tuple[str, ...], tuple[str, ...]], list[int | None]] = OrderedDict()
+        self.roi_features = None
+        if pybrain is not None:
+            import predict as pybrainage
+
+            self.roi_features = pybrainage.roi_features(pybrain[1])
+
+    def describe(self) -> dict[str, Any]:
+        info: dict[str, Any] = {"pybrainage": self.pybrain is not None, "braincharts_idps": 0, "adaptation_sites": []}
+        if self.braincharts is not None:
+            info["braincharts_idps"] = len(self.braincharts.stack.idps)
+            if self.braincharts.adaptation is not None:
+                info["adaptation_sites"] = [int(site) for site in self.braincharts.adaptation.sites]
+        return info
+
+    def _numeric(self, rows: list[dict[str, Any]], keys: list[str], names: list[str]):
+        """(N, len(names)) float matrix of ``names`` resolved through the column map; absent or non-numeric values are NaN.
+
+        Requests from the same client repeat the same fields, so the resolved
+        positions are cached per field list, keeping the ``MATCH_CACHE_SIZE``
+        most recently used lists.
+        """
+        import numpy as np
+
+        cache_key = (tuple(names), tuple(keys))
+        positions = self._matches.get(cache_key)
+        if positions is None:
+            positions = self._matches[cache_key] = self.column_map.match(names, keys)
+            if len(self._matches) > MATCH_CACHE_SIZE:
+                self._matches.popitem(last=False)
+        else:
+            self._matches.move_to_end(cache_key)
+        values = np.full((len(rows), len(names)), np.nan)
+        for target, position in enumerate(positions):
+            if position is not None:
+                key = keys[position]
+                values[:, target] = [_to_float(row.get(key)) for row in rows]
+        return values
+
+    def score(self, rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        import numpy as np
+        import pandas as pd
+
+        keys = list(dict.fromkeys(key for row in rows for key in row))
+        results: list[dict[str, Any]] = [
+            {"subject": row.get(self.columns.subject), "BrainAge": None, "BrainPAD": None, "zscores": {}, "errors": {}} for row in rows
+        ]
+        age = self._numeric(rows, keys, [self.columns.age])[:, 0]
+
+        if self.pybrain is not None:
+            model, scaler = self.pybrain
+            data = self._numeric(rows, keys, self.roi_features)
+            complete = np.isfinite(data).all(axis=1)
+            for row in np.flatnonzero(~complete):
+                results[row]["errors"]["BrainAge"] = f"{int((~np.isfinite(data[row])).sum())} ROI features missing or not finite"
+            if complete.any():
+                scaled = scaler.transform(pd.DataFrame(data[complete], columns=self.roi_features))
+                for row, brain_age in zip(np.flatnonzero(complete), model.predict(scaled)):
+                    results[row]["BrainAge"] = float(brain_age)
+                    results[row]["BrainPAD"] = _json_float(brain_age - age[row])
+
+        if self.braincharts is not None:
+            self._score_braincharts(rows, keys, age, results)
+        for result in results:
+            if not result["errors"]:
+                del result["errors"]
+        return results
+
+    def _score_braincharts(self, rows: list[dict[str, Any]], keys: list[str], age, results: list[dict[str, Any]]) -> None:
+        import numpy as np
+        import pandas as pd
+        from pcntoolkit.util.utils import create_design_matrix
+
+        model = self.braincharts
+        sex = self._numeric(rows, keys, [self.columns.sex])[:, 0]
+        site = pd.Series([_to_site(row.get(self.columns.site)) for row in rows], dtype=object)
+        ok = np.isfinite(age) & np.isfinite(sex) & (site != "").to_numpy()
+        for row in np.flatnonzero(~ok):
+            results[row]["errors"]["zscores"] = f"{self.columns.age}, {self.columns.sex} and {self.columns.site} are required"
+
+        if model.adaptation is None:
+            known = site.isin(model.site_ids_tr).to_numpy()
+            for row in np.flatnonzero(ok & ~known):
+                results[row]["errors"]["zscores"] = f"site {site[row]} is not a training site; start the server with --adaptation"
+            ok &= known
+            sitenum = None
+        else:
+            sitenum = self._numeric(rows, keys, [self.columns.sitenum])[:, 0]
+            usable = {float(s) for s, count in zip(model.adaptation.sites, model.adaptation.counts) if count >= 2}
+            adapted = np.array([value in usable for value in sitenum], dtype=bool)
+            for row in np.flatnonzero(ok & ~adapted):
+                results[row]["errors"]["zscores"] = f"{self.columns.sitenum} {sitenum[row]} has no site adaptation"
+            ok &= adapted
+
+        scored = np.flatnonzero(ok)
+        if scored.size == 0:
+            return
+        covariates = pd.DataFrame({self.columns.age: age[scored], self.columns.sex: sex[scored]})
+        x = create_design_matrix(
+            covariates,
+            site_ids=site.iloc[scored].reset_index(drop=True),
+            all_sites=model.site_ids_tr,
+            basis="bspline",
+            xmin=model.xmin,
+            xmax=model.xmax,
+        )
+        y = self._numeric(rows, keys, model.stack.idps)[scored]
+        _, _, z = batched_predict(model.stack, x, y, adaptation=model.adaptation, sitenum_te=None if sitenum is None else sitenum[scored])
+        for row, values in zip(scored, z):
+            results[row]["zscores"] = {idp: _json_float(value) for idp, value in zip(model.stack.idps, values)}
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _to_site(value) -> str:
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return ""
+    return str(value)
+
+
+def _json_float(value) -> float | None:
+    value = float(value)
+    return value if math.isfinite(value) else None
+
+
+class _Pending:
+    __slots__ = ("rows", "done", "results", "error")
+
+    def __init__(self, rows: list[dict[str, Any]]):
+        self.rows = rows
+        self.done = threading.Event()
+        self.results: list[dict[str, Any]] = []
+        self.error: Exception | None = None
+
+
+class MicroBatcher:
+    """Collect requests that arrive within ``max_wait`` seconds and score them as one batch.
+
+    All scoring runs on one worker thread, so the models are never used
+    concurrently; HTTP handler threads block in :meth:`submit` until their
+    rows are done. If scoring a batch raises, its requests are scored again
+    one at a time, so only the request that fails gets the error.
+    """
+
+    def __init__(self, score: Callable[[list[dict[str, Any]]], list[dict[str, Any]]], max_batch: int, max_wait: float):
+        self.score = score
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.batches = 0
+        self.rows = 0
+        self._queue: queue.Queue[_Pending] = queue.Queue()
+        threading.Thread(target=self._run, name="scoring-batcher", daemon=True).start()
+
+    def submit(self, rows: list[dict[str, Any]]) -> list[dict[str, Any]]:
+        pending = _Pending(rows)
+        self._queue.put(pending)
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.results
+
+    def _collect(self) -> list[_Pending]:
+        batch = [self._queue.get()]
+        size = len(batch[0].rows)
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                pending = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            batch.append(pending)
+            size += len(pending.rows)
+        return batch
+
+    def _run(self) -> None:
+        while True:
+            batch = self._collect()
+            try:
+                self._score(batch)
+            except Exception as exc:
+                if len(batch) == 1:
+                    batch[0].error = exc
+                else:
+                    for pending in batch:
+                        try:
+                            self._score([pending])
+                        except Exception as single_exc:
+                            pending.error = single_exc
+            for pending in batch:
+                pending.done.set()
+
+    def _score(self, batch: list[_Pending]) -> None:
+        rows = [row for pending in batch for row in pending.rows]
+        results = self.score(rows)
+        self.batches += 1
+        self.rows += len(rows)
+        start = 0
+        for pending in batch:
+            pending.results = results[start : start + len(pending.rows)]
+            start += len(pending.rows)
+
+
+def request_rows(body: Any) -> list[dict[str, Any]]:
+    """Rows of a request body: one object, a list of objects, or ``{"rows": [...]}``."""
+    if isinstance(body, dict) and isinstance(body.get("rows"), list):
+        body = body["rows"]
+    rows = body if isinstance(body, list) else [body]
+    if not rows or not all(isinstance(row, dict) for row in rows):
+        raise ValueError("Expected a row object, a list of row objects or {\"rows\": [...]}")
+    return rows
+
+
+class ScoringHandler(BaseHTTPRequestHandler):
+    server_version = "SCIMapScoring/1"
+
+    def _send(self, status: int, payload: dict[str, Any]) -> None:
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self) -> None:
+        if self.path != "/health":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        batcher = self.server.batcher
+        self._send(200, {"status": "ok", **self.server.scorer.describe(), "batches": batcher.batches, "rows": batcher.rows})
+
+    def do_POST(self) -> None:
+        if self.path != "/score":
+            self._send(404, {"error": f"Unknown path {self.path}"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            rows = request_rows(json.loads(self.rfile.read(length)))
+        except ValueError as exc:
+            self._send(400, {"error": str(exc)})
+            return
+        start = time.perf_counter()
+        try:
+            results = self.server.batcher.submit(rows)
+        except Exception as exc:
+            self._send(500, {"error": f"{type(exc).__name__}: {exc}"})
+            return
+        self._send(200, {"results": results, "milliseconds": round((time.perf_counter() - start) * 1000, 3)})
+
+    def log_message(self, format: str, *args: Any) -> None:
+        if not self.server.quiet:
+            super().log_message(format, *args)
+
+
+class ScoringServer(ThreadingHTTPServer):
+    """Threaded HTTP server holding the scorer and its batcher."""
+
+    daemon_threads = True
+    # Bursts of clients, e.g. one per finished recon-all, must not be refused.
+    request_queue_size = 128
+
+    def __init__(self, address: tuple[str, int], scorer: Scorer, batcher: MicroBatcher, quiet: bool = False):
+        super().__init__(address, ScoringHandler)
+        self.scorer = scorer
+        self.batcher = batcher
+        self.quiet = quiet
+
+
+def post_rows(url: str, rows: list[dict[str, Any]], timeout: float = 60.0) -> dict[str, Any]:
+    """Send rows to a running server and return its JSON response."""
+    from urllib.request import Request, urlopen
+
+    clean = [{key: (None if isinstance(value, float) and not math.isfinite(value) else value) for key, value in row.items()} for row in rows]
+    request = Request(f"{url.rstrip('/')}/score", data=json.dumps({"rows": clean}).encode("utf-8"), headers={"Content-Type": "application/json"})
+    with urlopen(request, timeout=timeout) as response:
+        return json.loads(response.read())
+
+
+def load_braincharts(args: argparse.Namespace) -> BrainChartsModel | None:
+    if not args.model_bundle:
+        return None
+    try:
+        stack, index = load_bundle(Path(args.model_bundle).resolve())
+    except (OSError, ValueError) as exc:
+        raise SystemExit(str(exc)) from exc
+    site_ids_tr = list(index["site_ids"])
+    if args.braincharts_root:
+        braincharts_root = Path(args.braincharts_root).resolve()
+        sys.path.insert(0, str(braincharts_root))
+        model_dir = braincharts_root / "models" / index["model_name"]
+        if source_fingerprint(model_dir, list(stack.idps), site_ids_tr) != index["source_fingerprint"]:
+            raise SystemExit(f"Model bundle {args.model_bundle} is stale; recompile it with braincharts_bundle.py.")
+    try:
+        import pcntoolkit.util.utils  # noqa: F401
+    except ImportError as exc:
+        raise SystemExit("BrainCharts scoring needs PCNtoolkit, for example: pip install pcntoolkit==0.35") from exc
+
+    adaptation = None
+    if args.adaptation:
+        path = Path(args.adaptation)
+        adaptation = load_adaptation(path.parent, path.stem, list(stack.idps))
+        if adaptation is None:
+            raise SystemExit(f"Cannot read a site adaptation for the bundle's IDPs from {path}")
+    return BrainChartsModel(stack=stack, site_ids_tr=site_ids_tr, adaptation=adaptation, xmin=args.xmin, xmax=args.xmax)
+
+
+def load_pybrain(args: argparse.Namespace) -> tuple[Any, Any] | None:
+    if not (args.pybrain_model or args.pybrain_scaler):
+        return None
+    if not (args.pybrain_model and args.pybrain_scaler):
+        raise SystemExit("--pybrain-model and --pybrain-scaler must be given together")
+    import predict as pybrainage
+
+    model = pybrainage.load_pickle(Path(args.pybrain_model), "Model")
+    scaler = pybrainage.load_pickle(Path(args.pybrain_scaler), "Scaler")
+    # One core by default: batches are small, and joblib's dispatch would cost more than it saves.
+    pybrainage.set_jobs(model, args.jobs if args.jobs is not None else 1)
+    return model, scaler
+
+
+def serve(args: argparse.Namespace) -> None:
+    if args.max_batch < 1 or args.max_wait_ms < 0:
+        raise SystemExit("--max-batch must be at least 1 and --max-wait-ms at least 0")
+    start = time.perf_counter()
+    columns = RowColumns(args.subject_col, args.age_col, args.sex_col, args.site_col, args.sitenum_col)
+    try:
+        scorer = Scorer(columns, pybrain=load_pybrain(args), braincharts=load_braincharts(args))
+    except ValueError as exc:
+        raise SystemExit(str(exc)) from exc
+
+    batcher = MicroBatcher(scorer.score, args.max_batch, args.max_wait_ms / 1000)
+    server = ScoringServer((args.host, args.port), scorer, batcher, args.quiet)
+    info = scorer.describe()
+    print(
+        f"Models loaded in {time.perf_counter() - start:.1f} s "
+        f"(PyBrainAge: {'yes' if info['pybrainage'] else 'no'}, BrainCharts IDPs: {info['braincharts_idps']}). "
+        f"Listening on http://{args.host}:{server.server_address[1]}",
+        flush=True,
+    )
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def score_file(args: argparse.Namespace) -> None:
+    import pandas as pd
+
+    frame = pd.read_csv(args.input, sep="\t" if args.sep in {"\\t", "tab"} else args.sep)
+    response = post_rows(args.url, frame.to_dict(orient="records"))
+    results = response["results"]
+    idps = list(dict.fromkeys(idp for result in results for idp in result["zscores"]))
+    with Path(args.output).open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle, lineterminator="\n")
+        writer.writerow(["subject", "BrainAge", "BrainPAD", *(f"{idp}{args.z_suffix}" for idp in idps), "errors"])
+        for result in results:
+            errors = "; ".join(f"{name}: {message}" for name, message in result.get("errors", {}).items())
+            zscores = [result["zscores"].get(idp) for idp in idps]
+            values = [result["subject"], result["BrainAge"], result["BrainPAD"], *zscores, errors]
+            writer.writerow(["" if value is None else value for value in values])
+    print(f"Scored {len(results)} rows in {response['milliseconds']} ms. Wrote {args.output}")
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Serve PyBrainAge and BrainCharts scoring from models kept in memory.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    serve_cmd = commands.add_parser("serve", help="Load the models and answer scoring requests.")
+    serve_cmd.add_argument("--host", default=DEFAULT_HOST, help=f"Address to listen on. Default: {DEFAULT_HOST}.")
+    serve_cmd.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"Port to listen on. Default: {DEFAULT_PORT}.")
+    serve_cmd.add_argument("--pybrain-model", help="Pickled PyBrainAge ExtraTreesModel.")
+    serve_cmd.add_argument("--pybrain-scaler", help="Pickled PyBrainAge scaler.pkl.")
+    serve_cmd.add_argument("--jobs", type=int, help="Cores the ExtraTrees model uses per batch; -1 uses all cores. Default: 1.")
+    serve_cmd.add_argument("--model-bundle", help="BrainCharts bundle from braincharts_bundle.py.")
+    serve_cmd.add_argument("--braincharts-root", help="BrainCharts clone; when given, the bundle is checked against its model files.")
+    serve_cmd.add_argument(
+        "--adaptation",
+        help="Cached site adaptation (<output-dir>/adaptation_cache/<key>.npz from an --engine batched run) for non-training sites.",
+    )
+    serve_cmd.add_argument("--xmin", type=float, default=-5, help="Lower age limit for B-spline basis.")
+    serve_cmd.add_argument("--xmax", type=float, default=110, help="Upper age limit for B-spline basis.")
+    serve_cmd.add_argument("--subject-col", default="subject", help="Subject ID field of a row. Default: subject.")
+    serve_cmd.add_argument("--age-col", default="age", help="Age field of a row. Default: age.")
+    serve_cmd.add_argument("--sex-col", default="sex", help="Sex field of a row. Default: sex.")
+    serve_cmd.add_argument("--site-col", default="site", help="Site field of a row. Default: site.")
+    serve_cmd.add_argument("--sitenum-col", default="sitenum", help="Numeric site field used with --adaptation. Default: sitenum.")
+    serve_cmd.add_argument("--max-batch", type=int, default=DEFAULT_MAX_BATCH, help=f"Most rows scored in one batch. Default: {DEFAULT_MAX_BATCH}.")
+    serve_cmd.add_argument(
+        "--max-wait-ms",
+        type=float,
+        default=DEFAULT_MAX_WAIT_MS,
+        help=f"How long the first request of a batch waits for more. Default: {DEFAULT_MAX_WAIT_MS:g}.",
+    )
+    serve_cmd.add_argument("--quiet", action="store_true", help="Do not log each request.")
+
+    score_cmd = commands.add_parser("score", help="Send the rows of a CSV to a running server and write the scores.")
+    score_cmd.add_argument("--url", default=f"http://{DEFAULT_HOST}:{DEFAULT_PORT}", help="Server URL.")
+    score_cmd.add_argument("--input", required=True, help="CSV with one row per subject.")
+    score_cmd.add_argument("--output", required=True, help="Output CSV of BrainAge, BrainPAD and z-scores.")
+    score_cmd.add_argument("--sep", default=",", help="Input field separator. Default: ','.")
+    score_cmd.add_argument("--z-suffix", default="_zscore", help="Suffix appended to IDP names in z-score columns.")
+    return parser.parse_args()
+
+
+def main() -> None:
+    args = parse_args()
+    if args.command == "serve":
+        serve(args)
+    else:
+        score_file(args)
+
+
+if __name__ == "__main__":
+    main()
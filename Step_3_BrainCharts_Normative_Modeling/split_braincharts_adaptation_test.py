@@ -4,15 +4,27 @@
 The adaptation sheet must contain only healthy controls from each site. The test
 sheet contains all SCI participants plus the held-out controls. By default this
 uses a 50/50 split of controls within each site.
+
+With ``--streaming`` the input is read twice instead of being held in memory:
+the first pass keeps only the site, cohort and subject of each row plus where
+the row sits in the file, and the second pass re-reads those rows one at a
+time and writes them to the adaptation and test files in sorted order.
+
+With ``--n-splits K --index-out FILE`` the script draws K reproducible splits
+in one pass and writes a compact index (one ``a``/``t`` column per replicate)
+instead of K pairs of CSVs. run_braincharts_normative_models.py reads the
+index with ``--split-index`` and scores every replicate from one input table.
 """
 
 from __future__ import annotations
 
 import argparse
 import csv
+import math
 import random
-from collections import defaultdict
+from collections import Counter, defaultdict
 from pathlib import Path
+from typing import Callable, Hashable
 
 
 DEFAULT_CONTROL_VALUES = ("0", "control", "controls", "healthy", "hc", "sci_h")
@@ -23,8 +35,8 @@ def parse_args() -> argparse.Namespace:
         description="Create BrainCharts adaptation and test CSVs from one merged input table."
     )
     parser.add_argument("--input", required=True, help="BrainCharts-ready CSV with metadata and FreeSurfer features.")
-    parser.add_argument("--adaptation-out", required=True, help="Output CSV for adaptation controls.")
-    parser.add_argument("--test-out", required=True, help="Output CSV for held-out controls and SCI participants.")
+    parser.add_argument("--adaptation-out", help="Output CSV for adaptation controls.")
+    parser.add_argument("--test-out", help="Output CSV for held-out controls and SCI participants.")
     parser.add_argument("--report-out", help="Optional split report CSV.")
     parser.add_argument("--site-col", default="site", help="Site/scanner column. Default: site.")
     parser.add_argument("--cohort-col", default="cohort", help="Cohort/group column. Default: cohort.")
@@ -36,7 +48,33 @@ def parse_args() -> argparse.Namespace:
         default=",".join(DEFAULT_CONTROL_VALUES),
         help="Comma-separated values in cohort-col that mean healthy control.",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--streaming",
+        action="store_true",
+        help="Two-pass split that re-reads rows instead of loading the table; memory scales with the number of rows, not their width.",
+    )
+    parser.add_argument("--n-splits", type=int, default=1, help="Number of replicate splits to draw. Default: 1.")
+    parser.add_argument(
+        "--index-out",
+        help="Write a split index CSV (subject plus one a/t column per replicate) instead of the adaptation and "
+        "test CSVs. Required with --n-splits above 1.",
+    )
+    parser.add_argument(
+        "--stratify",
+        action="store_true",
+        help="Within each site, allocate adaptation controls proportionally across age-bin x sex strata.",
+    )
+    parser.add_argument("--age-bin-width", type=float, default=10, help="Age bin width in years for --stratify. Default: 10.")
+    args = parser.parse_args()
+    if args.n_splits < 1:
+        parser.error("--n-splits must be at least 1")
+    if args.n_splits > 1 and not args.index_out:
+        parser.error("--n-splits above 1 requires --index-out")
+    if not args.index_out and not (args.adaptation_out and args.test_out):
+        parser.error("--adaptation-out and --test-out are required unless --index-out is given")
+    if args.age_bin_width <= 0:
+        parser.error("--age-bin-width must be positive")
+    return args
 
 
 def normalized(value: str) -> str:
@@ -60,48 +98,172 @@ def write_rows(path: Path, header: list[str], rows: list[dict[str, str]]) -> Non
         writer.writerows(rows)
 
 
-def main() -> None:
-    args = parse_args()
-    if not 0 < args.adapt_fraction < 1:
-        raise SystemExit("--adapt-fraction must be between 0 and 1")
+class RowRef(dict):
+    """Site, cohort and subject of one input row plus the byte span of the raw row."""
 
-    input_path = Path(args.input)
-    header, rows = read_rows(input_path)
+    __slots__ = ("offset", "length")
 
-    required = [args.site_col, args.cohort_col, args.subject_col, "age", "sex", "sitenum"]
-    missing = [col for col in required if col not in header]
-    if missing:
-        raise SystemExit(f"Missing required column(s) in {input_path}: {', '.join(missing)}")
 
-    control_values = {normalized(v) for v in args.control_values.split(",") if v.strip()}
+def scan_rows(path: Path, key_cols: list[str]) -> tuple[list[str], list[RowRef]]:
+    """First streaming pass: return the header and a RowRef per row.
+
+    Records are split on newlines outside quoted fields, so quoted values that
+    contain newlines stay in one row.
+    """
+    header: list[str] | None = None
+    positions: list[int] = []
+    refs: list[RowRef] = []
+
+    with path.open("rb") as handle:
+        offset = 0
+        record = b""
+        start = 0
+        for line in handle:
+            if not record:
+                start = offset
+            record += line
+            offset += len(line)
+            if record.count(b'"') % 2:
+                continue
+            raw, record = record, b""
+            if not raw.strip():
+                continue
+            text = raw.decode("utf-8-sig" if start == 0 else "utf-8")
+            fields = next(csv.reader([text]), [])
+            if header is None:
+                header = fields
+                missing = [col for col in key_cols if col not in header]
+                if missing:
+                    return header, refs
+                positions = [header.index(col) for col in key_cols]
+                continue
+            ref = RowRef((col, fields[pos] if pos < len(fields) else "") for col, pos in zip(key_cols, positions))
+            ref.offset = start
+            ref.length = len(raw)
+            refs.append(ref)
+
+    if header is None:
+        raise ValueError(f"{path} has no header")
+    return header, refs
+
+
+def copy_rows(source: Path, path: Path, header: list[str], refs: list[RowRef]) -> None:
+    """Second streaming pass: write the header and the ``refs`` rows to ``path`` in order.
+
+    Each raw row is re-parsed and written with the csv module, padded or cut
+    to the header width, so the file matches what ``write_rows`` writes.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    width = len(header)
+    with source.open("rb") as reader, path.open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(header)
+        for ref in refs:
+            reader.seek(ref.offset)
+            fields = next(csv.reader([reader.read(ref.length).decode("utf-8")]), [])
+            writer.writerow((fields + [""] * width)[:width])
+
+
+def allocate_strata(
+    controls: list[dict[str, str]],
+    n_adapt: int,
+    stratum: Callable[[dict[str, str]], Hashable],
+    rng: random.Random,
+) -> tuple[list[dict[str, str]], list[dict[str, str]]]:
+    """Pick ``n_adapt`` of the shuffled ``controls`` with proportional allocation across strata.
+
+    Each stratum gets the floor of its proportional share; the remaining slots
+    go to the largest fractional shares, ties broken at random.
+    """
+    strata: dict[Hashable, list[dict[str, str]]] = {}
+    for row in controls:
+        strata.setdefault(stratum(row), []).append(row)
+
+    shares = {key: len(members) * n_adapt / len(controls) for key, members in strata.items()}
+    quotas = {key: int(share) for key, share in shares.items()}
+    tiebreak = {key: rng.random() for key in strata}
+    leftover = n_adapt - sum(quotas.values())
+    for key in sorted(strata, key=lambda key: (quotas[key] - shares[key], tiebreak[key]))[:leftover]:
+        quotas[key] += 1
+
+    adaptation: list[dict[str, str]] = []
+    test: list[dict[str, str]] = []
+    for key, members in strata.items():
+        adaptation.extend(members[: quotas[key]])
+        test.extend(members[quotas[key] :])
+    return adaptation, test
+
+
+def age_sex_stratum(bin_width: float) -> Callable[[dict[str, str]], Hashable]:
+    """Return a stratum key of (age bin, sex); unparseable and non-finite ages share one bin."""
+
+    def key(row: dict[str, str]) -> Hashable:
+        try:
+            age = float(row.get("age", ""))
+        except ValueError:
+            age = math.nan
+        age_bin = age // bin_width if math.isfinite(age) else None
+        return age_bin, normalized(row.get("sex", ""))
+
+    return key
+
+
+def write_index(path: Path, subjects: list[str], assignments: list[set[str]]) -> None:
+    """Write the subject -> a/t assignment of every replicate as one compact CSV."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with path.open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle)
+        writer.writerow(["subject"] + [f"split_{number:03d}" for number in range(1, len(assignments) + 1)])
+        for subject in subjects:
+            writer.writerow([subject] + ["a" if subject in adapt else "t" for adapt in assignments])
+
+
+def split_rows(
+    rows: list[dict[str, str]],
+    site_col: str,
+    cohort_col: str,
+    subject_col: str,
+    control_values: set[str],
+    adapt_fraction: float,
+    seed: int,
+    stratum: Callable[[dict[str, str]], Hashable] | None = None,
+) -> tuple[list[dict[str, str]], list[dict[str, str]], list[dict[str, str]]]:
+    """Split rows into sorted adaptation and test lists plus per-site report rows.
+
+    ``stratum`` maps a control row to its stratum key; when given, each site's
+    adaptation controls are spread across strata in proportion to their size.
+    """
     controls_by_site: dict[str, list[dict[str, str]]] = defaultdict(list)
     noncontrols: list[dict[str, str]] = []
 
     for row in rows:
-        if normalized(row.get(args.cohort_col, "")) in control_values:
-            controls_by_site[row[args.site_col]].append(row)
+        if normalized(row.get(cohort_col, "")) in control_values:
+            controls_by_site[row[site_col]].append(row)
         else:
             noncontrols.append(row)
 
-    rng = random.Random(args.seed)
+    rng = random.Random(seed)
     adaptation: list[dict[str, str]] = []
     test: list[dict[str, str]] = []
     report_rows: list[dict[str, str]] = []
 
     for site in sorted(controls_by_site):
         controls = controls_by_site[site][:]
-        controls.sort(key=lambda row: row[args.subject_col])
+        controls.sort(key=lambda row: row[subject_col])
         rng.shuffle(controls)
 
         n_controls = len(controls)
         if n_controls == 1:
             n_adapt = 1
         else:
-            n_adapt = round(n_controls * args.adapt_fraction)
+            n_adapt = round(n_controls * adapt_fraction)
             n_adapt = max(1, min(n_controls - 1, n_adapt))
 
-        site_adapt = controls[:n_adapt]
-        site_test_controls = controls[n_adapt:]
+        if stratum is None:
+            site_adapt = controls[:n_adapt]
+            site_test_controls = controls[n_adapt:]
+        else:
+            site_adapt, site_test_controls = allocate_strata(controls, n_adapt, stratum, rng)
         adaptation.extend(site_adapt)
         test.extend(site_test_controls)
 
@@ -116,11 +278,78 @@ def main() -> None:
 
     test.extend(noncontrols)
 
-    adaptation.sort(key=lambda row: (row[args.site_col], row[args.subject_col]))
-    test.sort(key=lambda row: (row[args.site_col], row[args.cohort_col], row[args.subject_col]))
+    adaptation.sort(key=lambda row: (row[site_col], row[subject_col]))
+    test.sort(key=lambda row: (row[site_col], row[cohort_col], row[subject_col]))
+    return adaptation, test, report_rows
+
+
+def main() -> None:
+    args = parse_args()
+    if not 0 < args.adapt_fraction < 1:
+        raise SystemExit("--adapt-fraction must be between 0 and 1")
+
+    input_path = Path(args.input)
+    key_cols = [args.site_col, args.cohort_col, args.subject_col]
+    if args.stratify:
+        key_cols += ["age", "sex"]
+    if args.streaming or args.index_out:
+        header, rows = scan_rows(input_path, key_cols)
+    else:
+        header, rows = read_rows(input_path)
+
+    required = [args.site_col, args.cohort_col, args.subject_col, "age", "sex", "sitenum"]
+    missing = [col for col in required if col not in header]
+    if missing:
+        raise SystemExit(f"Missing required column(s) in {input_path}: {', '.join(missing)}")
+
+    control_values = {normalized(v) for v in args.control_values.split(",") if v.strip()}
+    stratum = age_sex_stratum(args.age_bin_width) if args.stratify else None
+
+    if args.index_out:
+        subjects = [row[args.subject_col] for row in rows]
+        duplicates = sorted(subject for subject, count in Counter(subjects).items() if count > 1)
+        if duplicates:
+            raise SystemExit("A split index needs unique subject IDs; duplicated: " + ", ".join(duplicates[:10]))
+        assignments = []
+        for replicate in range(args.n_splits):
+            adaptation, test, replicate_report = split_rows(
+                rows,
+                args.site_col,
+                args.cohort_col,
+                args.subject_col,
+                control_values,
+                args.adapt_fraction,
+                args.seed + replicate,
+                stratum,
+            )
+            assignments.append({row[args.subject_col] for row in adaptation})
+            if replicate == 0:
+                report_rows = replicate_report
+        index_out = Path(args.index_out)
+        write_index(index_out, subjects, assignments)
+        report_out = Path(args.report_out) if args.report_out else index_out.with_name("braincharts_split_report.csv")
+        write_rows(report_out, ["site", "controls_total", "controls_adaptation", "controls_test"], report_rows)
+        print(f"Wrote split index:     {args.n_splits} replicate(s) x {len(subjects)} rows -> {index_out}")
+        print(f"Wrote split report:    {report_out}")
+        return
+
+    adaptation, test, report_rows = split_rows(
+        rows,
+        args.site_col,
+        args.cohort_col,
+        args.subject_col,
+        control_values,
+        args.adapt_fraction,
+        args.seed,
+        stratum,
+    )
 
-    write_rows(Path(args.adaptation_out), header, adaptation)
-    write_rows(Path(args.test_out), header, test)
+    if args.streaming:
+        copy_rows(input_path, Path(args.adaptation_out), header, adaptation)
+        copy_rows(input_path, Path(args.test_out), header, test)
+    else:
+        write_rows(Path(args.adaptation_out), header, adaptation)
+        write_rows(Path(args.test_out), header, test)
 
     report_out = Path(args.report_out) if args.report_out else Path(args.adaptation_out).with_name("braincharts_split_report.csv")
     write_rows(report_out, ["site", "controls_total", "controls_adaptation", "controls_test"], report_rows)
@@ -1,98 +1,252 @@
-import pandas as pd
-import numpy as np
-import matplotlib.pyplot as plt
+#!/usr/bin/env python3
+"""Predict brain-age with the PyBrainAge ExtraTrees model.
+
+The input table has the subject ID in the first column, chronological age in
+the second and the 187 ROI features after that (see ``ROIS_input_template.txt``).
+FreeSurfer spellings of the feature names (``_and_`` for ``&``,
+``Left-Thalamus`` for ``Left-Thalamus-Proper``) and a different column order
+are resolved once from the header with the BrainCharts column map.
+
+The table is read in chunks of ``--chunk-size`` rows. Each chunk is checked with
+vectorised dtype, missing-value and infinity checks, scaled, predicted and
+appended to the output, so memory depends on the chunk size and not on the
+number of subjects. ``--jobs`` sets how many cores the ExtraTrees model uses to
+predict each chunk, and the seconds spent loading, reading, validating,
+scaling, predicting and writing are reported at the end. Usage::
+
+    python Step_3_to_7_PyBrainAge/predict.py \\
+      --input subject_features.csv \\
+      --model /path/to/ExtraTreesModel \\
+      --scaler /path/to/scaler.pkl \\
+      --output predicted_results.csv \\
+      --jobs -1
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
 import pickle
-import seaborn as sns
-from statsmodels.genmod.families import Gaussian
-import statsmodels.formula.api as smf
-from itertools import combinations 
-from scipy.stats import pearsonr
-
-
-#age_data_path = get_file_path("Enter the path for the 'Your_database.xlsx' file: ")
-# make the subject features by grabbing the concatenated results txt file and adding the age of the subjects on the second column and saving it as subject_features.csv
-
-age_data_path = r'C:\Users\kramerlab\Documents\brain_age_data\subject_features.csv'
-
-#model_path = get_file_path("Enter the path for the 'ExtraTreesModel' file: ")
-model_path = r'C:\Users\kramerlab\Documents\brain_age_pybrain\PyBrainAge\software\ExtraTreesModel'
-
-#scaler_path = get_file_path("Enter the path for the 'scaler.pkl' file: ")
-scaler_path = r'C:\Users\kramerlab\Documents\brain_age_pybrain\PyBrainAge\software\scaler.pkl'
-#scaler_path = r'C:\Users\kramerlab\Documents\brain_age_pybrain\PyBrainAge-main\scaler.pkl'
-
-
-
-data_test = pd.read_csv(age_data_path)
-
-# Load model and scaler
-model = pickle.load(open(model_path, 'rb'))
-sc_X = pickle.load(open(scaler_path, 'rb'))
-
-# Prepare data for prediction
-#df = data_total
-df = data_test
-
-IDs = df.iloc[:, 0]
-Ages = df.iloc[:, 1]
-data = df.iloc[:, 2:]
-
-# Validate data
-if data.isnull().values.any():
-    raise ValueError('There is missing data in the dataframe')
-
-if data.isin([np.inf, -np.inf]).values.sum() != 0:
-    raise ValueError('There is an infinite value in your dataframe')
-
-for index, row in enumerate(data.iterrows()):
-    if any(isinstance(val, str) for val in row[1].values):
-        raise ValueError('There is non-numeric data in the dataframe')
-
-# Rename columns if needed
-def rename_cols_to_roi_format(data):
-    new_columns = []
-    for col in data.columns:
-        col = col.replace('_and_', '&')
-        col = col.replace('Left-Thalamus', 'Left-Thalamus-Proper')
-        col = col.replace('Right-Thalamus', 'Right-Thalamus-Proper')
-        new_columns.append(col)
-    data.columns = new_columns
-    return data
-
-# Apply scaler
-try:
-    data = sc_X.transform(data)
-except ValueError as e:
-    print("Scaler failed potentially due to feature name mismatch, attempting to rename columns and attempt scaler again.")
-    data = rename_cols_to_roi_format(data)
-    try:
-        data = sc_X.transform(data)
-        print('Scaler transformation appears successful')
-    except ValueError:
-        raise ValueError('Failing to apply scaler to the data. Check if the scaler is loaded correctly and/or if the data is in the correct format.') from e
-
-# Predict
-outputs = []
-try:
-    outputs = model.predict(data)
-except:
-    print("Applying the model to the data at once failed. Moving to apply the model row-by-row (slower).")
-    for row in range(len(data)):
-        try:
-            outputs.append(model.predict(data[row].reshape(1, -1)))
-        except:
-            raise ValueError(f'Failed at row {row}')
-print(f"Processed all {len(data)} rows successfully. Moving to save the results.")
-
-
-# Save results
-stacked = np.column_stack((IDs, Ages, outputs))
-df2 = pd.DataFrame(stacked, columns=['ID', 'Age', 'BrainAge'])
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Iterator
 
-# Calculate Brain-PAD
-df2['BrainPAD'] = df2['BrainAge'] - df2['Age']
-
-# Save output
-output_path = r'C:\Users\kramerlab\Documents\brain_age_data\predicted_results.csv'
-df2.to_csv(output_path, index=False)
+import numpy as np
+import pandas as pd
 
+HERE = Path(__file__).resolve().parent
+sys.path.insert(0, str(HERE.parent / "Step_3_BrainCharts_Normative_Modeling"))
+from braincharts_columns import ColumnMap  # noqa: E402
+from feature_store import FeatureStore  # noqa: E402
+
+ROI_TEMPLATE = HERE / "ROIS_input_template.txt"
+DEFAULT_MODEL = HERE / "software" / "ExtraTreesModel"
+DEFAULT_SCALER = HERE / "software" / "scaler.pkl"
+DEFAULT_CHUNK_SIZE = 10000
+OUTPUT_COLUMNS = ["ID", "Age", "BrainAge", "BrainPAD"]
+STAGES = ["load", "read", "validate", "scale", "predict", "write"]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Predict brain-age and Brain-PAD with the PyBrainAge ExtraTrees model.")
+    parser.add_argument(
+        "--input",
+        required=True,
+        help="CSV with ID, Age and the ROI features, e.g. subject_features.csv, or a feature store directory from feature_store.py.",
+    )
+    parser.add_argument("--output", default="predicted_results.csv", help="Output CSV. Default: predicted_results.csv.")
+    parser.add_argument("--model", default=str(DEFAULT_MODEL), help="Pickled ExtraTreesModel. Default: software/ExtraTreesModel.")
+    parser.add_argument("--scaler", default=str(DEFAULT_SCALER), help="Pickled StandardScaler. Default: software/scaler.pkl.")
+    parser.add_argument("--sep", default=",", help="Input field separator; use '\\t' for aparc_aseg_pybrain.sh tables. Default: ','.")
+    parser.add_argument(
+        "--chunk-size",
+        type=int,
+        default=DEFAULT_CHUNK_SIZE,
+        help=f"Rows read, scaled and predicted at a time. Default: {DEFAULT_CHUNK_SIZE}.",
+    )
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        help="Cores the ExtraTrees model uses to predict each chunk; -1 uses all cores. Default: the n_jobs stored in the model.",
+    )
+    parser.add_argument("--timings-out", help="Optional CSV of the seconds spent in each stage.")
+    return parser.parse_args()
+
+
+class StageTimer:
+    """Wall-clock seconds spent in each stage, summed over chunks."""
+
+    def __init__(self) -> None:
+        self.seconds = {stage: 0.0 for stage in STAGES}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.seconds[name] = self.seconds.get(name, 0.0) + time.perf_counter() - start
+
+    def report(self) -> str:
+        total = sum(self.seconds.values())
+        lines = [f"  {name:<9}{seconds:9.2f} s" for name, seconds in self.seconds.items()]
+        return "\n".join(["Stage timings:", *lines, f"  {'total':<9}{total:9.2f} s"])
+
+    def write(self, path: Path) -> None:
+        with Path(path).open("w", newline="", encoding="utf-8") as handle:
+            writer = csv.writer(handle, lineterminator="\n")
+            writer.writerow(["stage", "seconds"])
+            writer.writerows((name, f"{seconds:.6f}") for name, seconds in self.seconds.items())
+
+
+def set_jobs(model, jobs: int | None) -> None:
+    """Set the tree-level parallelism of a scikit-learn ensemble; ``None`` keeps the pickled value."""
+    if jobs is None:
+        return
+    if jobs == 0:
+        raise SystemExit("--jobs must be a positive number of cores or -1 for all cores")
+    if not hasattr(model, "n_jobs"):
+        raise SystemExit(f"--jobs is not supported for a {type(model).__name__} model")
+    model.n_jobs = jobs
+
+
+def load_pickle(path: Path, label: str):
+    if not Path(path).is_file():
+        raise SystemExit(f"{label} not found: {path}")
+    with open(path, "rb") as handle:
+        return pickle.load(handle)
+
+
+def roi_features(scaler) -> list[str]:
+    """Feature names the scaler was fitted on, else the ROI template order."""
+    features = getattr(scaler, "feature_names_in_", None)
+    if features is None:
+        features = ROI_TEMPLATE.read_text().splitlines()[0].split("\t")[2:]
+    return list(features)
+
+
+def rename_cols_to_roi_format(columns: list[str], features: list[str]) -> list[int]:
+    """Position in ``columns`` of each ROI feature.
+
+    The compiled BrainCharts column map resolves the FreeSurfer spellings
+    (``_and_`` for ``&``, ``Left-Thalamus`` for ``Left-Thalamus-Proper``, case)
+    to the ROI template names.
+    """
+    positions = ColumnMap.compiled().match(features, columns)
+    missing = [name for name, position in zip(features, positions) if position is None]
+    if missing:
+        raise SystemExit(f"Input is missing {len(missing)} ROI features, e.g. {', '.join(missing[:5])}")
+    return positions
+
+
+def validate_chunk(ids: pd.Series, ages: pd.Series, data: pd.DataFrame) -> None:
+    """Fail on non-numeric, missing or infinite values, naming the columns and subjects involved."""
+    non_numeric = [name for name, dtype in data.dtypes.items() if not pd.api.types.is_numeric_dtype(dtype)]
+    if non_numeric:
+        raise SystemExit(f"There is non-numeric data in the dataframe: {', '.join(map(str, non_numeric[:5]))}")
+    if not pd.api.types.is_numeric_dtype(ages):
+        raise SystemExit("The Age column (second column) must be numeric")
+    values = data.to_numpy(dtype=float)
+    for problem, mask in [("missing", np.isnan(values)), ("infinite", np.isinf(values))]:
+        rows = mask.any(axis=1)
+        if rows.any():
+            raise SystemExit(f"There is {problem} data in the dataframe for subjects {', '.join(map(str, ids[rows][:5]))}")
+
+
+def csv_chunks(path: Path, features: list[str], sep: str, chunk_size: int) -> Iterator[tuple]:
+    """ID, Age and ROI feature frame for each chunk of a CSV table."""
+    header = list(pd.read_csv(path, sep=sep, nrows=0).columns)
+    if len(header) < 3:
+        raise SystemExit(f"{path} needs ID, Age and feature columns; found {header}")
+    positions = rename_cols_to_roi_format(header[2:], features)
+    for chunk in pd.read_csv(path, sep=sep, chunksize=chunk_size):
+        data = chunk.iloc[:, [2 + position for position in positions]]
+        data.columns = features
+        yield chunk.iloc[:, 0], chunk.iloc[:, 1], data
+
+
+def store_chunks(path: Path, features: list[str], chunk_size: int) -> Iterator[tuple]:
+    """ID, Age and ROI feature frame for each block of rows of a feature store (see feature_store.py)."""
+    store = FeatureStore.load(path)
+    positions = rename_cols_to_roi_format(store.features, features)
+    age_names = [name for name in [*store.index["metadata_columns"], *store.features] if name.lower() == "age"]
+    if not age_names:
+        raise SystemExit(f"{path} has no Age column")
+    ages = pd.to_numeric(pd.Series(store.column(age_names[0])), errors="coerce")
+    for start in range(0, store.shape[0], chunk_size):
+        stop = min(start + chunk_size, store.shape[0])
+        index = pd.RangeIndex(start, stop)
+        data = pd.DataFrame(store.values[start:stop][:, positions], index=index, columns=features)
+        yield pd.Series(store.subjects[start:stop], index=index), ages.iloc[start:stop], data
+
+
+def iter_predictions(
+    path: Path,
+    model,
+    scaler,
+    sep: str = ",",
+    chunk_size: int = DEFAULT_CHUNK_SIZE,
+    timer: StageTimer | None = None,
+) -> Iterator[pd.DataFrame]:
+    """Yield ID, Age, BrainAge and BrainPAD for each chunk of ``path``, a CSV table or a feature store."""
+    timer = timer or StageTimer()
+    features = roi_features(scaler)
+    if FeatureStore.is_store(path):
+        chunks = store_chunks(path, features, chunk_size)
+    else:
+        chunks = csv_chunks(path, features, sep, chunk_size)
+    while True:
+        with timer.stage("read"):
+            chunk = next(chunks, None)
+        if chunk is None:
+            return
+        ids, ages, data = chunk
+        with timer.stage("validate"):
+            validate_chunk(ids, ages, data)
+        try:
+            with timer.stage("scale"):
+                scaled = scaler.transform(data)
+            with timer.stage("predict"):
+                brain_age = model.predict(scaled)
+        except ValueError as exc:
+            raise SystemExit(f"Prediction failed for rows {data.index[0]}-{data.index[-1]}: {exc}") from exc
+        yield pd.DataFrame(
+            {"ID": ids.to_numpy(), "Age": ages.to_numpy(), "BrainAge": brain_age, "BrainPAD": brain_age - ages.to_numpy()},
+            columns=OUTPUT_COLUMNS,
+        )
+
+
+def main() -> None:
+    args = parse_args()
+    if args.chunk_size < 1:
+        raise SystemExit("--chunk-size must be at least 1")
+    source = Path(args.input)
+    if not source.is_file() and not FeatureStore.is_store(source):
+        raise SystemExit(f"Input not found: {source}")
+    sep = "\t" if args.sep in {"\\t", "tab"} else args.sep
+    timer = StageTimer()
+    with timer.stage("load"):
+        model = load_pickle(Path(args.model), "Model")
+        scaler = load_pickle(Path(args.scaler), "Scaler")
+    set_jobs(model, args.jobs)
+
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    rows = 0
+    with output.open("w", newline="", encoding="utf-8") as handle:
+        for number, result in enumerate(iter_predictions(source, model, scaler, sep, args.chunk_size, timer)):
+            with timer.stage("write"):
+                result.to_csv(handle, index=False, header=number == 0)
+            rows += len(result)
+    if rows == 0:
+        raise SystemExit(f"No subjects in {source}")
+    print(f"Processed all {rows} rows successfully. Wrote {output}")
+    print(timer.report())
+    if args.timings_out:
+        timer.write(Path(args.timings_out))
+
+
+if __name__ == "__main__":
+    main()
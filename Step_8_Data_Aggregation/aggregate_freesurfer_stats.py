@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""Compile the Step 8 raw FreeSurfer tables in one pass over the derivatives tree.
+
+For every ``sub-*`` folder this reads ``stats/lh.aparc.stats``,
+``rh.aparc.stats``, ``aseg.stats``, ``wmparc.stats`` and the
+``lh/rh.aparc.a2009s.stats`` mean thickness once each and writes:
+
+- ``dk_all_stats.csv``: DK cortical NumVert, SurfArea, GrayVol, ThickAvg,
+  ThickStd, MeanCurv, GausCurv, FoldInd and CurvInd per hemisphere and region,
+  plus aseg volumes.
+- ``wm_volumes.csv``: total, right and left cerebral white matter volume plus
+  the wmparc regional volumes.
+- ``icv_data.csv``: estimated total intracranial volume.
+- ``cortical_thickness.csv``: mean left and right cortical thickness.
+
+Values are copied as written in the stats files. Usage::
+
+    python Step_8_Data_Aggregation/aggregate_freesurfer_stats.py \\
+      --derivs /path/to/derivatives \\
+      --outdir /path/to/outputs
+"""
+
+from __future__ import annotations
+
+import argparse
+import csv
+import sys
+from pathlib import Path
+from typing import Any, Iterable
+
+from freesurfer_stats import read_stats
+
+
+APARC_MEASURES = ["NumVert", "SurfArea", "GrayVol", "ThickAvg", "ThickStd", "MeanCurv", "GausCurv", "FoldInd", "CurvInd"]
+WM_TOTALS = {
+    "TotalCerebralWM": "CerebralWhiteMatter",
+    "RightCerebralWM": "rhCerebralWhiteMatter",
+    "LeftCerebralWM": "lhCerebralWhiteMatter",
+}
+
+# table name: (output file, subject column, value for structures missing in a subject)
+TABLES = {
+    "dk": ("dk_all_stats.csv", "subject", ""),
+    "wm": ("wm_volumes.csv", "subjectID", "0"),
+    "icv": ("icv_data.csv", "SubjectID", ""),
+    "thickness": ("cortical_thickness.csv", "subjectid", ""),
+}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compile DK, white matter, ICV and mean thickness tables from FreeSurfer stats.")
+    parser.add_argument("--derivs", required=True, help="Derivatives folder holding one FreeSurfer folder per subject.")
+    parser.add_argument("--outdir", default=".", help="Output directory for the CSV tables. Default: current directory.")
+    parser.add_argument("--pattern", default="sub-*", help="Glob for subject folders under --derivs. Default: sub-*.")
+    parser.add_argument(
+        "--thickness-parc",
+        default="aparc.a2009s",
+        help="Parcellation whose MeanThickness measure goes into cortical_thickness.csv. Default: aparc.a2009s.",
+    )
+    return parser.parse_args()
+
+
+def aparc_row(hemi: str, stats) -> dict[str, str]:
+    """``<hemi>_<region>_<measure>`` columns of an aparc stats table."""
+    row = {}
+    for fields in stats.rows:
+        if len(fields) < 10:
+            continue
+        for measure, value in zip(APARC_MEASURES, fields[1:10]):
+            row[f"{hemi}_{fields[0]}_{measure}"] = value
+    return row
+
+
+def aseg_volumes(stats) -> dict[str, str]:
+    """Structure name to Volume_mm3 for the segmentation rows of an aseg or wmparc stats table."""
+    return {fields[4]: fields[3] for fields in stats.rows if len(fields) >= 5 and fields[0].isdigit()}
+
+
+def parse_subject(subject_dir: Path, thickness_parc: str = "aparc.a2009s") -> dict[str, Any]:
+    """Parse one subject's ``stats`` folder into one row per Step 8 table.
+
+    Returns ``{"subject": ..., "tables": {table: row}, "missing": [...]}``; a
+    table is left out when its required stats files are missing.
+    """
+    stats_dir = subject_dir / "stats"
+    files = {
+        "lh": stats_dir / "lh.aparc.stats",
+        "rh": stats_dir / "rh.aparc.stats",
+        "aseg": stats_dir / "aseg.stats",
+        "wmparc": stats_dir / "wmparc.stats",
+        "lh_thickness": stats_dir / f"lh.{thickness_parc}.stats",
+        "rh_thickness": stats_dir / f"rh.{thickness_parc}.stats",
+    }
+    parsed = {name: read_stats(path) for name, path in files.items() if path.is_file()}
+    tables: dict[str, dict[str, str]] = {}
+
+    if {"lh", "rh", "aseg"} <= parsed.keys():
+        tables["dk"] = {**aparc_row("lh", parsed["lh"]), **aparc_row("rh", parsed["rh"]), **aseg_volumes(parsed["aseg"])}
+    if "wmparc" in parsed:
+        wmparc = parsed["wmparc"]
+        row = {column: wmparc.measure(name) or "0" for column, name in WM_TOTALS.items()}
+        row.update(aseg_volumes(wmparc))
+        tables["wm"] = row
+    if "aseg" in parsed:
+        tables["icv"] = {"ICV": parsed["aseg"].measure("Estimated Total Intracranial Volume") or ""}
+    tables["thickness"] = {
+        f"{hemi}_thickness": (parsed[f"{hemi}_thickness"].measure("MeanThickness") or "") if f"{hemi}_thickness" in parsed else ""
+        for hemi in ["lh", "rh"]
+    }
+    return {"subject": subject_dir.name, "tables": tables, "missing": sorted(name for name in files if name not in parsed)}
+
+
+def subject_dirs(derivs: Path, pattern: str) -> list[Path]:
+    return sorted(path for path in derivs.glob(pattern) if path.is_dir())
+
+
+def write_rows(path: Path, subject_col: str, rows: Iterable[tuple[str, dict[str, str]]], missing: str) -> int:
+    """Write one row per subject; columns are the structures in first-seen order."""
+    rows = list(rows)
+    columns = list(dict.fromkeys(column for _, row in rows for column in row))
+    with path.open("w", newline="", encoding="utf-8") as handle:
+        writer = csv.writer(handle, lineterminator="\n")
+        writer.writerow([subject_col, *columns])
+        for subject, row in rows:
+            writer.writerow([subject, *(row.get(column, missing) for column in columns)])
+    return len(rows)
+
+
+def write_tables(records: list[dict[str, Any]], outdir: Path) -> dict[str, Path]:
+    """Write the four Step 8 tables from :func:`parse_subject` records."""
+    outdir.mkdir(parents=True, exist_ok=True)
+    written = {}
+    for table, (filename, subject_col, missing) in TABLES.items():
+        rows = [(record["subject"], record["tables"][table]) for record in records if table in record["tables"]]
+        if not rows:
+            print(f"WARNING: no subject has the stats files needed for {filename}; not written", file=sys.stderr)
+            continue
+        written[table] = outdir / filename
+        count = write_rows(written[table], subject_col, rows, missing)
+        print(f"  {written[table]} ({count} subjects)")
+    return written
+
+
+def main() -> None:
+    args = parse_args()
+    derivs = Path(args.derivs)
+    if not derivs.is_dir():
+        raise SystemExit(f"Derivatives directory not found: {derivs}")
+    subjects = subject_dirs(derivs, args.pattern)
+    if not subjects:
+        raise SystemExit(f"No subject folders matching {args.pattern!r} under {derivs}")
+
+    records = []
+    for subject_dir in subjects:
+        record = parse_subject(subject_dir, args.thickness_parc)
+        if "dk" not in record["tables"]:
+            print(f"Missing DK stats for {record['subject']} ({', '.join(record['missing'])}); not in dk_all_stats.csv")
+        if "wm" not in record["tables"]:
+            print(f"Missing wmparc for {record['subject']}; not in wm_volumes.csv", file=sys.stderr)
+        records.append(record)
+
+    print(f"Parsed {len(records)} subjects. Wrote:")
+    written = write_tables(records, Path(args.outdir))
+    if len(written) < len(TABLES):
+        raise SystemExit("Some tables were not written; see the warnings above.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+"""Line parser for FreeSurfer ``.stats`` files.
+
+A stats file has ``# Measure`` lines holding whole-brain or hemisphere
+measures, a ``# ColHeaders`` line, and one whitespace-separated row per
+structure. :func:`read_stats` reads a file once and keeps the measure fields
+and the table rows as the strings written by FreeSurfer, so aggregated
+tables reproduce the original values exactly.
+"""
+
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+
+
+MEASURE_PREFIX = "# Measure "
+HEADER_PREFIX = "# ColHeaders"
+
+
+@dataclass(frozen=True)
+class StatsFile:
+    """Measures and structure table of one FreeSurfer stats file.
+
+    ``measures`` holds the comma-separated fields of each ``# Measure`` line,
+    for example ``("Cortex", "MeanThickness", "Mean Thickness", "2.45", "mm")``.
+    ``columns`` are the ``# ColHeaders`` names and ``rows`` the split table rows.
+    """
+
+    measures: tuple[tuple[str, ...], ...]
+    columns: tuple[str, ...]
+    rows: tuple[tuple[str, ...], ...]
+
+    def measure(self, name: str) -> str | None:
+        """Value of the first measure whose name, short name or description is ``name``."""
+        for fields in self.measures:
+            if name in fields[:3] and len(fields) > 3:
+                return fields[3]
+        return None
+
+    def column(self, name: str) -> int:
+        """Position of ``name`` in the table columns."""
+        return self.columns.index(name)
+
+    def table(self, key: str, value: str, min_fields: int = 0) -> dict[str, str]:
+        """Map the ``key`` column to the ``value`` column over rows with at least ``min_fields`` fields."""
+        key_pos, value_pos = self.column(key), self.column(value)
+        needed = max(min_fields, key_pos + 1, value_pos + 1)
+        return {row[key_pos]: row[value_pos] for row in self.rows if len(row) >= needed}
+
+
+def read_stats(path: Path) -> StatsFile:
+    """Parse ``path`` in one pass over its lines."""
+    measures = []
+    columns: tuple[str, ...] = ()
+    rows = []
+    with open(path, encoding="utf-8", errors="replace") as handle:
+        for line in handle:
+            if line.startswith("#"):
+                if line.startswith(MEASURE_PREFIX):
+                    measures.append(tuple(field.strip() for field in line[len(MEASURE_PREFIX):].split(",")))
+                elif line.startswith(HEADER_PREFIX):
+                    columns = tuple(line[len(HEADER_PREFIX):].split())
+            elif columns:
+                fields = line.split()
+                if fields:
+                    rows.append(tuple(fields))
+    return StatsFile(tuple(measures), columns, tuple(rows))
@@ -0,0 +1,68 @@
+"""Effect sizes for the BrainPAD and regional group comparisons.
+
+``cliffs_delta`` is a drop-in replacement for ``cliffs_delta.cliffs_delta``
+from the ``cliffs_delta`` package. It counts the pairs with ``x > y`` and
+``x < y`` using a sort and two ``searchsorted`` calls instead of walking the
+data in Python. ``cliffs_delta_batched`` does the same for many (x, y) column
+pairs at once. Both compute the same integer counts as the package and divide
+them the same way, so the results are identical, ties included.
+"""
+
+from __future__ import annotations
+
+from typing import Any
+
+
+# Thresholds from Hess and Kromrey (2004), as used by the cliffs_delta package.
+CLIFFS_DELTA_THRESHOLDS = {"small": 0.147, "medium": 0.33, "large": 0.474}
+
+
+def cliffs_delta_size(delta: float, thresholds: dict[str, float] | None = None) -> str:
+    """Label |delta| as negligible, small, medium or large."""
+    thresholds = thresholds or CLIFFS_DELTA_THRESHOLDS
+    delta = abs(delta)
+    if delta < thresholds["small"]:
+        return "negligible"
+    if delta < thresholds["medium"]:
+        return "small"
+    if delta < thresholds["large"]:
+        return "medium"
+    return "large"
+
+
+def cliffs_delta(x, y, **thresholds: float) -> tuple[float, str]:
+    """Return Cliff's delta of x vs y and its size label, like ``cliffs_delta.cliffs_delta``.
+
+    Ties count as neither greater nor smaller. Runs in O((m + n) log n).
+    """
+    import numpy as np
+
+    x = np.asarray(x, dtype=float).ravel()
+    y = np.sort(np.asarray(y, dtype=float).ravel())
+    m, n = x.size, y.size
+    more = int(np.searchsorted(y, x, side="left").sum())
+    less = int((n - np.searchsorted(y, x, side="right")).sum())
+    delta = (more - less) / (m * n)
+    return delta, cliffs_delta_size(delta, thresholds or None)
+
+
+def cliffs_delta_batched(x, y, axis: int = 0) -> Any:
+    """Cliff's delta for every pair of slices of x and y along ``axis``.
+
+    ``x`` and ``y`` must have the same shape apart from ``axis``, which holds
+    the observations, for example (subjects, regions) matrices for two groups
+    or (resamples, subjects) bootstrap draws with ``axis=-1``. The count
+    ``#(x > y) - #(x < y)`` is ``2 * U - m * n``, where ``U`` is the
+    Mann-Whitney U of x; doubled mid-ranks are integers, so the counts are
+    exact and match :func:`cliffs_delta`. Slices containing NaN give NaN.
+    """
+    import numpy as np
+    from scipy.stats import rankdata
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    m, n = x.shape[axis], y.shape[axis]
+    doubled_ranks = 2 * rankdata(np.concatenate([x, y], axis=axis), axis=axis)
+    doubled_rank_sum = np.take(doubled_ranks, np.arange(m), axis=axis).sum(axis=axis)
+    difference = doubled_rank_sum - m * (m + 1) - m * n
+    return difference / (m * n)
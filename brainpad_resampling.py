@@ -0,0 +1,173 @@
+"""Vectorized bootstrap and permutation engine for brainpadstats.py.
+
+For every pair of groups this computes Cohen's d and Cliff's delta with
+percentile bootstrap confidence intervals and two-sided permutation p-values.
+Resamples are drawn as NumPy index matrices (one row per resample) and every
+statistic is evaluated for a whole block of resamples at once, so 10,000
+resamples of a typical cohort comparison take well under a second. Pairs can be
+spread over a process pool; each pair gets its own child seed, so results do
+not depend on the number of workers.
+"""
+
+from __future__ import annotations
+
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import Any, Hashable, Iterable
+
+from brainpad_effects import cliffs_delta_batched
+
+
+DEFAULT_RESAMPLES = 10_000
+DEFAULT_BLOCK = 2_000
+
+
+@dataclass(frozen=True)
+class PairResampling:
+    """Effect sizes, bootstrap CIs and permutation p-values for one group pair."""
+
+    group1: Hashable
+    group2: Hashable
+    n1: int
+    n2: int
+    cohen_d: float
+    cohen_d_ci_low: float
+    cohen_d_ci_high: float
+    cohen_d_perm_p: float
+    cliffs_delta: float
+    cliffs_delta_ci_low: float
+    cliffs_delta_ci_high: float
+    cliffs_delta_perm_p: float
+    n_resamples: int
+
+
+def cohen_d_rows(x, y):
+    """Cohen's d (average-variance pooled SD, as in brainpadstats.py) for each row of x and y."""
+    import numpy as np
+
+    pooled_sd = np.sqrt((np.var(x, axis=-1, ddof=1) + np.var(y, axis=-1, ddof=1)) / 2)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (np.mean(x, axis=-1) - np.mean(y, axis=-1)) / pooled_sd
+
+
+def _percentile_ci(values, confidence: float) -> tuple[float, float]:
+    import numpy as np
+
+    alpha = (1 - confidence) / 2
+    finite = values[np.isfinite(values)]
+    if finite.size == 0:
+        return float("nan"), float("nan")
+    low, high = np.quantile(finite, [alpha, 1 - alpha])
+    return float(low), float(high)
+
+
+def _permutation_p(permuted, observed: float) -> float:
+    import numpy as np
+
+    if not np.isfinite(observed):
+        return float("nan")
+    extreme = np.sum(np.abs(permuted) >= abs(observed) - 1e-12)
+    return float((extreme + 1) / (permuted.size + 1))
+
+
+def resample_pair(
+    x,
+    y,
+    n_resamples: int = DEFAULT_RESAMPLES,
+    seed: Any = None,
+    confidence: float = 0.95,
+    block: int = DEFAULT_BLOCK,
+    group1: Hashable = "group1",
+    group2: Hashable = "group2",
+) -> PairResampling:
+    """Bootstrap CIs and permutation p-values for Cohen's d and Cliff's delta of x vs y.
+
+    Bootstrap resamples draw x and y with replacement within each group;
+    permutation resamples shuffle the group labels of the pooled values.
+    ``seed`` is anything accepted by ``numpy.random.default_rng``.
+    """
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    x = x[~np.isnan(x)]
+    y = y[~np.isnan(y)]
+    n1, n2 = x.size, y.size
+    if n1 < 2 or n2 < 2:
+        nan = float("nan")
+        return PairResampling(group1, group2, n1, n2, nan, nan, nan, nan, nan, nan, nan, nan, 0)
+
+    rng = np.random.default_rng(seed)
+    observed_d = float(cohen_d_rows(x, y))
+    observed_delta = float(cliffs_delta_batched(x, y, axis=-1))
+
+    pooled = np.concatenate([x, y])
+    boot_d = np.empty(n_resamples)
+    boot_delta = np.empty(n_resamples)
+    perm_d = np.empty(n_resamples)
+    perm_delta = np.empty(n_resamples)
+    for start in range(0, n_resamples, block):
+        stop = min(start + block, n_resamples)
+        rows = stop - start
+
+        xb = x[rng.integers(0, n1, size=(rows, n1))]
+        yb = y[rng.integers(0, n2, size=(rows, n2))]
+        boot_d[start:stop] = cohen_d_rows(xb, yb)
+        boot_delta[start:stop] = cliffs_delta_batched(xb, yb, axis=-1)
+
+        shuffled = pooled[rng.permuted(np.broadcast_to(np.arange(n1 + n2), (rows, n1 + n2)), axis=1)]
+        perm_d[start:stop] = cohen_d_rows(shuffled[:, :n1], shuffled[:, n1:])
+        perm_delta[start:stop] = cliffs_delta_batched(shuffled[:, :n1], shuffled[:, n1:], axis=-1)
+
+    d_low, d_high = _percentile_ci(boot_d, confidence)
+    delta_low, delta_high = _percentile_ci(boot_delta, confidence)
+    return PairResampling(
+        group1=group1,
+        group2=group2,
+        n1=n1,
+        n2=n2,
+        cohen_d=observed_d,
+        cohen_d_ci_low=d_low,
+        cohen_d_ci_high=d_high,
+        cohen_d_perm_p=_permutation_p(perm_d, observed_d),
+        cliffs_delta=observed_delta,
+        cliffs_delta_ci_low=delta_low,
+        cliffs_delta_ci_high=delta_high,
+        cliffs_delta_perm_p=_permutation_p(perm_delta, observed_delta),
+        n_resamples=n_resamples,
+    )
+
+
+def _resample_job(job: tuple) -> PairResampling:
+    x, y, n_resamples, seed, confidence, group1, group2 = job
+    return resample_pair(x, y, n_resamples, seed, confidence, group1=group1, group2=group2)
+
+
+def resample_pairs(
+    groups: dict[Hashable, Any],
+    pairs: Iterable[tuple[Hashable, Hashable]],
+    n_resamples: int = DEFAULT_RESAMPLES,
+    seed: int = 117,
+    confidence: float = 0.95,
+    jobs: int = 1,
+) -> list[dict[str, Any]]:
+    """Run :func:`resample_pair` for every ``(group1, group2)`` in ``pairs``.
+
+    ``groups`` maps each group label to its values. Returns one result dict per
+    pair, in the order of ``pairs``. With ``jobs > 1`` the pairs run in a
+    process pool.
+    """
+    import numpy as np
+
+    pairs = list(pairs)
+    seeds = np.random.SeedSequence(seed).spawn(len(pairs))
+    work = [
+        (np.asarray(groups[a], dtype=float), np.asarray(groups[b], dtype=float), n_resamples, child, confidence, a, b)
+        for (a, b), child in zip(pairs, seeds)
+    ]
+    if jobs > 1 and len(work) > 1:
+        with ProcessPoolExecutor(max_workers=jobs) as pool:
+            results = list(pool.map(_resample_job, work))
+    else:
+        results = [_resample_job(job) for job in work]
+    return [asdict(result) for result in results]
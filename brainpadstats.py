@@ -2,513 +2,471 @@
 # Analysis of BrainPAD - Brain Predicted Age Difference Analysis Script
 ###############################################################################
 
-# This script performs comprehensive analysis of brain age predictions across different cohorts.
-# It generates statistical summaries and visualizations to help understand brain age differences between control subjects and spinal cord injury (SCI) patients with and without pain.
+"""BrainPAD group comparisons as an importable library and a command-line tool.
 
-###############################################################################
-
-# Import required libraries
-import pandas as pd  # For data manipulation and analysis
-import matplotlib.pyplot as plt  # For creating plots and visualizations
-import numpy as np  # For numerical operations
-import seaborn as sns  # For statistical data visualization
-from scipy import stats  # For statistical tests
-from itertools import combinations  # For generating combinations of groups
-from cliffs_delta import cliffs_delta  # For calculating Cliff's delta effect size
-import statsmodels.api as sm # For regression analysis
-import os # For file operations
-
-# Define file paths for input data and output files
-PyB_path = "/path/to/your/predicted_results.xlsx"  # Excel file containing brain age predictions
-output_path1 = "/path/to/output/summary_statistics.csv"  # CSV file for summary statistics
-output_path2 = "/path/to/output/BrainPAD_comparison.png"  # Plot comparing BrainPAD across cohorts
-output_path3 = "/path/to/output/Chronological_vs_BrainAge.png"  # Plot comparing chronological vs predicted brain age
-output_path4 = "/path/to/output/BrainPAD_vs_Age.png"  # Plot showing BrainPAD vs age relationship
-output_path5 = "/path/to/output/BrainPAD_across_sex.png"  # Plot showing sex-specific BrainPAD comparisons
-output_path6 = "/path/to/output/BrainPAD_vs_TimeSinceInjury.png"  # Plot showing BrainPAD vs injury duration + correlation 
-output_path7 = "/path/to/output/BrainPAD_across_cohorts.csv"  # Statistical results for cohort comparisons
-output_path8 = "/path/to/output/BrainPAD_across_sex.csv"  # Statistical results for sex-specific analyses
-output_path9 = "/path/to/output/BrainPAD_acorss_AIS.csv" # Statistical results for AIS-specific comparison
-output_path10 = "/path/to/output/Chi2_AIS.csv" # Statistical results for AIS-specific comparison
-output_path11 = "/path/to/output/TimeSinceInjury_Comparison.csv" # Statistical results for Time since Injury comparison
-output_path12 = "/path/to/output/ChronologicalAge_Comparison.csv"   # Statistical results for chronological age comparison
-df_pybrain = pd.read_excel(PyB_path)
-
-# Convert relevant columns to numeric format, handling any errors
-for col in ["Age", "BrainPAD", "BrainAge"]:
-    if col in df_pybrain.columns:
-        df_pybrain[col] = pd.to_numeric(df_pybrain[col], errors="coerce")
-
-# Define the order of cohorts for consistent analysis
-cohort_order = ["control", "SCI_nNP", "SCI_P"]  # Control, SCI without pain, SCI with pain
-
-# Initialize list to store summary statistics
-summary_results = []
-
-# Calculate summary statistics for each cohort
-for cohort in cohort_order:
-    # Filter data for current cohort
-    subset = df_pybrain[df_pybrain["Cohort"] == cohort]
-
-    # Calculate basic demographic and clinical statistics
-    num_participants = len(subset)
-    mean_age = subset["Age"].mean() if "Age" in subset.columns else np.nan
-    std_age = subset["Age"].std() if "Age" in subset.columns else np.nan
-    mean_brainpad = subset["BrainPAD"].mean() if "BrainPAD" in subset.columns else np.nan
-    std_brainpad = subset["BrainPAD"].std() if "BrainPAD" in subset.columns else np.nan
-    mean_brainage = subset["BrainAge"].mean() if "BrainAge" in subset.columns else np.nan
-    std_brainage = subset["BrainAge"].std() if "BrainAge" in subset.columns else np.nan
-
-    # Calculate sex distribution
-    num_male = sum(subset["Sex"] == "Male") if "Sex" in subset.columns else np.nan
-    num_female = sum(subset["Sex"] == "Female") if "Sex" in subset.columns else np.nan
-
-    # Get AIS (ASIA Impairment Scale) distribution for SCI participants
-    ais_distribution = subset["AIS"].value_counts().to_dict() if "AIS" in subset.columns else "Not Available"
-
-    # Calculate additional clinical measures
-    valid_time_since_sci = subset["Time since SCI (years)"].notna().sum() if "Time since SCI (years)" in subset.columns else 0
-    time_since_sci_mean = subset["Time since SCI (years)"].mean() if valid_time_since_sci > 2 else "Not Available"
-    
-    # Store all calculated statistics for this cohort
-    summary_results.append([
-        cohort, num_participants, mean_age, std_age, mean_brainpad, std_brainpad,
-        mean_brainage, std_brainage, num_male, num_female, ais_distribution,
-        time_since_sci_mean
-    ])
+This performs the analysis of brain age predictions across cohorts: summary
+statistics, cohort/sex/AIS comparisons of BrainPAD, time-since-injury and
+chronological-age comparisons, and the accompanying plots, comparing control
+subjects with spinal cord injury (SCI) participants with and without pain.
 
-# Create summary DataFrame with all statistics
-df_summary = pd.DataFrame(summary_results, columns=[
-    "Cohort", "Participants", "Mean Age", "SD Age", "Mean BrainPAD", "SD BrainPAD",
-    "Mean BrainAge", "SD BrainAge", "Num Male", "Num Female", "AIS Distribution",
-    "Mean Time Since SCI", 
-])
+Every pairwise comparison goes through :func:`compare_groups`, which can be
+imported and run on any table::
 
-# Save summary statistics to CSV file
-df_summary.to_csv(output_path1, index=False)
-
-
-# Create boxplot comparing BrainPAD across cohorts
-# Define colors for each cohort
-cohort_palette = {
-    "control": "#AEC6E8",  # Light Blue for control group
-    "SCI_nNP": "#FFCC99",  # Light Orange for SCI without pain
-    "SCI_P": "#99D8A0"     # Light Green for SCI with pain
-}
+    from brainpadstats import compare_groups
+    results = compare_groups(frame, "Cohort", "BrainPAD", [("control", "SCI_P")])
 
-# Create main boxplot
-plt.figure(figsize=(10, 6))
-sns.boxplot(x="Cohort", y="BrainPAD", data=df_pybrain, palette=cohort_palette, showfliers=False, width=0.6, boxprops={'alpha': 0.5})
-
-# Add individual data points
-sns.stripplot(x="Cohort", y="BrainPAD", data=df_pybrain, color="black", jitter=True, size=6, alpha=0.7)
-
-# Add mean values as triangular markers
-means = df_pybrain.groupby("Cohort")["BrainPAD"].mean()
-for i, cohort in enumerate(df_pybrain["Cohort"].unique()):
-    plt.scatter(i, means[cohort], color="black", marker="^", s=100, label="Mean" if i == 0 else "")
-
-# Customize plot appearance
-plt.title("BrainPAD Comparison Across Cohorts", fontsize=16, fontweight="bold")
-plt.xlabel("Cohort", fontsize=14, fontweight="bold")
-plt.ylabel("BrainPAD", fontsize=14, fontweight="bold")
-plt.xticks(fontsize=12)
-plt.yticks(fontsize=12)
-plt.legend(title="Statistics", loc="upper right")
-
-# Add grid and save plot
-plt.grid(alpha=0.3)
-plt.tight_layout()
-plt.savefig(output_path2)
-
-
-# Create scatter plot comparing chronological age vs predicted brain age
-plt.figure(figsize=(10, 6))
-sns.scatterplot(x="Age", y="BrainAge", hue="Cohort", data=df_pybrain, palette=cohort_palette, alpha=0.7, s=70, edgecolor="black")
-
-# Add reference line (y=x) showing perfect prediction
-plt.plot([df_pybrain["Age"].min(), df_pybrain["Age"].max()],
-         [df_pybrain["Age"].min(), df_pybrain["Age"].max()],
-         'k--', alpha=0.8)
-
-# Customize plot appearance
-plt.title("Chronological Age vs. Predicted Brain Age (PyBrain)", fontsize=16, fontweight="bold")
-plt.xlabel("Chronological Age", fontsize=14, fontweight="bold")
-plt.ylabel("Predicted Brain Age", fontsize=14, fontweight="bold")
-plt.xticks(fontsize=12)
-plt.yticks(fontsize=12)
-plt.legend(title="Cohort", loc="upper left")
-
-# Save plot
-plt.savefig(output_path3)
-
-
-# Create scatter plot showing BrainPAD vs Age relationship for different cohorts
-plt.figure(figsize=(10, 6))
-
-# Add trend lines for each cohort
-sns.lmplot(data=df_pybrain, x="Age", y="BrainPAD", hue="Cohort", palette=cohort_palette, ci=None, height=6, aspect=1.5)
-
-# Customize plot appearance
-plt.xlabel("Age (Years)", fontsize=14, fontweight="bold")
-plt.ylabel("BrainPAD", fontsize=14, fontweight="bold")
-plt.title("BrainPAD vs Age Across Cohorts", fontsize=16, fontweight="bold")
-plt.legend(title="Cohort", loc="upper right")
-plt.grid(alpha=0.3)
-
-# Save plot
-plt.savefig(output_path4)
-
-# Create sex-specific BrainPAD analysis
-# Split data by sex
-df_female = df_pybrain[df_pybrain["Sex"] == "Female"]
-df_male = df_pybrain[df_pybrain["Sex"] == "Male"]
-
-# Define cohort order and colors
-cohort_order = ["control", "SCI_nNP", "SCI_P"]
-cohort_palette = {"control": "#AEC6E8", "SCI_nNP": "#FFCC99", "SCI_P": "#99D8A0"}
-
-# Create side-by-side plots for female and male participants
-fig, axes = plt.subplots(nrows=1, ncols=2, figsize=(14, 6), sharey=True)
-
-# Plot female data
-sns.boxplot(x="Cohort", y="BrainPAD", data=df_female, order=cohort_order, palette=cohort_palette,
-            showfliers=False, width=0.6, ax=axes[0], legend=False)
-sns.stripplot(x="Cohort", y="BrainPAD", data=df_female, hue="Cohort", order=cohort_order, jitter=True,
-              size=8, alpha=0.7, color="black", ax=axes[0])
-axes[0].set_title("BrainPAD - Female", fontsize=14, fontweight="bold")
-axes[0].set_xlabel("Cohorts", fontsize=12, fontweight="bold")
-axes[0].set_ylabel("BrainPAD", fontsize=12, fontweight="bold")
-
-# Plot male data
-sns.boxplot(x="Cohort", y="BrainPAD", data=df_male, order=cohort_order, palette=cohort_palette,
-            showfliers=False, width=0.6, ax=axes[1])
-sns.stripplot(x="Cohort", y="BrainPAD", data=df_male, hue="Cohort", order=cohort_order, jitter=True,
-              size=8, alpha=0.7, color="black", ax=axes[1])
-axes[1].set_title("BrainPAD - Male", fontsize=14, fontweight="bold")
-axes[1].set_xlabel("Cohorts", fontsize=12, fontweight="bold")
-
-# Add overall title and save plot
-plt.suptitle("BrainPAD Comparison by Cohort (Separated by Sex)", fontsize=16, fontweight="bold")
-plt.tight_layout()
-plt.savefig(output_path5)
-
-
-# Analyze BrainPAD vs Time Since Injury for SCI participants
-# Filter the dataset for SCI participants only
-df_sci = df_pybrain[df_pybrain["Cohort"].isin(["SCI_nNP", "SCI_P"])].copy()
-
-# Rename column to avoid whitespace issues
-df_sci.rename(columns={"Time since SCI (years) ": "Time since SCI (years)"}, inplace=True)
-
-# Drop rows where Time Since SCI or BrainPAD is NaN
-df_sci = df_sci[["Time since SCI (years)", "BrainPAD", "Cohort"]].dropna()
-
-# Convert Time Since SCI to numeric
-df_sci["Time since SCI (years)"] = pd.to_numeric(df_sci["Time since SCI (years)"], errors="coerce")
-
-# Group Data by Cohort
-sci_nnp_tsi = df_sci[df_sci["Cohort"] == "SCI_nNP"]["Time since SCI (years)"].dropna()
-sci_p_tsi = df_sci[df_sci["Cohort"] == "SCI_P"]["Time since SCI (years)"].dropna()
-
-# Check Normality
-shapiro_nnp = stats.shapiro(sci_nnp_tsi)[1]
-shapiro_p = stats.shapiro(sci_p_tsi)[1]
-
-# Choose Statistical Test
-if shapiro_nnp > 0.05 and shapiro_p > 0.05:
-    tsi_test = "t-test"
-    test_stat, p_tsi = stats.ttest_ind(sci_nnp_tsi, sci_p_tsi)
-    effect_size_tsi = (sci_nnp_tsi.mean() - sci_p_tsi.mean()) / np.sqrt((sci_nnp_tsi.std()**2 + sci_p_tsi.std()**2) / 2)
-else:
-    tsi_test = "Mann-Whitney U"
-    test_stat, p_tsi = stats.mannwhitneyu(sci_nnp_tsi, sci_p_tsi)
-    effect_size_tsi, _ = cliffs_delta(sci_nnp_tsi, sci_p_tsi)
-
-# Perform Linear Regression
-X = df_sci["Time since SCI (years)"]
-y = df_sci["BrainPAD"]
-X = sm.add_constant(X)  # Add intercept
-
-model = sm.OLS(y, X, missing="drop").fit()
-regression_p = model.pvalues["Time since SCI (years)"]
-regression_r2 = model.rsquared
-
-# Define Colors for SCI Groups
-cohort_palette = {"SCI_nNP": "#FFCC99", "SCI_P": "#99D8A0"}
-
-# Create Scatter Plot
-plt.figure(figsize=(10, 6))
-sns.scatterplot(x="Time since SCI (years)", y="BrainPAD", hue="Cohort",
-                data=df_sci, palette=cohort_palette, s=70, alpha=0.8, edgecolor="black")
-
-# Add Trend Lines
-sns.regplot(x="Time since SCI (years)", y="BrainPAD", data=df_sci[df_sci["Cohort"] == "SCI_nNP"],
-            scatter=False, color="#FFCC99", line_kws={"linestyle": "--", "linewidth": 2})
-sns.regplot(x="Time since SCI (years)", y="BrainPAD", data=df_sci[df_sci["Cohort"] == "SCI_P"],
-            scatter=False, color="#99D8A0", line_kws={"linestyle": "--", "linewidth": 2})
-
-# Customize Labels & Title
-plt.xlabel("Time Since Injury (Years)", fontsize=14, fontweight="bold")
-plt.ylabel("BrainPAD", fontsize=14, fontweight="bold")
-plt.title("BrainPAD vs Time Since Injury (SCI Participants)", fontsize=16, fontweight="bold")
-
-# Add Statistical Annotations
-stats_text = f"{tsi_test}: p = {p_tsi:.3f}, ES = {effect_size_tsi:.2f}\n" \
-             f"Regression: R² = {regression_r2:.3f}, p = {regression_p:.3f}"
-plt.annotate(stats_text, xy=(0.025, 0.9), xycoords="axes fraction", fontsize=12, fontweight="bold")
-
-# Adjust Legend & Save Plot
-plt.legend(title="Cohort", loc="upper right")
-plt.grid(alpha=0.3)
-plt.tight_layout()
-temp_path = output_path6.replace(".png", "_temp.png")
-plt.savefig(temp_path)
-os.rename(temp_path, output_path6)
-
-
-# Perform statistical analysis
-# Define function to calculate Cohen's d effect size
-def cohen_d(x, y):
-    """Calculate Cohen's d for two independent samples."""
-    mean_x, mean_y = np.mean(x), np.mean(y)
-    pooled_std = np.sqrt(((np.std(x, ddof=1) ** 2) + (np.std(y, ddof=1) ** 2)) / 2)
-    return (mean_x - mean_y) / pooled_std
+Command line (several centre files can be passed at once; each one gets its
+own sub-folder of the output directory)::
 
-# Define cohorts
-cohort_order = ["control", "SCI_nNP", "SCI_P"]
+    python brainpadstats.py --input predicted_results.xlsx --output-dir brainpad_outputs
+    python brainpadstats.py --input centre_*.csv --output-dir brainpad_outputs --no-plots
 
-# Test for normality in entire dataset
-shapiro_p = stats.shapiro(df_pybrain["BrainPAD"].dropna())[1]
-ks_p = stats.kstest(df_pybrain["BrainPAD"].dropna(), 'norm',
-                    args=(df_pybrain["BrainPAD"].mean(), df_pybrain["BrainPAD"].std()))[1]
+matplotlib, seaborn and statsmodels are only imported when plots are drawn,
+so ``--no-plots`` runs need only pandas, NumPy and SciPy.
+"""
 
-# Determine if data is normally distributed
-is_normal = shapiro_p > 0.05 and ks_p > 0.05
+from __future__ import annotations
 
-# Perform pairwise comparisons between cohorts
-comparison_results = []
-for group1, group2 in combinations(cohort_order, 2):
-    data1 = df_pybrain[df_pybrain["Cohort"] == group1]["BrainPAD"].dropna()
-    data2 = df_pybrain[df_pybrain["Cohort"] == group2]["BrainPAD"].dropna()
+import argparse
+import os
+from itertools import combinations
+from pathlib import Path
+from typing import Hashable, Iterable
 
-    n1, n2 = len(data1), len(data2)  # Sample sizes
+from brainpad_effects import cliffs_delta
+from brainpad_resampling import DEFAULT_RESAMPLES, resample_pairs
 
-    # Choose appropriate statistical test based on normality
-    if is_normal:
-        test_stat, p_value = stats.ttest_ind(data1, data2)
-        test_used = f"t-test (t={test_stat:.2f})"
-        effect_size = cohen_d(data1, data2)
 
-    else:
-        test_stat, p_value = stats.mannwhitneyu(data1, data2)
-        test_used = f"Mann-Whitney U (U={test_stat:.2f})"
-        effect_size, _ = cliffs_delta(data1, data2)
-
-
-    # Always format df as n1=XX, n2=XX
-    df_value = f"n1={n1}, n2={n2}"
-
-    comparison_results.append([group1, group2, test_used, p_value, effect_size, df_value])
-
-# Create and save results DataFrame
-df_comparisons = pd.DataFrame(comparison_results, columns=["Group1", "Group2", "Test Used", "p-value", "Effect Size", "Sample Size"])
-df_comparisons.to_csv(output_path7)
-
-
-# Perform sex-specific statistical analysis
-# Split data by sex
-df_female = df_pybrain[df_pybrain["Sex"] == "Female"]
-df_male = df_pybrain[df_pybrain["Sex"] == "Male"]
-
-# Analyze female cohorts
-female_results = []
-for group1, group2 in combinations(cohort_order, 2):
-    data1 = df_female[df_female["Cohort"] == group1]["BrainPAD"].dropna()
-    data2 = df_female[df_female["Cohort"] == group2]["BrainPAD"].dropna()
-
-    n1, n2 = len(data1), len(data2)  # Sample sizes
-
-    # Choose appropriate test based on normality
-    if is_normal:
-        test_stat, p_value = stats.ttest_ind(data1, data2)
-        test_used = f"t-test (t={test_stat:.2f})"
-        effect_size = cohen_d(data1, data2)
-    else:
-        test_stat, p_value = stats.mannwhitneyu(data1, data2)
-        test_used = f"Mann-Whitney U (U={test_stat:.2f})"
-        effect_size, _ = cliffs_delta(data1, data2)
-
-    # Store results with sample sizes
-    df_value = f"n1={n1}, n2={n2}"
-    female_results.append(["Female", group1, group2, test_used, p_value, effect_size, df_value])
-
-# Analyze male cohorts
-male_results = []
-for group1, group2 in combinations(cohort_order, 2):
-    data1 = df_male[df_male["Cohort"] == group1]["BrainPAD"].dropna()
-    data2 = df_male[df_male["Cohort"] == group2]["BrainPAD"].dropna()
-    n1, n2 = len(data1), len(data2)  # Sample sizes
-    # Choose appropriate test based on normality
-    if is_normal:
-        test_stat, p_value = stats.ttest_ind(data1, data2)
-        test_used = f"t-test (t={test_stat:.2f})"
-        effect_size = cohen_d(data1, data2)
-    else:
-        test_stat, p_value = stats.mannwhitneyu(data1, data2)
-        test_used = f"Mann-Whitney U (U={test_stat:.2f})"
-        effect_size, _ = cliffs_delta(data1, data2)
-
-    # Store results with sample sizes
-    df_value = f"n1={n1}, n2={n2}"
-    male_results.append(["Male", group1, group2, test_used, p_value, effect_size, df_value])
-
-# Create and combine results DataFrames
-df_female_comparisons = pd.DataFrame(female_results, columns=["Sex", "Group1", "Group2", "Test Used", "p-value", "Effect Size", "Sample Size"])
-df_male_comparisons = pd.DataFrame(male_results, columns=["Sex", "Group1", "Group2", "Test Used", "p-value", "Effect Size", "Sample Size"])
-df_sex_comparisons = pd.concat([df_female_comparisons, df_male_comparisons], ignore_index=True)
-
-# Save sex-specific results
-df_sex_comparisons.to_csv(output_path8)
-
-# AIS vs BrainPAD
-# Filter dataset for relevant groups (SCI + Controls)
-df_sci_controls = df_pybrain[df_pybrain["Cohort"].isin(["control", "SCI_nNP", "SCI_P"])].copy()
-
-# Drop rows where AIS, Cohort, or BrainPAD is NaN or inf
-df_sci_controls = df_sci_controls[["AIS", "Cohort", "BrainPAD"]].replace([np.inf, -np.inf], np.nan).dropna()
+# Order of cohorts for consistent analysis: control, SCI without pain, SCI with pain
+COHORT_ORDER = ["control", "SCI_nNP", "SCI_P"]
+# Controls first, then AIS (ASIA Impairment Scale) grades
+AIS_ORDER = ["control", "D", "C", "B", "A"]
+COHORT_PALETTE = {
+    "control": "#AEC6E8",  # Light Blue for control group
+    "SCI_nNP": "#FFCC99",  # Light Orange for SCI without pain
+    "SCI_P": "#99D8A0",  # Light Green for SCI with pain
+}
+TSI_COL = "Time since SCI (years)"
+
+OUTPUT_NAMES = {
+    "summary": "summary_statistics.csv",
+    "cohort_plot": "BrainPAD_comparison.png",
+    "age_scatter_plot": "Chronological_vs_BrainAge.png",
+    "brainpad_age_plot": "BrainPAD_vs_Age.png",
+    "sex_plot": "BrainPAD_across_sex.png",
+    "tsi_plot": "BrainPAD_vs_TimeSinceInjury.png",
+    "cohorts": "BrainPAD_across_cohorts.csv",
+    "sex": "BrainPAD_across_sex.csv",
+    "ais": "BrainPAD_across_AIS.csv",
+    "ais_chi2": "Chi2_AIS.csv",
+    "tsi": "TimeSinceInjury_Comparison.csv",
+    "age": "ChronologicalAge_Comparison.csv",
+}
+PLOT_KEYS = ["cohort_plot", "age_scatter_plot", "brainpad_age_plot", "sex_plot", "tsi_plot"]
+
+RESAMPLING_COLUMNS = {
+    "Cohen d": "cohen_d",
+    "Cohen d CI Low": "cohen_d_ci_low",
+    "Cohen d CI High": "cohen_d_ci_high",
+    "Cohen d Permutation p": "cohen_d_perm_p",
+    "Cliff's Delta": "cliffs_delta",
+    "Cliff's Delta CI Low": "cliffs_delta_ci_low",
+    "Cliff's Delta CI High": "cliffs_delta_ci_high",
+    "Cliff's Delta Permutation p": "cliffs_delta_perm_p",
+}
 
-# Ensure AIS & Cohort are treated as categorical variables
-df_sci_controls["AIS"] = df_sci_controls["AIS"].astype(str)  # Convert AIS to string for categorical analysis
-df_sci_controls["Cohort"] = df_sci_controls["Cohort"].astype(str)
 
-# Define order for groups
-ais_order = ["control", "D", "C", "B", "A"]  # Controls first, then AIS order
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="BrainPAD statistics and plots across cohorts, sex and AIS grades.")
+    parser.add_argument("--input", nargs="+", required=True, help="Brain age prediction table(s), .xlsx or .csv.")
+    parser.add_argument(
+        "--output-dir",
+        required=True,
+        help="Output directory. With several inputs, each one is written to <output-dir>/<input name>/.",
+    )
+    parser.add_argument("--no-plots", action="store_true", help="Only write the statistics tables.")
+    parser.add_argument(
+        "--n-resamples",
+        type=int,
+        default=DEFAULT_RESAMPLES,
+        help=f"Bootstrap/permutation resamples per comparison; 0 disables them. Default: {DEFAULT_RESAMPLES}.",
+    )
+    parser.add_argument("--seed", type=int, default=117, help="Seed for reproducible resampling. Default: 117.")
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=min(4, os.cpu_count() or 1),
+        help="Worker processes for the resampling. Results do not depend on it. Default: up to 4.",
+    )
+    args = parser.parse_args()
+    if args.n_resamples < 0:
+        parser.error("--n-resamples must be 0 or more")
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return args
+
+
+def load_predictions(path: Path):
+    """Read a prediction table (.xlsx/.xls or .csv) and convert its numeric columns."""
+    import pandas as pd
+
+    frame = pd.read_excel(path) if path.suffix.lower() in {".xlsx", ".xls"} else pd.read_csv(path)
+    # Some exports carry a trailing space in the time-since-injury header
+    frame = frame.rename(columns={f"{TSI_COL} ": TSI_COL})
+    for col in ["Age", "BrainPAD", "BrainAge"]:
+        if col in frame.columns:
+            frame[col] = pd.to_numeric(frame[col], errors="coerce")
+    return frame
+
+
+def cohen_d(x, y) -> float:
+    """Calculate Cohen's d for two independent samples."""
+    import numpy as np
 
-# Function for Cohen's d
-def cohen_d(x, y):
     mean_x, mean_y = np.mean(x), np.mean(y)
     pooled_std = np.sqrt(((np.std(x, ddof=1) ** 2) + (np.std(y, ddof=1) ** 2)) / 2)
     return (mean_x - mean_y) / pooled_std
 
-# Check Normality for Entire Dataset
-shapiro_p = stats.shapiro(df_sci_controls["BrainPAD"].dropna())[1]
-ks_p = stats.kstest(df_sci_controls["BrainPAD"].dropna(), 'norm',
-                    args=(df_sci_controls["BrainPAD"].mean(), df_sci_controls["BrainPAD"].std()))[1]
-
-# Determine Normality
-is_normal = shapiro_p > 0.05 and ks_p > 0.05
 
-# Statistical Comparisons (AIS + Controls)
-comparison_results = []
-for group1, group2 in combinations(ais_order, 2):
-    data1 = df_sci_controls[df_sci_controls["AIS"] == group1]["BrainPAD"].dropna() if group1 != "control" else df_sci_controls[df_sci_controls["Cohort"] == "control"]["BrainPAD"].dropna()
-    data2 = df_sci_controls[df_sci_controls["AIS"] == group2]["BrainPAD"].dropna() if group2 != "control" else df_sci_controls[df_sci_controls["Cohort"] == "control"]["BrainPAD"].dropna()
+def is_normal(values) -> bool:
+    """True if neither Shapiro-Wilk nor Kolmogorov-Smirnov rejects normality at 0.05."""
+    from scipy import stats
+
+    values = values.dropna()
+    shapiro_p = stats.shapiro(values)[1]
+    ks_p = stats.kstest(values, "norm", args=(values.mean(), values.std()))[1]
+    return shapiro_p > 0.05 and ks_p > 0.05
+
+
+def compare_groups(
+    frame,
+    group_col: str,
+    value_col: str,
+    pairs: Iterable[tuple[Hashable, Hashable]],
+    normal: bool | None = None,
+    n_resamples: int = 0,
+    seed: int = 117,
+    jobs: int = 1,
+):
+    """Compare ``value_col`` between the ``group_col`` groups of every ``(group1, group2)`` pair.
+
+    Uses an independent t-test with Cohen's d when the values are normal and a
+    Mann-Whitney U test with Cliff's delta otherwise. ``normal`` defaults to
+    :func:`is_normal` of the whole ``value_col``. Returns one row per pair with
+    Group1, Group2, Test Used, p-value, Effect Size and Sample Size columns;
+    with ``n_resamples > 0`` the bootstrap CIs and permutation p-values of both
+    effect sizes are appended (see ``brainpad_resampling.resample_pairs``).
+    """
+    import pandas as pd
+    from scipy import stats
+
+    pairs = list(pairs)
+    if normal is None:
+        normal = is_normal(frame[value_col])
+
+    values = {
+        group: frame.loc[frame[group_col] == group, value_col].dropna()
+        for group in dict.fromkeys(group for pair in pairs for group in pair)
+    }
+    rows = []
+    for group1, group2 in pairs:
+        data1, data2 = values[group1], values[group2]
+        if normal:
+            test_stat, p_value = stats.ttest_ind(data1, data2)
+            test_used = f"t-test (t={test_stat:.2f})"
+            effect_size = cohen_d(data1, data2)
+        else:
+            test_stat, p_value = stats.mannwhitneyu(data1, data2)
+            test_used = f"Mann-Whitney U (U={test_stat:.2f})"
+            effect_size, _ = cliffs_delta(data1, data2)
+        rows.append([group1, group2, test_used, p_value, effect_size, f"n1={len(data1)}, n2={len(data2)}"])
+
+    results = pd.DataFrame(rows, columns=["Group1", "Group2", "Test Used", "p-value", "Effect Size", "Sample Size"])
+    if n_resamples > 0:
+        resampled = resample_pairs(values, pairs, n_resamples, seed, jobs=jobs)
+        for column, key in RESAMPLING_COLUMNS.items():
+            results[column] = [result[key] for result in resampled]
+    return results
+
+
+def summarize_cohorts(frame):
+    """Demographic, clinical and BrainPAD summary statistics for each cohort."""
+    import numpy as np
+    import pandas as pd
+
+    summary_results = []
+    for cohort in COHORT_ORDER:
+        subset = frame[frame["Cohort"] == cohort]
+        valid_time_since_sci = subset[TSI_COL].notna().sum() if TSI_COL in subset.columns else 0
+        summary_results.append([
+            cohort,
+            len(subset),
+            subset["Age"].mean() if "Age" in subset.columns else np.nan,
+            subset["Age"].std() if "Age" in subset.columns else np.nan,
+            subset["BrainPAD"].mean() if "BrainPAD" in subset.columns else np.nan,
+            subset["BrainPAD"].std() if "BrainPAD" in subset.columns else np.nan,
+            subset["BrainAge"].mean() if "BrainAge" in subset.columns else np.nan,
+            subset["BrainAge"].std() if "BrainAge" in subset.columns else np.nan,
+            sum(subset["Sex"] == "Male") if "Sex" in subset.columns else np.nan,
+            sum(subset["Sex"] == "Female") if "Sex" in subset.columns else np.nan,
+            subset["AIS"].value_counts().to_dict() if "AIS" in subset.columns else "Not Available",
+            subset[TSI_COL].mean() if valid_time_since_sci > 2 else "Not Available",
+        ])
+    return pd.DataFrame(summary_results, columns=[
+        "Cohort", "Participants", "Mean Age", "SD Age", "Mean BrainPAD", "SD BrainPAD",
+        "Mean BrainAge", "SD BrainAge", "Num Male", "Num Female", "AIS Distribution",
+        "Mean Time Since SCI",
+    ])
 
-    n1, n2 = len(data1), len(data2)  # Sample sizes
 
-    # Choose the statistical test based on normality
-    if is_normal:
-        test_stat, p_value = stats.ttest_ind(data1, data2)
-        test_used = f"t-test (t={test_stat:.2f})"
-        effect_size = cohen_d(data1, data2)
+def compare_cohorts_by_sex(frame, normal: bool, n_resamples: int = 0, seed: int = 117, jobs: int = 1):
+    """Cohort comparisons of BrainPAD within female and within male participants."""
+    keyed = frame.assign(_sex_cohort=list(zip(frame["Sex"], frame["Cohort"])))
+    pairs = [((sex, group1), (sex, group2)) for sex in ["Female", "Male"] for group1, group2 in combinations(COHORT_ORDER, 2)]
+    results = compare_groups(keyed, "_sex_cohort", "BrainPAD", pairs, normal, n_resamples, seed, jobs)
+    results.insert(0, "Sex", [sex for sex, _ in results["Group1"]])
+    results["Group1"] = [cohort for _, cohort in results["Group1"]]
+    results["Group2"] = [cohort for _, cohort in results["Group2"]]
+    return results
+
+
+def ais_groups(frame):
+    """Controls and SCI participants by AIS grade, stacked under an "AIS Group" column.
+
+    Returns the stacked frame and the filtered control/SCI rows it was built from.
+    """
+    import numpy as np
+    import pandas as pd
+
+    # Drop rows where AIS, Cohort, or BrainPAD is NaN or inf; AIS and Cohort are categorical
+    subset = frame[frame["Cohort"].isin(COHORT_ORDER)][["AIS", "Cohort", "BrainPAD"]]
+    subset = subset.replace([np.inf, -np.inf], np.nan).dropna().astype({"AIS": str, "Cohort": str})
+    parts = [
+        (subset[subset["Cohort"] == "control"] if group == "control" else subset[subset["AIS"] == group]).assign(**{"AIS Group": group})
+        for group in AIS_ORDER
+    ]
+    return pd.concat(parts, ignore_index=True), subset
+
+
+def ais_chi_square(frame):
+    """Chi-square test of the AIS distribution between SCI_P and SCI_nNP."""
+    import pandas as pd
+    from scipy import stats
+
+    df_sci = frame[frame["Cohort"].isin(["SCI_P", "SCI_nNP"])]
+    chi2_stat, p_value, dof, _ = stats.chi2_contingency(pd.crosstab(df_sci["Cohort"], df_sci["AIS"]))
+    return pd.DataFrame({"Chi-Square Statistic": [chi2_stat], "Degrees of Freedom": [dof], "p-value": [p_value]})
+
+
+def compare_time_since_injury(frame, normal: bool):
+    """Compare time since injury between SCI_P and SCI_nNP."""
+    import pandas as pd
+
+    df_sci = frame[frame["Cohort"].isin(["SCI_P", "SCI_nNP"])].copy()
+    df_sci[TSI_COL] = pd.to_numeric(df_sci[TSI_COL], errors="coerce")
+    result = compare_groups(df_sci, "Cohort", TSI_COL, [("SCI_P", "SCI_nNP")], normal).iloc[0]
+    test_used = result["Test Used"].replace("t-test", "T-Test").replace("Mann-Whitney U ", "Mann-Whitney U-Test ")
+    return pd.DataFrame({
+        "Test": [test_used],
+        "p-Value": [result["p-value"]],
+        "Effect Size": [result["Effect Size"]],
+        "n_SCI_P": [df_sci.loc[df_sci["Cohort"] == "SCI_P", TSI_COL].notna().sum()],
+        "n_SCI_nNP": [df_sci.loc[df_sci["Cohort"] == "SCI_nNP", TSI_COL].notna().sum()],
+    })
+
+
+def analyze(
+    frame,
+    output_dir: Path,
+    plots: bool = True,
+    n_resamples: int = DEFAULT_RESAMPLES,
+    seed: int = 117,
+    jobs: int = 1,
+) -> dict[str, Path]:
+    """Run the full BrainPAD analysis of one table and write every output to ``output_dir``.
+
+    Returns the written paths keyed like ``OUTPUT_NAMES``.
+    """
+    output_dir.mkdir(parents=True, exist_ok=True)
+    paths = {key: output_dir / name for key, name in OUTPUT_NAMES.items() if plots or key not in PLOT_KEYS}
+    cohort_pairs = list(combinations(COHORT_ORDER, 2))
+
+    summarize_cohorts(frame).to_csv(paths["summary"], index=False)
+
+    if plots:
+        plot_brainpad_by_cohort(frame, paths["cohort_plot"])
+        plot_age_vs_brainage(frame, paths["age_scatter_plot"])
+        plot_brainpad_vs_age(frame, paths["brainpad_age_plot"])
+        plot_brainpad_by_sex(frame, paths["sex_plot"])
+        plot_time_since_injury(frame, paths["tsi_plot"])
+
+    # Cohort and sex-specific comparisons share the normality of BrainPAD in the entire dataset
+    brainpad_normal = is_normal(frame["BrainPAD"])
+    compare_groups(frame, "Cohort", "BrainPAD", cohort_pairs, brainpad_normal, n_resamples, seed, jobs).to_csv(paths["cohorts"])
+    compare_cohorts_by_sex(frame, brainpad_normal, n_resamples, seed, jobs).to_csv(paths["sex"])
+
+    # AIS comparisons use the normality of BrainPAD in the control/SCI rows with a known AIS
+    df_ais, df_sci_controls = ais_groups(frame)
+    ais_normal = is_normal(df_sci_controls["BrainPAD"])
+    ais_results = compare_groups(df_ais, "AIS Group", "BrainPAD", combinations(AIS_ORDER, 2), ais_normal, n_resamples, seed, jobs)
+    ais_results = ais_results.rename(columns={"Group1": "Group 1", "Group2": "Group 2", "Sample Size": "Sample Sizes"})
+    ais_results.to_csv(paths["ais"], index=False)
+
+    ais_chi_square(frame).to_csv(paths["ais_chi2"], index=False)
+
+    # Time since injury and chronological age reuse the AIS normality decision
+    compare_time_since_injury(frame, ais_normal).to_csv(paths["tsi"], index=False)
+    age_results = compare_groups(frame, "Cohort", "Age", cohort_pairs, ais_normal)
+    age_results.drop(columns="Sample Size").to_csv(paths["age"], index=False)
+    return paths
+
+
+def _pyplot():
+    import matplotlib
+
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+
+    return plt, sns
+
+
+def plot_brainpad_by_cohort(frame, path: Path) -> None:
+    """Boxplot of BrainPAD across cohorts with individual points and cohort means."""
+    plt, sns = _pyplot()
+    plt.figure(figsize=(10, 6))
+    sns.boxplot(x="Cohort", y="BrainPAD", data=frame, palette=COHORT_PALETTE, showfliers=False, width=0.6, boxprops={"alpha": 0.5})
+    sns.stripplot(x="Cohort", y="BrainPAD", data=frame, color="black", jitter=True, size=6, alpha=0.7)
+
+    # Add mean values as triangular markers
+    means = frame.groupby("Cohort")["BrainPAD"].mean()
+    for i, cohort in enumerate(frame["Cohort"].unique()):
+        plt.scatter(i, means[cohort], color="black", marker="^", s=100, label="Mean" if i == 0 else "")
+
+    plt.title("BrainPAD Comparison Across Cohorts", fontsize=16, fontweight="bold")
+    plt.xlabel("Cohort", fontsize=14, fontweight="bold")
+    plt.ylabel("BrainPAD", fontsize=14, fontweight="bold")
+    plt.xticks(fontsize=12)
+    plt.yticks(fontsize=12)
+    plt.legend(title="Statistics", loc="upper right")
+    plt.grid(alpha=0.3)
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close("all")
+
+
+def plot_age_vs_brainage(frame, path: Path) -> None:
+    """Chronological age vs predicted brain age, with the y = x line of perfect prediction."""
+    plt, sns = _pyplot()
+    plt.figure(figsize=(10, 6))
+    sns.scatterplot(x="Age", y="BrainAge", hue="Cohort", data=frame, palette=COHORT_PALETTE, alpha=0.7, s=70, edgecolor="black")
+    plt.plot([frame["Age"].min(), frame["Age"].max()], [frame["Age"].min(), frame["Age"].max()], "k--", alpha=0.8)
+    plt.title("Chronological Age vs. Predicted Brain Age (PyBrain)", fontsize=16, fontweight="bold")
+    plt.xlabel("Chronological Age", fontsize=14, fontweight="bold")
+    plt.ylabel("Predicted Brain Age", fontsize=14, fontweight="bold")
+    plt.xticks(fontsize=12)
+    plt.yticks(fontsize=12)
+    plt.legend(title="Cohort", loc="upper left")
+    plt.savefig(path)
+    plt.close("all")
+
+
+def plot_brainpad_vs_age(frame, path: Path) -> None:
+    """BrainPAD vs age with a trend line for each cohort."""
+    plt, sns = _pyplot()
+    sns.lmplot(data=frame, x="Age", y="BrainPAD", hue="Cohort", palette=COHORT_PALETTE, ci=None, height=6, aspect=1.5)
+    plt.xlabel("Age (Years)", fontsize=14, fontweight="bold")
+    plt.ylabel("BrainPAD", fontsize=14, fontweight="bold")
+    plt.title("BrainPAD vs Age Across Cohorts", fontsize=16, fontweight="bold")
+    plt.legend(title="Cohort", loc="upper right")
+    plt.grid(alpha=0.3)
+    plt.savefig(path)
+    plt.close("all")
+
+
+def plot_brainpad_by_sex(frame, path: Path) -> None:
+    """Side-by-side BrainPAD boxplots across cohorts for female and male participants."""
+    plt, sns = _pyplot()
+    fig, axes = plt.subplots(nrows=1, ncols=2, figsize=(14, 6), sharey=True)
+    for ax, sex in zip(axes, ["Female", "Male"]):
+        df_sex = frame[frame["Sex"] == sex]
+        sns.boxplot(x="Cohort", y="BrainPAD", data=df_sex, order=COHORT_ORDER, palette=COHORT_PALETTE,
+                    showfliers=False, width=0.6, ax=ax, legend=False)
+        sns.stripplot(x="Cohort", y="BrainPAD", data=df_sex, hue="Cohort", order=COHORT_ORDER, jitter=True,
+                      size=8, alpha=0.7, color="black", ax=ax)
+        ax.set_title(f"BrainPAD - {sex}", fontsize=14, fontweight="bold")
+        ax.set_xlabel("Cohorts", fontsize=12, fontweight="bold")
+    axes[0].set_ylabel("BrainPAD", fontsize=12, fontweight="bold")
+    plt.suptitle("BrainPAD Comparison by Cohort (Separated by Sex)", fontsize=16, fontweight="bold")
+    plt.tight_layout()
+    plt.savefig(path)
+    plt.close(fig)
+
+
+def plot_time_since_injury(frame, path: Path) -> None:
+    """BrainPAD vs time since injury for SCI participants, annotated with the group test and a regression."""
+    import numpy as np
+    import pandas as pd
+    import statsmodels.api as sm
+    from scipy import stats
+
+    plt, sns = _pyplot()
+    df_sci = frame[frame["Cohort"].isin(["SCI_nNP", "SCI_P"])][[TSI_COL, "BrainPAD", "Cohort"]].dropna()
+    df_sci[TSI_COL] = pd.to_numeric(df_sci[TSI_COL], errors="coerce")
+    sci_nnp_tsi = df_sci[df_sci["Cohort"] == "SCI_nNP"][TSI_COL].dropna()
+    sci_p_tsi = df_sci[df_sci["Cohort"] == "SCI_P"][TSI_COL].dropna()
+
+    # The test here follows the normality of time since injury within each SCI group
+    if stats.shapiro(sci_nnp_tsi)[1] > 0.05 and stats.shapiro(sci_p_tsi)[1] > 0.05:
+        tsi_test = "t-test"
+        _, p_tsi = stats.ttest_ind(sci_nnp_tsi, sci_p_tsi)
+        effect_size_tsi = (sci_nnp_tsi.mean() - sci_p_tsi.mean()) / np.sqrt((sci_nnp_tsi.std() ** 2 + sci_p_tsi.std() ** 2) / 2)
     else:
-        test_stat, p_value = stats.mannwhitneyu(data1, data2)
-        test_used = f"Mann-Whitney U (U={test_stat:.2f})"
-        effect_size, _ = cliffs_delta(data1, data2)
-
-    # Store results
-    comparison_results.append([group1, group2, test_used, p_value, effect_size, f"n1={n1}, n2={n2}"])
-
-
-# Create DataFrame and Save
-df_comparisons = pd.DataFrame(comparison_results, columns=["Group 1", "Group 2", "Test Used", "p-value", "Effect Size", "Sample Sizes"])
-df_comparisons.to_csv(output_path9, index=False)
-
-
-# Chi-Square Test for AIS Distribution
-# Filter for SCI participants
-df_sci = df_pybrain[df_pybrain["Cohort"].isin(["SCI_P", "SCI_nNP"])]
-
-# Create a contingency table for AIS levels
-contingency_table = pd.crosstab(df_sci["Cohort"], df_sci["AIS"])
-
-# Perform Chi-Square test
-chi2_stat, p_value, dof, expected = stats.chi2_contingency(contingency_table)
-
-# Store results in a DataFrame
-df_chi2_results = pd.DataFrame({
-    "Chi-Square Statistic": [chi2_stat],
-    "Degrees of Freedom": [dof],
-    "p-value": [p_value]
-})
-# Save results to CSV
-df_chi2_results.to_csv(output_path10, index=False)
-
-# Define output path for saving results
-###Comparison between Time since Injury
-# Compare SCI_P and SCI_nNP for "Time since SCI (years)"
-df_sci_comparison = df_pybrain[df_pybrain["Cohort"].isin(["SCI_P", "SCI_nNP"])].copy()
-
-# Convert column to numeric and drop NaN values 
-df_sci_comparison["Time since SCI (years)"] = pd.to_numeric(df_sci_comparison["Time since SCI (years)"], errors="coerce")
-df_sci_comparison = df_sci_comparison.dropna(subset=["Time since SCI (years)"])
-
-# Extract values for both groups
-sci_p = df_sci_comparison[df_sci_comparison["Cohort"] == "SCI_P"]["Time since SCI (years)"]
-sci_nnp = df_sci_comparison[df_sci_comparison["Cohort"] == "SCI_nNP"]["Time since SCI (years)"]
-
-# Use previously determined normality test result
-if is_normal:
-    test_stat, p_value = stats.ttest_ind(sci_p, sci_nnp)
-    test_used = f"T-Test (t={test_stat:.2f})"
-    effect_size = cohen_d(sci_p, sci_nnp)
-else:
-    test_stat, p_value = stats.mannwhitneyu(sci_p, sci_nnp)
-    test_used = f"Mann-Whitney U-Test (U={test_stat:.2f})"
-    effect_size, _ = cliffs_delta(sci_p, sci_nnp)
-
-# Store results in a DataFrame
-df_time_comparison = pd.DataFrame({
-    "Test": [test_used],
-    "p-Value": [p_value], 
-    "Effect Size": [effect_size],
-    "n_SCI_P": [len(sci_p)],
-    "n_SCI_nNP": [len(sci_nnp)]
-})
-
-# Save results to CSV
-df_time_comparison.to_csv(output_path11, index=False)
-
-
-# Comparison Chronological Age
-# Function to Calculate Cohen's d
-def cohen_d(x, y):
-    mean_x, mean_y = np.mean(x), np.mean(y)
-    pooled_std = np.sqrt(((np.std(x, ddof=1) ** 2) + (np.std(y, ddof=1) ** 2)) / 2)
-    return (mean_x - mean_y) / pooled_std
-
-# Perform Pairwise Comparisons
-comparison_results = []
-for group1, group2 in combinations(cohort_order, 2):
-    data1 = df_pybrain[df_pybrain["Cohort"] == group1]["Age"].dropna()
-    data2 = df_pybrain[df_pybrain["Cohort"] == group2]["Age"].dropna()
-
-    # Choose statistical test
-    if is_normal:
-        test_stat, p_value = stats.ttest_ind(data1, data2)
-        test_used = f"t-test (t={test_stat:.2f})"
-        effect_size = cohen_d(data1, data2)
-    else:
-        test_stat, p_value = stats.mannwhitneyu(data1, data2)
-        test_used = f"Mann-Whitney U (U={test_stat:.2f})"
-        effect_size, _ = cliffs_delta(data1, data2)
-
-    # Store results
-    comparison_results.append([group1, group2, test_used, p_value, effect_size])
-
-# Convert to DataFrame
-df_comparisons = pd.DataFrame(comparison_results, columns=["Group1", "Group2", "Test Used", "p-value", "Effect Size"])
-
-# Save results to CSV
-df_comparisons.to_csv(output_path12, index=False)
\ No newline at end of file
+        tsi_test = "Mann-Whitney U"
+        _, p_tsi = stats.mannwhitneyu(sci_nnp_tsi, sci_p_tsi)
+        effect_size_tsi, _ = cliffs_delta(sci_nnp_tsi, sci_p_tsi)
+
+    model = sm.OLS(df_sci["BrainPAD"], sm.add_constant(df_sci[TSI_COL]), missing="drop").fit()
+    regression_p = model.pvalues[TSI_COL]
+    regression_r2 = model.rsquared
+
+    sci_palette = {cohort: COHORT_PALETTE[cohort] for cohort in ["SCI_nNP", "SCI_P"]}
+    plt.figure(figsize=(10, 6))
+    sns.scatterplot(x=TSI_COL, y="BrainPAD", hue="Cohort", data=df_sci, palette=sci_palette, s=70, alpha=0.8, edgecolor="black")
+    for cohort, color in sci_palette.items():
+        sns.regplot(x=TSI_COL, y="BrainPAD", data=df_sci[df_sci["Cohort"] == cohort],
+                    scatter=False, color=color, line_kws={"linestyle": "--", "linewidth": 2})
+    plt.xlabel("Time Since Injury (Years)", fontsize=14, fontweight="bold")
+    plt.ylabel("BrainPAD", fontsize=14, fontweight="bold")
+    plt.title("BrainPAD vs Time Since Injury (SCI Participants)", fontsize=16, fontweight="bold")
+    stats_text = f"{tsi_test}: p = {p_tsi:.3f}, ES = {effect_size_tsi:.2f}\n" \
+                 f"Regression: R² = {regression_r2:.3f}, p = {regression_p:.3f}"
+    plt.annotate(stats_text, xy=(0.025, 0.9), xycoords="axes fraction", fontsize=12, fontweight="bold")
+    plt.legend(title="Cohort", loc="upper right")
+    plt.grid(alpha=0.3)
+    plt.tight_layout()
+    temp_path = path.with_name(f"{path.stem}_temp{path.suffix}")
+    plt.savefig(temp_path)
+    os.replace(temp_path, path)
+    plt.close("all")
+
+
+def main() -> None:
+    args = parse_args()
+    inputs = [Path(path) for path in args.input]
+    output_root = Path(args.output_dir)
+    for path in inputs:
+        output_dir = output_root / path.stem if len(inputs) > 1 else output_root
+        print(f"Analyzing {path} -> {output_dir}")
+        analyze(
+            load_predictions(path),
+            output_dir,
+            plots=not args.no_plots,
+            n_resamples=args.n_resamples,
+            seed=args.seed,
+            jobs=args.jobs,
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,221 @@
+"""Region-wise cohort comparisons of BrainCharts z-scores.
+
+Compares every ``*_zscore`` column of a ``braincharts_zscores`` table between
+pairs of cohorts in one pass: the subjects x regions matrix of each cohort is
+tested with SciPy's axis-aware ``ttest_ind`` and ``mannwhitneyu``, Cohen's d is
+computed column-wise, and Cliff's delta comes from ``cliffs_delta_batched``.
+Benjamini-Hochberg FDR correction is applied over the regions of each cohort
+pair. Regions with missing values in a cohort are tested one at a time on
+their observed values.
+
+Usage::
+
+    python regional_comparisons.py \\
+      --input braincharts_normative_outputs/braincharts_zscores.csv \\
+      --output braincharts_region_comparisons.csv \\
+      --pairs 0:1 0:2 1:2 0:1+2
+
+A side of ``--pairs`` can join several cohort labels with ``+`` to pool them,
+for example all SCI participants against controls. Without ``--pairs``, every
+pair of the cohort labels found in the table is compared.
+"""
+
+from __future__ import annotations
+
+import argparse
+import warnings
+from itertools import combinations
+from pathlib import Path
+from typing import Sequence
+
+from brainpad_effects import cliffs_delta_batched
+
+
+RESULT_COLUMNS = [
+    "region", "group1", "group2", "n1", "n2", "mean1", "sd1", "mean2", "sd2",
+    "t", "t_p", "t_p_fdr", "u", "u_p", "u_p_fdr", "cohen_d", "cliffs_delta",
+]
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Compare BrainCharts z-scores between cohorts for every region.")
+    parser.add_argument("--input", required=True, help="braincharts_zscores table (.csv, .parquet or .feather).")
+    parser.add_argument("--output", required=True, help="Output CSV with one row per region and cohort pair.")
+    parser.add_argument("--cohort-col", default="cohort", help="Cohort/group column. Default: cohort.")
+    parser.add_argument("--z-suffix", default="_zscore", help="Suffix of the z-score columns. Default: _zscore.")
+    parser.add_argument(
+        "--pairs",
+        nargs="+",
+        help="Cohort pairs as GROUP1:GROUP2; join labels with + to pool cohorts. Default: every pair of cohorts.",
+    )
+    parser.add_argument(
+        "--equal-var",
+        action="store_true",
+        help="Use Student's t-test instead of Welch's t-test (the default, as in R's t.test).",
+    )
+    return parser.parse_args()
+
+
+def parse_pairs(specs: Sequence[str]) -> list[tuple[str, str]]:
+    """Parse GROUP1:GROUP2 pair specs."""
+    pairs = []
+    for spec in specs:
+        group1, sep, group2 = spec.partition(":")
+        if not sep or not group1 or not group2:
+            raise SystemExit(f"Invalid pair {spec!r}; expected GROUP1:GROUP2, e.g. 0:1 or 0:1+2")
+        pairs.append((group1, group2))
+    return pairs
+
+
+def fdr_bh(p_values):
+    """Benjamini-Hochberg adjusted p-values along the last axis; NaN p-values stay NaN and are not counted."""
+    import numpy as np
+
+    p_values = np.asarray(p_values, dtype=float)
+    adjusted = np.full(p_values.shape, np.nan)
+    finite = ~np.isnan(p_values)
+    p = p_values[finite]
+    if p.size == 0:
+        return adjusted
+    order = np.argsort(p)
+    scaled = p[order] * p.size / np.arange(1, p.size + 1)
+    scaled = np.minimum.accumulate(scaled[::-1])[::-1]
+    values = np.empty(p.size)
+    values[order] = np.minimum(scaled, 1.0)
+    adjusted[finite] = values
+    return adjusted
+
+
+def _matrix_stats(x, y, equal_var: bool) -> dict:
+    """Test statistics and effect sizes for each column of complete (NaN-free) x and y matrices."""
+    import numpy as np
+    from scipy import stats
+
+    t_stat, t_p = stats.ttest_ind(x, y, axis=0, equal_var=equal_var)
+    u_stat, u_p = stats.mannwhitneyu(x, y, axis=0)
+    var_x, var_y = np.var(x, axis=0, ddof=1), np.var(y, axis=0, ddof=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        cohen_d = (np.mean(x, axis=0) - np.mean(y, axis=0)) / np.sqrt((var_x + var_y) / 2)
+    return {
+        "t": t_stat, "t_p": t_p, "u": u_stat, "u_p": u_p,
+        "cohen_d": cohen_d, "cliffs_delta": cliffs_delta_batched(x, y, axis=0),
+    }
+
+
+def compare_pair(x, y, equal_var: bool = False) -> dict:
+    """Compare the columns of two subjects x regions matrices.
+
+    Complete columns are tested together; columns with missing values are
+    tested one at a time on their non-missing values, and get NaN when either
+    side has fewer than two values. Returns a dict of per-column arrays.
+    """
+    import numpy as np
+
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float)
+    n_regions = x.shape[1]
+    n1 = np.sum(~np.isnan(x), axis=0)
+    n2 = np.sum(~np.isnan(y), axis=0)
+    # Regions with no or one value in a cohort get NaN means/SDs without warnings
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore", RuntimeWarning)
+        result = {
+            "n1": n1, "n2": n2,
+            "mean1": np.nanmean(x, axis=0), "sd1": np.nanstd(x, axis=0, ddof=1),
+            "mean2": np.nanmean(y, axis=0), "sd2": np.nanstd(y, axis=0, ddof=1),
+        }
+    for key in ["t", "t_p", "u", "u_p", "cohen_d", "cliffs_delta"]:
+        result[key] = np.full(n_regions, np.nan)
+
+    testable = (n1 >= 2) & (n2 >= 2)
+    complete = testable & (n1 == x.shape[0]) & (n2 == y.shape[0])
+    if complete.any():
+        for key, values in _matrix_stats(x[:, complete], y[:, complete], equal_var).items():
+            result[key][complete] = values
+    for col in np.flatnonzero(testable & ~complete):
+        xc = x[~np.isnan(x[:, col]), col][:, None]
+        yc = y[~np.isnan(y[:, col]), col][:, None]
+        for key, values in _matrix_stats(xc, yc, equal_var).items():
+            result[key][col] = values[0]
+    return result
+
+
+def compare_regions(frame, cohort_col: str, regions: Sequence[str], pairs: Sequence[tuple[str, str]], equal_var: bool = False):
+    """Compare every region between each ``(group1, group2)`` pair of cohorts.
+
+    Cohort labels are matched as strings; a side may pool labels joined with
+    ``+``. The effect direction is group1 minus group2. Returns one row per
+    pair and region with the columns in ``RESULT_COLUMNS``.
+    """
+    import numpy as np
+    import pandas as pd
+
+    labels = frame[cohort_col].astype(str).to_numpy()
+    z = frame[list(regions)].to_numpy(dtype=float)
+    blocks = []
+    for group1, group2 in pairs:
+        x = z[np.isin(labels, group1.split("+"))]
+        y = z[np.isin(labels, group2.split("+"))]
+        result = compare_pair(x, y, equal_var)
+        result["t_p_fdr"] = fdr_bh(result["t_p"])
+        result["u_p_fdr"] = fdr_bh(result["u_p"])
+        blocks.append(pd.DataFrame({"region": list(regions), "group1": group1, "group2": group2, **result}))
+    if not blocks:
+        return pd.DataFrame(columns=RESULT_COLUMNS)
+    return pd.concat(blocks, ignore_index=True)[RESULT_COLUMNS]
+
+
+def read_columns(path: Path, cohort_col: str, z_suffix: str):
+    """Read the cohort column and every z-score column, and return (frame, regions)."""
+    import pandas as pd
+
+    suffix = path.suffix.lower()
+    if suffix == ".parquet":
+        import pyarrow.parquet as pq
+
+        names = pq.read_schema(path).names
+    elif suffix == ".feather":
+        import pyarrow.feather as feather
+
+        names = feather.read_table(path, memory_map=True).column_names
+    else:
+        names = list(pd.read_csv(path, nrows=0).columns)
+    if cohort_col not in names:
+        raise SystemExit(f"{path} has no cohort column {cohort_col!r}")
+    regions = [name for name in names if name.endswith(z_suffix)]
+    if not regions:
+        raise SystemExit(f"{path} has no columns ending in {z_suffix!r}")
+
+    columns = [cohort_col, *regions]
+    if suffix == ".parquet":
+        frame = pd.read_parquet(path, columns=columns)
+    elif suffix == ".feather":
+        frame = pd.read_feather(path, columns=columns)
+    else:
+        frame = pd.read_csv(path, usecols=columns, dtype={cohort_col: str})
+    return frame, regions
+
+
+def main() -> None:
+    import pandas as pd
+
+    args = parse_args()
+    frame, regions = read_columns(Path(args.input), args.cohort_col, args.z_suffix)
+    frame = frame[frame[args.cohort_col].notna()]
+    cohorts = sorted(frame[args.cohort_col].astype(str).unique())
+    pairs = parse_pairs(args.pairs) if args.pairs else list(combinations(cohorts, 2))
+    missing = sorted({label for pair in pairs for side in pair for label in side.split("+")} - set(cohorts))
+    if missing:
+        raise SystemExit(f"Cohort label(s) not found in {args.cohort_col!r}: {', '.join(missing)}; found {', '.join(cohorts)}")
+
+    results = compare_regions(frame, args.cohort_col, regions, pairs, args.equal_var)
+    output = Path(args.output)
+    output.parent.mkdir(parents=True, exist_ok=True)
+    results.to_csv(output, index=False)
+    significant = results.groupby(["group1", "group2"], sort=False)["t_p_fdr"].apply(lambda p: int((p < 0.05).sum()))
+    print(f"Compared {len(regions)} regions for {len(pairs)} cohort pair(s) -> {output}")
+    print(pd.DataFrame({"regions_t_p_fdr_lt_0.05": significant}).to_string())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,611 @@
+#!/usr/bin/env python3
+"""Run the SCI_Map processing steps as one dependency graph with cached outputs.
+
+Each step declares the files it reads and writes. A step's cache key is a hash
+of its command and parameters, the contents of its input files and the scripts
+it runs; after a successful run its declared outputs are copied into a
+content-addressed object store under ``<outdir>/.pipeline_cache``. On the next
+run a step whose key is unchanged is skipped if its outputs are intact, or has
+them restored from the store if they were deleted or overwritten, so only the
+steps downstream of a changed input are rerun. Switching a parameter back to
+an earlier value restores the earlier outputs without rerunning the step.
+
+The graph is::
+
+    recon_all (only with "rawdata")
+      -> freesurfer_table -> braincharts_sheet -> braincharts_split
+           -> braincharts_normative -> regional_comparisons
+         freesurfer_table -> pybrain_table -> pybrain_predict
+           -> brainpad_table -> brainpad_stats (only with "brainpad_metadata")
+      -> step8_tables
+    braincharts_sheet + step8_tables -> feature_store
+
+Independent branches, such as the BrainCharts track, the PyBrainAge track and
+the Step 8 tables, run at the same time, up to ``--jobs`` steps. A failed step
+stops only the steps that depend on it. Steps read their settings from a JSON
+config file; relative paths in it are resolved against the file's folder::
+
+    {
+      "outdir": "outputs",
+      "derivs": "/path/to/derivatives",
+      "metadata": "metadata.csv",
+      "braincharts_root": "/path/to/braincharts",
+      "normative_args": ["--engine", "batched", "--force-adaptation"]
+    }
+
+Usage::
+
+    python run_pipeline.py --config pipeline.json --jobs 3
+    python run_pipeline.py --config pipeline.json --dry-run
+    python run_pipeline.py --config pipeline.json --targets pybrain_predict --force pybrain_predict
+
+Each step's output is logged to ``<outdir>/logs/<step>.log``.
+"""
+
+from __future__ import annotations
+
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, TextIO
+
+
+HERE = Path(__file__).resolve().parent
+STEP3 = HERE / "Step_3_BrainCharts_Normative_Modeling"
+PYBRAIN = HERE / "Step_3_to_7_PyBrainAge"
+STEP8 = HERE / "Step_8_Data_Aggregation"
+CACHE_NAME = ".pipeline_cache"
+GLOB_CHARS = set("*?[")
+
+# Config key: default value; paths are resolved against the config file.
+CONFIG_DEFAULTS: dict[str, Any] = {
+    "outdir": None,
+    "derivs": None,
+    "metadata": None,
+    "braincharts_root": None,
+    "rawdata": None,
+    "recon_max_threads": 8,
+    "recon_max_jobs": None,
+    "t1_pattern": "*_T1w.nii.gz",
+    "parc": "aparc.a2009s",
+    "scan_jobs": os.cpu_count() or 1,
+    "dict": str(STEP3 / "keys_lifespan57K_82sites.csv"),
+    "adapt_fraction": 0.5,
+    "seed": 117,
+    "normative_args": [],
+    "pybrain_model": str(PYBRAIN / "software" / "ExtraTreesModel"),
+    "pybrain_scaler": str(PYBRAIN / "software" / "scaler.pkl"),
+    "pybrain_python": sys.executable,
+    "python": sys.executable,
+    "subject_col": "subject",
+    "age_col": "age",
+    "brainpad_metadata": None,
+    "brainpad_args": ["--no-plots"],
+    "step8_pattern": "sub-*",
+}
+PATH_KEYS = {"outdir", "derivs", "metadata", "braincharts_root", "rawdata", "dict", "pybrain_model", "pybrain_scaler", "brainpad_metadata"}
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Run the SCI_Map steps as a dependency graph with cached outputs.")
+    parser.add_argument("--config", required=True, help="JSON file with the pipeline paths and settings.")
+    parser.add_argument("--jobs", type=int, default=2, help="Steps run at the same time. Default: 2.")
+    parser.add_argument("--targets", nargs="+", help="Only run these steps and the steps they depend on. Default: all.")
+    parser.add_argument("--force", nargs="+", default=[], help="Rerun these steps even if their cache key is unchanged.")
+    parser.add_argument("--dry-run", action="store_true", help="Print which steps would run, restore or be skipped.")
+    args = parser.parse_args()
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    return args
+
+
+@dataclass
+class Step:
+    """One node of the graph: a command or Python function with declared inputs and outputs.
+
+    ``inputs`` are files or glob patterns whose contents go into the cache key;
+    ``code`` lists the scripts the step runs, which are hashed the same way.
+    A ``function`` step is called with its log file.
+    ``after`` names steps that must finish first but whose outputs are not
+    listed as inputs. ``discover`` returns more input files when the step is
+    about to run, for inputs a glob cannot describe. Outputs of a step with
+    ``store_outputs=False`` (the FreeSurfer subject folders) are only checked
+    for existence.
+    """
+
+    name: str
+    inputs: list[str]
+    outputs: list[str]
+    command: list[str] | None = None
+    function: Callable[[TextIO], None] | None = None
+    params: dict[str, Any] = field(default_factory=dict)
+    code: list[str] = field(default_factory=list)
+    after: list[str] = field(default_factory=list)
+    store_outputs: bool = True
+    discover: Callable[[], list[Path]] | None = None
+
+
+def load_config(path: Path) -> dict[str, Any]:
+    if not path.is_file():
+        raise SystemExit(f"Config not found: {path}")
+    values = json.loads(path.read_text(encoding="utf-8"))
+    unknown = sorted(set(values) - set(CONFIG_DEFAULTS))
+    if unknown:
+        raise SystemExit(f"Unknown config key(s) in {path}: {', '.join(unknown)}")
+    config = {**CONFIG_DEFAULTS, **values}
+    for key in PATH_KEYS:
+        if config[key] is not None:
+            config[key] = str((path.parent / os.path.expanduser(config[key])).resolve())
+    for key in ["outdir", "derivs"]:
+        if config[key] is None:
+            raise SystemExit(f"{path} must set {key!r}")
+    return config
+
+
+def merge_pybrain_table(features: Path, metadata: Path, output: Path, subject_col: str, age_col: str, log: TextIO = sys.stdout) -> None:
+    """ID, Age and the PyBrainAge features, with ages taken from the participant metadata."""
+    import pandas as pd
+
+    table = pd.read_csv(features, sep="\t", dtype={"ID": str})
+    ages = pd.read_csv(metadata, usecols=[subject_col, age_col], dtype={subject_col: str})
+    merged = table.merge(ages.rename(columns={subject_col: "ID", age_col: "Age"}), on="ID", how="inner")
+    dropped = len(table) - len(merged)
+    if merged.empty:
+        raise SystemExit(f"No subject of {features} has an age in {metadata}")
+    if dropped:
+        print(f"{dropped} subject(s) without an age in {metadata} left out", file=log)
+    columns = ["ID", "Age", *[name for name in table.columns if name != "ID"]]
+    merged[columns].to_csv(output, index=False)
+
+
+def merge_brainpad_table(predictions: Path, metadata: Path, output: Path, log: TextIO = sys.stdout) -> None:
+    """Predicted brain ages joined with the cohort, sex and clinical columns of the BrainPAD metadata."""
+    import pandas as pd
+
+    predicted = pd.read_csv(predictions, dtype={"ID": str})
+    clinical = pd.read_excel(metadata) if metadata.suffix.lower() in {".xlsx", ".xls"} else pd.read_csv(metadata)
+    if "ID" not in clinical.columns:
+        raise SystemExit(f"{metadata} needs an ID column")
+    clinical = clinical.astype({"ID": str}).drop(columns=[name for name in ["Age", "BrainAge", "BrainPAD"] if name in clinical])
+    merged = predicted.merge(clinical, on="ID", how="inner")
+    merged.to_csv(output, index=False)
+    print(f"{len(merged)} of {len(predicted)} predictions matched {metadata}", file=log)
+
+
+def freesurfer_stats_inputs(derivs: str, parc: str) -> Callable[[], list[Path]]:
+    """The stats files scan_freesurfer_stats.py reads, found the way it finds subjects (recursively, following links)."""
+
+    def discover() -> list[Path]:
+        sys.path.insert(0, str(STEP3))
+        from scan_freesurfer_stats import find_subjects, stats_files  # noqa: E402
+
+        return [
+            path
+            for subject_dir in find_subjects(Path(derivs)).values()
+            for path in stats_files(subject_dir, parc).values()
+            if path.is_file()
+        ]
+
+    return discover
+
+
+def build_steps(config: dict[str, Any]) -> list[Step]:
+    """The pipeline graph for ``config``; steps whose settings are missing are left out."""
+    out = Path(config["outdir"])
+    python = config["python"]
+    derivs = config["derivs"]
+    bc, pb, s8 = out / "braincharts", out / "pybrainage", out / "step8"
+    parc = config["parc"]
+    step3_code = [str(STEP3 / "*.py")]
+    recon_after = ["recon_all"] if config["rawdata"] else []
+
+    joined = bc / "_dbg_joined_all.csv"
+    features = pb / "pybrain_features.tsv"
+    sheet = bc / "braincharts_all_subjects.csv"
+    adaptation, test, report = bc / "braincharts_adaptation_controls.csv", bc / "braincharts_test.csv", bc / "braincharts_split_report.csv"
+    normative = bc / "braincharts_normative_outputs"
+    zscores = normative / "braincharts_zscores.csv"
+    pybrain_input, predicted = pb / "pybrain_input.csv", pb / "predicted_results.csv"
+    brainpad_input = pb / "brainpad_input.csv"
+    step8 = {name: s8 / f"{name}.csv" for name in ["dk_all_stats", "wm_volumes", "icv_data", "cortical_thickness"]}
+    store = out / "freesurfer_features.store"
+
+    steps = []
+    if config["rawdata"]:
+        steps.append(Step(
+            "recon_all",
+            inputs=[f"{config['rawdata']}/*/**/{config['t1_pattern']}"],
+            outputs=[derivs],
+            command=[python, str(HERE / "Step_1_Preprocessing" / "recon_all_scheduler.py"), "--rawdata", config["rawdata"],
+                     "--derivs", derivs, "--t1-pattern", config["t1_pattern"], "--max-threads", str(config["recon_max_threads"]),
+                     *(["--max-jobs", str(config["recon_max_jobs"])] if config["recon_max_jobs"] else [])],
+            code=[str(HERE / "Step_1_Preprocessing" / "recon_all_scheduler.py")],
+            store_outputs=False,
+        ))
+    steps.append(Step(
+        "freesurfer_table",
+        inputs=[],
+        outputs=[str(joined), str(features)],
+        command=[python, str(STEP3 / "scan_freesurfer_stats.py"), "--derivs", derivs, "--outdir", str(bc), "--parc", parc,
+                 "--jobs", str(config["scan_jobs"]), "--pybrain-out", str(features)],
+        code=[str(STEP3 / "scan_freesurfer_stats.py"), str(STEP8 / "freesurfer_stats.py")],
+        after=recon_after,
+        discover=freesurfer_stats_inputs(derivs, parc),
+    ))
+    if config["metadata"]:
+        steps.append(Step(
+            "braincharts_sheet",
+            inputs=[str(joined), config["dict"], config["metadata"]],
+            outputs=[str(sheet)],
+            command=["bash", str(STEP3 / "make_brainchart_outputs.sh"), "--joined", str(joined), "--dict", config["dict"],
+                     "--metadata", config["metadata"], "--outdir", str(bc)],
+            code=[str(STEP3 / "make_brainchart_outputs.sh"), *step3_code],
+        ))
+        steps.append(Step(
+            "braincharts_split",
+            inputs=[str(sheet)],
+            outputs=[str(adaptation), str(test), str(report)],
+            command=[python, str(STEP3 / "split_braincharts_adaptation_test.py"), "--input", str(sheet),
+                     "--adaptation-out", str(adaptation), "--test-out", str(test), "--report-out", str(report),
+                     "--adapt-fraction", str(config["adapt_fraction"]), "--seed", str(config["seed"])],
+            code=step3_code,
+        ))
+        steps.append(Step(
+            "pybrain_table",
+            inputs=[str(features), config["metadata"]],
+            outputs=[str(pybrain_input)],
+            function=lambda log: merge_pybrain_table(features, Path(config["metadata"]), pybrain_input, config["subject_col"], config["age_col"], log),
+            params={"subject_col": config["subject_col"], "age_col": config["age_col"]},
+            code=[str(Path(__file__).resolve())],
+        ))
+        steps.append(Step(
+            "pybrain_predict",
+            inputs=[str(pybrain_input), config["pybrain_model"], config["pybrain_scaler"]],
+            outputs=[str(predicted)],
+            command=[config["pybrain_python"], str(PYBRAIN / "predict.py"), "--input", str(pybrain_input),
+                     "--model", config["pybrain_model"], "--scaler", config["pybrain_scaler"], "--output", str(predicted)],
+            code=[str(PYBRAIN / "predict.py"), *step3_code],
+        ))
+    if config["metadata"] and config["braincharts_root"]:
+        root = config["braincharts_root"]
+        steps.append(Step(
+            "braincharts_normative",
+            inputs=[str(test), str(adaptation), f"{root}/docs/*.txt", f"{root}/models/*/*/Models/*"],
+            outputs=[str(zscores), str(normative / "braincharts_test_with_zscores.csv"), str(normative / "braincharts_zscore_summary.csv")],
+            command=[python, str(STEP3 / "run_braincharts_normative_models.py"), "--braincharts-root", root,
+                     "--test-csv", str(test), "--adaptation-csv", str(adaptation), "--output-dir", str(normative),
+                     *map(str, config["normative_args"])],
+            code=step3_code,
+        ))
+        steps.append(Step(
+            "regional_comparisons",
+            inputs=[str(zscores)],
+            outputs=[str(bc / "braincharts_region_comparisons.csv")],
+            command=[python, str(HERE / "regional_comparisons.py"), "--input", str(zscores),
+                     "--output", str(bc / "braincharts_region_comparisons.csv")],
+            code=[str(HERE / "regional_comparisons.py"), str(HERE / "brainpad_effects.py")],
+        ))
+    if config["metadata"] and config["brainpad_metadata"]:
+        steps.append(Step(
+            "brainpad_table",
+            inputs=[str(predicted), config["brainpad_metadata"]],
+            outputs=[str(brainpad_input)],
+            function=lambda log: merge_brainpad_table(predicted, Path(config["brainpad_metadata"]), brainpad_input, log),
+            code=[str(Path(__file__).resolve())],
+        ))
+        steps.append(Step(
+            "brainpad_stats",
+            inputs=[str(brainpad_input)],
+            outputs=[str(pb / "brainpad_stats" / "summary_statistics.csv")],
+            command=[python, str(HERE / "brainpadstats.py"), "--input", str(brainpad_input),
+                     "--output-dir", str(pb / "brainpad_stats"), *map(str, config["brainpad_args"])],
+            code=[str(HERE / "brainpad*.py")],
+        ))
+    steps.append(Step(
+        "step8_tables",
+        inputs=[f"{derivs}/{config['step8_pattern']}/stats/*.stats"],
+        outputs=[str(path) for path in step8.values()],
+        command=[python, str(STEP8 / "aggregate_freesurfer_stats.py"), "--derivs", derivs, "--outdir", str(s8),
+                 "--pattern", config["step8_pattern"], "--thickness-parc", parc],
+        code=[str(STEP8 / "*.py")],
+        after=recon_after,
+    ))
+    tables = ([str(sheet)] if config["metadata"] else []) + [str(step8[name]) for name in ["dk_all_stats", "wm_volumes", "icv_data"]]
+    steps.append(Step(
+        "feature_store",
+        inputs=tables,
+        outputs=[str(store / name) for name in ["values.npy", "subjects.npy", "subject_order.npy", "metadata.csv", "index.json"]],
+        command=[python, str(STEP3 / "feature_store.py"), "build", "--tables", *tables, "--output", str(store), "--dtype", "float64"],
+        code=[str(STEP3 / "feature_store.py")],
+    ))
+    return steps
+
+
+def dependencies(steps: list[Step]) -> dict[str, set[str]]:
+    """Upstream steps of each step: producers of its inputs plus its ``after`` list."""
+    producers = {output: step.name for step in steps for output in step.outputs}
+    names = {step.name for step in steps}
+    return {
+        step.name: {producers[path] for path in step.inputs if path in producers} | (set(step.after) & names)
+        for step in steps
+    }
+
+
+def select_steps(steps: list[Step], deps: dict[str, set[str]], targets: list[str] | None) -> list[Step]:
+    """``targets`` and everything they depend on, in declaration order."""
+    names = [step.name for step in steps]
+    if not targets:
+        return steps
+    unknown = [name for name in targets if name not in names]
+    if unknown:
+        raise SystemExit(f"Unknown step(s): {', '.join(unknown)}; steps are {', '.join(names)}")
+    wanted: set[str] = set()
+    pending = list(targets)
+    while pending:
+        name = pending.pop()
+        if name not in wanted:
+            wanted.add(name)
+            pending.extend(deps[name])
+    return [step for step in steps if step.name in wanted]
+
+
+class ContentStore:
+    """Content-addressed copies of step outputs and the manifest of each step's cache keys."""
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.objects = root / "objects"
+        self.manifests = root / "steps"
+        self.hashes_path = root / "file_hashes.json"
+        self._lock = threading.Lock()
+        self._hashes: dict[str, list[Any]] = {}
+        if self.hashes_path.is_file():
+            self._hashes = json.loads(self.hashes_path.read_text(encoding="utf-8"))
+
+    def file_hash(self, path: Path) -> str:
+        """SHA-256 of a file, remembered against its size and mtime so unchanged files are read once."""
+        stat = path.stat()
+        key = str(path)
+        with self._lock:
+            known = self._hashes.get(key)
+        if known and known[0] == stat.st_size and known[1] == stat.st_mtime_ns:
+            return known[2]
+        digest = hashlib.sha256()
+        with path.open("rb") as handle:
+            for block in iter(lambda: handle.read(1 << 20), b""):
+                digest.update(block)
+        with self._lock:
+            self._hashes[key] = [stat.st_size, stat.st_mtime_ns, digest.hexdigest()]
+        return digest.hexdigest()
+
+    def save_hashes(self) -> None:
+        self.root.mkdir(parents=True, exist_ok=True)
+        with self._lock:
+            text = json.dumps(self._hashes, sort_keys=True)
+        self.hashes_path.write_text(text, encoding="utf-8")
+
+    def object_path(self, digest: str) -> Path:
+        return self.objects / digest[:2] / digest[2:]
+
+    def put(self, path: Path) -> str:
+        digest = self.file_hash(path)
+        target = self.object_path(digest)
+        if not target.exists():
+            target.parent.mkdir(parents=True, exist_ok=True)
+            partial = target.with_name(target.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+            shutil.copyfile(path, partial)
+            os.replace(partial, target)
+        return digest
+
+    def restore(self, digest: str, path: Path) -> bool:
+        source = self.object_path(digest)
+        if not source.is_file():
+            return False
+        path.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copyfile(source, path)
+        return True
+
+    def manifest(self, step: str, key: str) -> dict[str, Any] | None:
+        path = self.manifests / step / f"{key}.json"
+        return json.loads(path.read_text(encoding="utf-8")) if path.is_file() else None
+
+    def write_manifest(self, step: str, key: str, manifest: dict[str, Any]) -> None:
+        folder = self.manifests / step
+        folder.mkdir(parents=True, exist_ok=True)
+        (folder / f"{key}.json").write_text(json.dumps(manifest, indent=1) + "\n", encoding="utf-8")
+
+
+def expand(pattern: str) -> list[Path]:
+    """Files named by a path or glob pattern, in sorted order; a directory stands for nothing."""
+    if not GLOB_CHARS & set(pattern):
+        path = Path(pattern)
+        return [path] if path.is_file() else []
+    anchor = Path(pattern)
+    parts = anchor.parts
+    first = next(number for number, part in enumerate(parts) if GLOB_CHARS & set(part))
+    base = Path(*parts[:first])
+    return sorted(path for path in base.glob(str(Path(*parts[first:]))) if path.is_file())
+
+
+def cache_key(step: Step, store: ContentStore, planned: dict[str, str] | None = None) -> str:
+    """Hash of the step's command, parameters and the contents of its inputs and code.
+
+    ``planned`` maps files an upstream step would restore to their digests; the
+    dry run uses it to key a step on the file it would see after the restore.
+    """
+    planned = planned or {}
+    digest = hashlib.sha256()
+    command = step.command if step.command is not None else [f"function:{step.name}"]
+    digest.update(json.dumps({"name": step.name, "command": command, "params": step.params, "outputs": step.outputs}, sort_keys=True).encode())
+    for pattern in [*step.inputs, *step.code]:
+        files = expand(pattern)
+        if not GLOB_CHARS & set(pattern) and str(Path(pattern)) in planned:
+            files = [Path(pattern)]
+        if not files and not GLOB_CHARS & set(pattern):
+            raise FileNotFoundError(f"Input of {step.name} not found: {pattern}")
+        digest.update(f"pattern:{pattern}:{len(files)};".encode())
+        for path in files:
+            digest.update(f"{path}={planned.get(str(path)) or store.file_hash(path)};".encode())
+    if step.discover is not None:
+        files = step.discover()
+        digest.update(f"discovered:{len(files)};".encode())
+        for path in files:
+            digest.update(f"{path}={store.file_hash(path)};".encode())
+    return digest.hexdigest()
+
+
+def cached_state(step: Step, key: str, store: ContentStore, forced: bool) -> str:
+    """``cached`` (outputs intact), ``restored`` (outputs recoverable from the store) or ``run``."""
+    manifest = None if forced else store.manifest(step.name, key)
+    if manifest is None:
+        return "run"
+    if not step.store_outputs:
+        return "cached" if all(Path(path).exists() for path in step.outputs) else "run"
+    state = "cached"
+    for path, digest in manifest["outputs"].items():
+        target = Path(path)
+        if target.is_file() and store.file_hash(target) == digest:
+            continue
+        if not store.object_path(digest).is_file():
+            return "run"
+        state = "restored"
+    return state
+
+
+def execute(step: Step, key: str, store: ContentStore, log_dir: Path, forced: bool) -> tuple[str, float]:
+    """Run, restore or skip one step; returns its state and the seconds it took."""
+    start = time.perf_counter()
+    state = cached_state(step, key, store, forced)
+    if state == "restored":
+        for path, digest in store.manifest(step.name, key)["outputs"].items():
+            target = Path(path)
+            if not (target.is_file() and store.file_hash(target) == digest):
+                store.restore(digest, target)
+    if state != "run":
+        return state, time.perf_counter() - start
+
+    for output in step.outputs:
+        Path(output).parent.mkdir(parents=True, exist_ok=True)
+    log_path = log_dir / f"{step.name}.log"
+    with log_path.open("w", encoding="utf-8") as log:
+        if step.command is not None:
+            log.write("$ " + " ".join(step.command) + "\n")
+            log.flush()
+            result = subprocess.run(step.command, cwd=HERE, stdout=log, stderr=subprocess.STDOUT)
+            if result.returncode != 0:
+                raise RuntimeError(f"exited with status {result.returncode}; see {log_path}")
+        else:
+            step.function(log)
+    missing = [path for path in step.outputs if not Path(path).exists()]
+    if missing:
+        raise RuntimeError(f"did not write {', '.join(missing)}; see {log_path}")
+    outputs = {path: store.put(Path(path)) for path in step.outputs} if step.store_outputs else {}
+    store.write_manifest(step.name, key, {"step": step.name, "created": time.time(), "outputs": outputs})
+    return "ran", time.perf_counter() - start
+
+
+def run_graph(steps: list[Step], deps: dict[str, set[str]], store: ContentStore, log_dir: Path, jobs: int, force: set[str]) -> dict[str, str]:
+    """Run the steps as their dependencies finish, up to ``jobs`` at a time; returns each step's outcome."""
+    outcome: dict[str, str] = {}
+    pending = {step.name: step for step in steps}
+    deps = {step.name: deps[step.name] & set(pending) for step in steps}
+    log_dir.mkdir(parents=True, exist_ok=True)
+
+    def launch(step: Step) -> tuple[str, float]:
+        key = cache_key(step, store)
+        return execute(step, key, store, log_dir, step.name in force)
+
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        running = {}
+        while pending or running:
+            for name, step in list(pending.items()):
+                if any(outcome.get(dep) == "failed" or outcome.get(dep) == "blocked" for dep in deps[name]):
+                    outcome[name] = "blocked"
+                    print(f"[{name}] not run: an upstream step failed")
+                    del pending[name]
+                elif all(dep in outcome for dep in deps[name]):
+                    print(f"[{name}] started")
+                    running[pool.submit(launch, step)] = name
+                    del pending[name]
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    state, seconds = future.result()
+                except (Exception, SystemExit) as exc:  # noqa: BLE001 - report the failure and let independent steps finish
+                    outcome[name] = "failed"
+                    print(f"[{name}] failed: {exc}")
+                    continue
+                outcome[name] = state
+                print(f"[{name}] {state} in {seconds:.1f} s")
+    store.save_hashes()
+    return outcome
+
+
+def dry_run(steps: list[Step], deps: dict[str, set[str]], store: ContentStore, force: set[str]) -> None:
+    """Print each step's cache state; steps downstream of one that would run are marked stale.
+
+    Outputs an upstream step would restore count as present, keyed on their
+    stored digests, as they will be in the real run.
+    """
+    stale: set[str] = set()
+    planned: dict[str, str] = {}
+    for step in steps:
+        reason = ""
+        if deps[step.name] & stale:
+            state, reason = "run", f"upstream {', '.join(sorted(deps[step.name] & stale))} will run"
+        else:
+            try:
+                key = cache_key(step, store, planned)
+                state = cached_state(step, key, store, step.name in force)
+            except FileNotFoundError as exc:
+                state, reason = "run", str(exc)
+            if state == "run" and step.name in force:
+                reason = "forced"
+            elif state == "restored":
+                planned.update(store.manifest(step.name, key)["outputs"])
+        if state == "run":
+            stale.add(step.name)
+        upstream = ", ".join(sorted(deps[step.name])) or "-"
+        print(f"{step.name:<24}{state:<10}after: {upstream}")
+        if reason:
+            print(f"{'':<24}  {reason}")
+
+
+def main() -> None:
+    args = parse_args()
+    config = load_config(Path(args.config).resolve())
+    steps = build_steps(config)
+    deps = dependencies(steps)
+    names = {step.name for step in steps}
+    unknown = sorted(set(args.force) - names)
+    if unknown:
+        raise SystemExit(f"Unknown step(s) in --force: {', '.join(unknown)}")
+    steps = select_steps(steps, deps, args.targets)
+    outdir = Path(config["outdir"])
+    store = ContentStore(outdir / CACHE_NAME)
+    if args.dry_run:
+        dry_run(steps, deps, store, set(args.force))
+        return
+
+    outcome = run_graph(steps, deps, store, outdir / "logs", args.jobs, set(args.force))
+    failed = sorted(name for name, state in outcome.items() if state in {"failed", "blocked"})
+    counts = {state: sum(value == state for value in outcome.values()) for state in ["ran", "restored", "cached"]}
+    print(f"Ran {counts['ran']}, restored {counts['restored']}, reused {counts['cached']} of {len(outcome)} step(s)")
+    if failed:
+        raise SystemExit(f"{len(failed)} step(s) did not complete: {', '.join(failed)}")
+
+
+if __name__ == "__main__":
+    main()